@@ -157,7 +157,7 @@ class ErroAdmin(admin.ModelAdmin):
 
 
 class ChangeNotificaionAdmin(admin.ModelAdmin):
-    list_display = ('model_type', 'model_pk', 'get_link', 'date')
+    list_display = ('model_type', 'model_pk', 'action', 'get_link', 'date')
     ordering = ('-date',)
     actions = None
     list_display_links = None
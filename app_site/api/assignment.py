@@ -0,0 +1,195 @@
+"""
+    Batch assignment of open collects (ABERTA) to available catadores.
+
+    The collect x catador cost matrix (haversine km) is computed in chunks
+    with numpy, pairs are masked by materials (the catador must collect every
+    material of the residue) and by distance, and only the best candidates
+    of each collect are kept. A greedy pass over the candidate pairs, cheapest
+    first, then assigns collects while the catadores have capacity left.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .calc_distance import chunk_rows, haversine_km
+from .heatmap import record_collects
+from .spatial_index import load_catador_positions
+
+DEFAULT_CAPACITY = 3
+MAX_DISTANCE_KM = 10.0
+CANDIDATES_PER_COLLECT = 8
+
+
+def material_matrix(owner_ids, pairs, material_index):
+    """
+    Boolean (owners x materials) matrix from (owner_id, material_id) pairs.
+    """
+    rows = dict((owner_id, i) for i, owner_id in enumerate(owner_ids))
+    matrix = np.zeros((len(owner_ids), len(material_index)), dtype=bool)
+    for owner_id, material_id in pairs:
+        if owner_id in rows:
+            matrix[rows[owner_id], material_index[material_id]] = True
+    return matrix
+
+
+def load_problem(capacity=DEFAULT_CAPACITY):
+    from .models import Catador, Collect, Residue
+
+    collects = list(Collect.objects.filter(
+        status=Collect.ABERTA, active=True, catador__isnull=True,
+        residue__georefresidue__isnull=False).values_list(
+            'pk', 'residue_id',
+            'residue__georefresidue__georef__latitude',
+            'residue__georefresidue__georef__longitude'))
+
+    positions = load_catador_positions()
+
+    busy = dict(Collect.objects.filter(status=Collect.ACEITA, active=True)
+                .values_list('catador_id').annotate(n=Count('id')))
+    catador_ids = [catador_id for catador_id in positions
+                   if busy.get(catador_id, 0) < capacity]
+
+    residue_materials = list(Residue.materials.through.objects.filter(
+        residue__collect__status=Collect.ABERTA,
+        residue__collect__catador__isnull=True).values_list(
+            'residue_id', 'material_id').distinct())
+    catador_materials = list(Catador.materials_collected.through.objects
+                             .values_list('catador_id', 'material_id'))
+
+    material_ids = sorted(set(m for r, m in residue_materials) |
+                          set(m for c, m in catador_materials))
+    material_index = dict((m, i) for i, m in enumerate(material_ids))
+
+    residue_ids = [row[1] for row in collects]
+    return {
+        'collect_ids': np.array([row[0] for row in collects], dtype=np.int64),
+        'collect_coords': np.array([row[2:] for row in collects],
+                                   dtype=np.float64).reshape(-1, 2),
+        'collect_materials': material_matrix(residue_ids, residue_materials,
+                                             material_index),
+        'catador_ids': np.array(catador_ids, dtype=np.int64),
+        'catador_coords': np.array([positions[c] for c in catador_ids],
+                                   dtype=np.float64).reshape(-1, 2),
+        'catador_materials': material_matrix(catador_ids, catador_materials,
+                                             material_index),
+        'capacity': np.array([capacity - busy.get(c, 0) for c in catador_ids],
+                             dtype=np.int64),
+    }
+
+
+def solve(problem, max_distance_km=MAX_DISTANCE_KM,
+          candidates=CANDIDATES_PER_COLLECT, chunk_size=None):
+    """
+    Returns {collect_id: (catador_id, distance_km)}. The collect x catador
+    matrices are computed `chunk_size` collects at a time, by default as
+    many as fit the memory budget (see calc_distance.chunk_rows).
+    """
+    collect_ids = problem['collect_ids']
+    catador_ids = problem['catador_ids']
+    n_catadores = len(catador_ids)
+
+    if not len(collect_ids) or not n_catadores:
+        return {}
+
+    lats = problem['catador_coords'][:, 0]
+    lons = problem['catador_coords'][:, 1]
+    # Materials each catador does NOT collect
+    missing = (~problem['catador_materials']).astype(np.int32).T
+    m = min(candidates, n_catadores)
+    chunk_size = chunk_size or chunk_rows(n_catadores)
+
+    pair_collect = []
+    pair_catador = []
+    pair_cost = []
+
+    for start in range(0, len(collect_ids), chunk_size):
+        coords = problem['collect_coords'][start:start + chunk_size]
+        wanted = problem['collect_materials'][start:start + chunk_size]
+
+        cost = haversine_km(coords[:, 0:1], coords[:, 1:2], lats, lons)
+        incompatible = wanted.astype(np.int32).dot(missing) > 0
+        cost[incompatible | (cost > max_distance_km)] = np.inf
+
+        if m < n_catadores:
+            best = np.argpartition(cost, m - 1, axis=1)[:, :m]
+        else:
+            best = np.tile(np.arange(n_catadores), (len(coords), 1))
+
+        rows = np.arange(len(coords))[:, None]
+        best_cost = cost[rows, best]
+        feasible = np.isfinite(best_cost)
+
+        pair_collect.append(np.broadcast_to(rows + start, best.shape)[feasible])
+        pair_catador.append(best[feasible])
+        pair_cost.append(best_cost[feasible])
+
+    pair_collect = np.concatenate(pair_collect)
+    pair_catador = np.concatenate(pair_catador)
+    pair_cost = np.concatenate(pair_cost)
+
+    capacity = problem['capacity'].copy()
+    assigned = np.zeros(len(collect_ids), dtype=bool)
+    result = {}
+
+    for i in np.argsort(pair_cost, kind='mergesort'):
+        collect, catador = pair_collect[i], pair_catador[i]
+        if assigned[collect] or capacity[catador] <= 0:
+            continue
+
+        assigned[collect] = True
+        capacity[catador] -= 1
+        result[int(collect_ids[collect])] = (int(catador_ids[catador]),
+                                             float(pair_cost[i]))
+
+    return result
+
+
+def save_assignment(assignment):
+    """
+    Write the assignment in one transaction, one UPDATE per catador. Collects
+    taken by hand in the meantime are left alone. Returns the number of
+    collects assigned.
+    """
+    from .models import Catador, Collect, touch
+
+    by_catador = {}
+    for collect_id, (catador_id, distance) in assignment.items():
+        by_catador.setdefault(catador_id, []).append(collect_id)
+
+    now = timezone.now()
+    updated = 0
+
+    with transaction.atomic():
+        for catador_id, collect_ids in by_catador.items():
+            pending = Collect.objects.filter(
+                pk__in=collect_ids, status=Collect.ABERTA,
+                catador__isnull=True)
+            # Lock the rows still open, so only those reach the heatmap
+            collect_ids = list(pending.select_for_update()
+                               .values_list('pk', flat=True))
+            updated += Collect.objects.filter(pk__in=collect_ids).update(
+                catador_id=catador_id, status=Collect.ACEITA,
+                modified_date=now)
+            record_collects(collect_ids, Collect.ACEITA)
+
+        # The bulk UPDATEs skip the Collect signals: move the catadores'
+        # validators, drop their cached details and log them for the sync
+        if by_catador:
+            touch(Catador, pk__in=list(by_catador))
+
+    return updated
+
+
+def assign_open_collects(capacity=DEFAULT_CAPACITY,
+                         max_distance_km=MAX_DISTANCE_KM, dry_run=False):
+    problem = load_problem(capacity)
+    assignment = solve(problem, max_distance_km)
+    saved = 0 if dry_run else save_assignment(assignment)
+
+    return {
+        'open_collects': len(problem['collect_ids']),
+        'available_catadores': len(problem['catador_ids']),
+        'assigned': len(assignment),
+        'saved': saved,
+    }
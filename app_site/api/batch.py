@@ -0,0 +1,171 @@
+"""
+    Ordered list of write operations run in one transaction, so the app
+    registers a residue (residue, location, photos) in a single request.
+
+    Operations:
+
+        {"op": "residue", "id": "<temp id>", "data": {description, quantity,
+            materials: [<material pk>...]}}
+        {"op": "georef", "residue": <ref>, "data": {latitude, longitude}}
+        {"op": "photo", "residue": <ref>, "data": {full_photo: <base64>}}
+        {"op": "materials", "residue": <ref>, "data": [<material pk>...]}
+
+    A <ref> is either the temp id of a residue created earlier in the batch
+    (a string that is not a number) or the pk of a residue of the user.
+    Photos and materials are stored with bulk inserts after every other
+    operation succeeded; any error rolls the whole batch back and is
+    answered with the index of the failed operation (BatchError).
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+from .models import GeorefResidue, LatitudeLongitude, Material
+from .models import PhotoResidue, Residue
+from .serializers import ResidueSerializer
+
+OPERATIONS = ('residue', 'georef', 'photo', 'materials')
+
+
+class BatchError(Exception):
+    """
+        Invalid operation: the view answers 400 with {"index", "detail"}.
+    """
+
+    def __init__(self, index, detail):
+        super(BatchError, self).__init__(index, detail)
+        self.index = index
+        self.detail = detail
+
+
+def batch_error(index, detail):
+    return BatchError(index, detail)
+
+
+class Batch(object):
+
+    def __init__(self, request):
+        self.request = request
+        self.ids = {}
+        self.residues = {}
+        self.photos = []
+        self.materials = {}
+
+    def run(self, operations):
+        max_operations = getattr(settings, 'BATCH_MAX_OPERATIONS', 100)
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError(_('operations deve ser uma lista'))
+        if len(operations) > max_operations:
+            raise ValidationError(
+                _('No máximo %d operações por requisição') % max_operations)
+
+        with transaction.atomic():
+            for index, operation in enumerate(operations):
+                if not isinstance(operation, dict) or \
+                        operation.get('op') not in OPERATIONS:
+                    raise batch_error(index, _('Operação inválida'))
+                getattr(self, 'do_' + operation['op'])(index, operation)
+
+            self.save_materials()
+            PhotoResidue.objects.bulk_create(self.photos)
+
+        return {
+            'ids': self.ids,
+            'residues': ResidueSerializer(
+                ResidueSerializer.setup_eager_loading(
+                    Residue.objects.filter(pk__in=self.residues)
+                    .order_by('pk')),
+                many=True, context={'request': self.request}).data,
+        }
+
+    def residue(self, index, ref):
+        if isinstance(ref, str) and ref in self.ids:
+            return self.residues[self.ids[ref]]
+
+        try:
+            residue = Residue.objects.get(pk=int(ref), user=self.request.user)
+        except (TypeError, ValueError, Residue.DoesNotExist):
+            raise batch_error(index, _('Resíduo %s não encontrado') % ref)
+
+        self.residues[residue.pk] = residue
+        return residue
+
+    def material_ids(self, index, ids):
+        try:
+            ids = set(int(pk) for pk in ids)
+        except (TypeError, ValueError):
+            raise batch_error(index, _('materials deve ser uma lista de ids'))
+
+        if Material.objects.filter(pk__in=ids).count() != len(ids):
+            raise batch_error(index, _('Material não encontrado'))
+        return ids
+
+    def do_residue(self, index, operation):
+        temp_id = operation.get('id')
+        if not isinstance(temp_id, str) or temp_id in self.ids:
+            raise batch_error(index, _('id temporário ausente ou repetido'))
+        if temp_id.strip().lstrip('+-').isdigit():
+            # It would be taken for the pk of an existing residue
+            raise batch_error(index, _('id temporário não pode ser um número'))
+
+        data = dict(operation.get('data') or {})
+        materials = self.material_ids(index, data.pop('materials', []))
+
+        serializer = ResidueSerializer(data=data,
+                                       context={'request': self.request})
+        if not serializer.is_valid():
+            raise batch_error(index, serializer.errors)
+        residue = serializer.save()
+
+        self.ids[temp_id] = residue.pk
+        self.residues[residue.pk] = residue
+        self.materials.setdefault(residue.pk, set()).update(materials)
+
+    def do_georef(self, index, operation):
+        residue = self.residue(index, operation.get('residue'))
+        data = operation.get('data') or {}
+
+        try:
+            latitude = float(data['latitude'])
+            longitude = float(data['longitude'])
+        except (KeyError, TypeError, ValueError):
+            raise batch_error(index, _('latitude e longitude são obrigatórios'))
+
+        if GeorefResidue.objects.filter(residue=residue).exists():
+            raise batch_error(index, _('O resíduo já tem localização'))
+
+        georef = LatitudeLongitude.objects.create(latitude=latitude,
+                                                  longitude=longitude)
+        GeorefResidue.objects.create(georef=georef, residue=residue)
+
+    def do_photo(self, index, operation):
+        from .views import base64ToFile
+
+        residue = self.residue(index, operation.get('residue'))
+        data = operation.get('data') or {}
+        try:
+            if not isinstance(data.get('full_photo'), str):
+                raise TypeError(data.get('full_photo'))
+            photo = base64ToFile(data['full_photo'])
+        except (AttributeError, TypeError, ValueError):
+            raise batch_error(index, _('full_photo deve ser uma imagem base64'))
+
+        self.photos.append(PhotoResidue(author=self.request.user,
+                                        residue=residue, full_photo=photo))
+
+    def do_materials(self, index, operation):
+        residue = self.residue(index, operation.get('residue'))
+        materials = self.material_ids(index, operation.get('data') or [])
+        self.materials.setdefault(residue.pk, set()).update(materials)
+
+    def save_materials(self):
+        through = Residue.materials.through
+        existing = set(through.objects.filter(residue_id__in=self.materials)
+                       .values_list('residue_id', 'material_id'))
+
+        through.objects.bulk_create([
+            through(residue_id=residue_id, material_id=material_id)
+            for residue_id, materials in sorted(self.materials.items())
+            for material_id in sorted(materials)
+            if (residue_id, material_id) not in existing])
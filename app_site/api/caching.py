@@ -0,0 +1,187 @@
+"""
+    Response cache for endpoints that rarely change.
+
+    Every cached model (or single object) has a version counter in the
+    Django cache (settings.RESPONSE_CACHE), bumped by signals. Responses are
+    stored under the current versions, first in an in-process LRU and then
+    in the Django cache, so in steady state a request only reads the version
+    counters. Concurrent misses of the same key in a process are coalesced,
+    so an expensive response is built once. The counters have to be seen by
+    every process: on a per-process backend (local memory, dummy) responses
+    are not cached at all.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class LRUCache(object):
+    """
+        Thread-safe LRU of at most `max_size` entries, each kept for
+        `timeout` seconds (forever when None) unless set() gives its own.
+    """
+
+    def __init__(self, max_size, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            expires, value = self._data[key]
+            if expires is not None and expires <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        expires = None if timeout is None else time.time() + timeout
+
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+response_cache = LRUCache(getattr(settings, 'RESPONSE_CACHE_SIZE', 1000),
+                          getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 3600))
+
+
+def cache_alias():
+    return getattr(settings, 'RESPONSE_CACHE', 'default')
+
+
+def get_cache():
+    return caches[cache_alias()]
+
+
+def is_shared():
+    return settings.CACHES[cache_alias()]['BACKEND'] not in LOCAL_BACKENDS
+
+
+def version_key(model, pk=None):
+    if pk is None:
+        return 'model_version:%s' % model._meta.label_lower
+    return 'object_version:%s:%s' % (model._meta.label_lower, pk)
+
+
+def new_version():
+    # Versions lost by the cache restart from the clock, never from 1, so
+    # they never match a response stored under an older counter
+    return int(time.time() * 1000)
+
+
+def get_version(model, pk=None):
+    cache = get_cache()
+    key = version_key(model, pk)
+
+    version = cache.get(key)
+    if version is None:
+        version = new_version()
+        if not cache.add(key, version, None):
+            version = cache.get(key, version)
+    return version
+
+
+def bump_version(model, pk=None):
+    cache = get_cache()
+    key = version_key(model, pk)
+
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = new_version()
+        cache.set(key, version, None)
+        return version
+
+
+def invalidate(model, pk=None):
+    bump_version(model, pk)
+    # A response built from the old rows before the commit may have been
+    # stored under the new version
+    transaction.on_commit(lambda: bump_version(model, pk))
+
+
+def model_changed(sender, **kwargs):
+    if kwargs.get('raw', False):
+        return
+    invalidate(sender)
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def single_flight(key, build, timeout=30):
+    """
+    Run build() once for concurrent callers of the same key: the first
+    caller builds, the others wait for its result.
+    """
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = {'done': threading.Event()}
+
+    if not leader:
+        flight['done'].wait(timeout)
+        if 'result' in flight:
+            return flight['result']
+        # The leader failed or is too slow
+        return build()
+
+    try:
+        flight['result'] = build()
+        return flight['result']
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight['done'].set()
+
+
+def cached_data(key, build):
+    """
+    (data, status) stored under `key`, or build() when missing.
+    """
+    if not is_shared():
+        return build()
+
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    def load():
+        cache = get_cache()
+        cached = cache.get(key)
+        if cached is None:
+            cached = build()
+            if cached[1] == 200:
+                cache.set(key, cached,
+                          getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 3600))
+
+        if cached[1] == 200:
+            response_cache.set(key, cached)
+        return cached
+
+    return single_flight(key, load)
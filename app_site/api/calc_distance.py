@@ -1,4 +1,10 @@
 import geopy.distance
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+# Matrices of the chunk size alive at once while computing distances
+MATRIX_TEMPORARIES = 6
+
 # your data
 
 list = [
@@ -27,16 +33,143 @@ def nearest_point_test(coordinate, coordinate_list):
     return min(alldist, key=lambda x: (x[1]))[0]
 
 
-def nearest_catadores(coord_residue, catador_list):
-    catadores = {}
-    for p in catador_list:
-        catadores[p.catador.id] = geopy.Point(p.georef.latitude, p.georef.longitude)
+def haversine_km(lat, lon, lats, lons):
+    """
+    Great-circle distance (km) from one point to every point of the
+    `lats`/`lons` arrays, computed in a single batched operation.
+    """
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+    lat2 = np.radians(lats)
+    lon2 = np.radians(lons)
+
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    (min_lat, max_lat, min_lon, max_lon) of a box that contains the circle
+    of `radius_km` around (lat, lon). Used to pre-filter rows with an
+    indexed range query before any exact distance math.
+    """
+    delta_lat = np.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(lat - delta_lat, -90.0)
+    max_lat = min(lat + delta_lat, 90.0)
+
+    cos_lat = np.cos(np.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat < 1e-6:
+        return min_lat, max_lat, -180.0, 180.0
+
+    delta_lon = min(np.degrees(radius_km / (EARTH_RADIUS_KM * cos_lat)), 180.0)
+    return min_lat, max_lat, lon - delta_lon, lon + delta_lon
+
+
+def load_positions(catador_list):
+    """
+    Load catador positions into contiguous arrays (ids, lats, lons).
+
+    Accepts a CatadorLastPosition or GeorefCatador queryset (read with a
+    single values_list query) or any iterable of GeorefCatador objects. As
+    before, a catador with more than one georef keeps the last one.
+    """
+    if hasattr(catador_list, 'values_list'):
+        prefix = 'georef__' if hasattr(catador_list.model, 'georef') else ''
+        rows = catador_list.values_list(
+            'catador_id', prefix + 'latitude', prefix + 'longitude')
+    else:
+        rows = ((p.catador_id, p.georef.latitude, p.georef.longitude)
+                for p in catador_list)
+
+    positions = {}
+    for catador_id, latitude, longitude in rows:
+        if latitude is None or longitude is None:
+            continue
+        positions[catador_id] = (latitude, longitude)
+
+    ids = np.fromiter(positions.keys(), dtype=np.int64, count=len(positions))
+    coords = np.array(list(positions.values()), dtype=np.float64)
+    coords = coords.reshape(-1, 2)
+
+    return ids, np.ascontiguousarray(coords[:, 0]), \
+        np.ascontiguousarray(coords[:, 1])
+
+
+def k_nearest(coord, ids, lats, lons, k=3):
+    """
+    Return [(id, distance_km), ...] of the k nearest positions, ordered by
+    distance. Uses a partial selection, so only the k winners are sorted.
+    """
+    if k <= 0 or not len(ids):
+        return []
+
+    dist = haversine_km(coord[0], coord[1], lats, lons)
+
+    if k < len(dist):
+        idx = np.argpartition(dist, k - 1)[:k]
+    else:
+        idx = np.arange(len(dist))
+    idx = idx[np.argsort(dist[idx], kind='mergesort')]
+
+    return [(int(ids[i]), float(dist[i])) for i in idx]
+
+
+def chunk_rows(n_columns, budget_mb=None):
+    """
+    Rows of a (rows x n_columns) distance matrix chunk whose computation
+    fits in settings.DISTANCE_MATRIX_BUDGET_MB, at least one.
+    """
+    from django.conf import settings
+
+    if budget_mb is None:
+        budget_mb = getattr(settings, 'DISTANCE_MATRIX_BUDGET_MB', 64)
+    # haversine_km keeps a few float64 temporaries of the matrix size
+    row_bytes = max(n_columns, 1) * 8 * MATRIX_TEMPORARIES
+    return max(int(budget_mb * 1024 * 1024 // row_bytes), 1)
+
+
+def batch_k_nearest(points, ids, lats, lons, k=3, chunk_size=None):
+    """
+    k nearest positions for many points at once. The point x position
+    distance matrix is computed in chunks of `chunk_size` rows (sized from
+    the number of positions by default) to bound memory. Returns one
+    [(id, distance_km), ...] list per point.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    n = len(ids)
+    k = min(k, n)
+
+    if k <= 0:
+        return [[] for p in points]
+
+    chunk_size = chunk_size or chunk_rows(n)
+
+    result = []
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        dist = haversine_km(chunk[:, 0:1], chunk[:, 1:2], lats, lons)
+
+        if k < n:
+            idx = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        else:
+            idx = np.tile(np.arange(n), (len(chunk), 1))
+
+        rows = np.arange(len(chunk))[:, None]
+        best = dist[rows, idx]
+        order = np.argsort(best, axis=1, kind='mergesort')
+        idx = idx[rows, order]
+        best = best[rows, order]
+
+        for row_ids, row_dist in zip(ids[idx], best):
+            result.append([(int(i), float(d)) for i, d in zip(row_ids, row_dist)])
+
+    return result
 
-    onept = geopy.Point(coord_residue[0], coord_residue[1])
 
-    alldist = [(cat, geopy.distance.distance(p, onept).km)
-               for cat, p in zip(catadores.keys(), catadores.values())]
-    return [i[0] for i in sorted(alldist, key=lambda tup: tup[1])[0:3]]
+def nearest_catadores(coord_residue, catador_list, k=3):
+    ids, lats, lons = load_positions(catador_list)
+    return [cat for cat, dist in k_nearest(coord_residue, ids, lats, lons, k)]
 
 # point = nearest_point_test(coord, list)
 # print(str(point.latitude) + ' - ' + str(point.longitude))
@@ -0,0 +1,185 @@
+import math
+import threading
+import time
+
+from django.conf import settings
+
+from .spatial_index import load_catador_positions, register_position_index
+
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+MAX_MERCATOR_LAT = 85.05112878
+
+
+def mercator_xy(latitude, longitude):
+    """
+    Web mercator position normalized to [0, 1) on both axes (y grows south),
+    the same projection used by the map tiles.
+    """
+    lat = max(min(latitude, MAX_MERCATOR_LAT), -MAX_MERCATOR_LAT)
+    x = (longitude + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return min(max(x, 0.0), 1.0 - 1e-12), min(max(y, 0.0), 1.0 - 1e-12)
+
+
+class GridClusterIndex(object):
+    """
+        Hierarchical grid clustering of catador positions.
+
+        Every zoom level keeps a dict of grid cells, each cell with the number
+        of points, the sum of their coordinates (for the centroid) and the sum
+        of their ids (which is the id itself when the cell has a single
+        point). A tile at zoom `z` is split in `cells_per_tile` x
+        `cells_per_tile` cells, so clusters keep the same size on screen.
+
+        Adding, moving or removing a point touches one cell per zoom level.
+        Like CatadorSpatialIndex it is built lazily and reloaded from the
+        database after `max_age` seconds.
+    """
+
+    def __init__(self, loader=load_catador_positions, min_zoom=MIN_ZOOM,
+                 max_zoom=MAX_ZOOM, cells_per_tile=4, max_age=None):
+        self.loader = loader
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cells_per_tile = cells_per_tile
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self.reset()
+
+    @property
+    def built(self):
+        return self._positions is not None
+
+    def reset(self):
+        with self._lock:
+            self._positions = None
+            self._built_on = None
+            self._levels = {}
+
+    def _grid_size(self, zoom):
+        return (2 ** zoom) * self.cells_per_tile
+
+    def _get_max_age(self):
+        if self.max_age is not None:
+            return self.max_age
+        return getattr(settings, 'SPATIAL_INDEX_MAX_AGE', 300)
+
+    def _ensure_built(self):
+        max_age = self._get_max_age()
+        expired = self._built_on is not None and max_age and \
+            time.time() - self._built_on > max_age
+
+        if not self.built or expired:
+            self._levels = dict((zoom, {}) for zoom in
+                                range(self.min_zoom, self.max_zoom + 1))
+            self._positions = {}
+            self._built_on = time.time()
+
+            for point_id, (lat, lon) in self.loader().items():
+                self._add(point_id, lat, lon)
+
+    def _add(self, point_id, latitude, longitude):
+        x, y = mercator_xy(latitude, longitude)
+        self._positions[point_id] = (latitude, longitude)
+
+        for zoom, cells in self._levels.items():
+            size = self._grid_size(zoom)
+            key = (int(x * size), int(y * size))
+            cell = cells.get(key)
+            if cell is None:
+                cells[key] = [1, latitude, longitude, point_id]
+            else:
+                cell[0] += 1
+                cell[1] += latitude
+                cell[2] += longitude
+                cell[3] += point_id
+
+    def _remove(self, point_id):
+        position = self._positions.pop(point_id, None)
+        if position is None:
+            return
+
+        latitude, longitude = position
+        x, y = mercator_xy(latitude, longitude)
+
+        for zoom, cells in self._levels.items():
+            size = self._grid_size(zoom)
+            key = (int(x * size), int(y * size))
+            cell = cells[key]
+            if cell[0] == 1:
+                del cells[key]
+            else:
+                cell[0] -= 1
+                cell[1] -= latitude
+                cell[2] -= longitude
+                cell[3] -= point_id
+
+    def update(self, point_id, latitude, longitude):
+        with self._lock:
+            if not self.built:
+                return
+            self._remove(point_id)
+            self._add(point_id, latitude, longitude)
+
+    def remove(self, point_id):
+        with self._lock:
+            if not self.built:
+                return
+            self._remove(point_id)
+
+    def clusters(self, zoom, bbox=None):
+        """
+        Clusters at `zoom` inside bbox (min_lon, min_lat, max_lon, max_lat).
+        A bbox with min_lon > max_lon crosses the antimeridian. Single points
+        come back with their id.
+        """
+        with self._lock:
+            self._ensure_built()
+
+            zoom = max(self.min_zoom, min(self.max_zoom, int(zoom)))
+            cells = self._levels[zoom]
+            size = self._grid_size(zoom)
+
+            if bbox is None:
+                keys = list(cells.keys())
+            else:
+                min_lon, min_lat, max_lon, max_lat = bbox
+                x0, y0 = mercator_xy(max_lat, min_lon)
+                x1, y1 = mercator_xy(min_lat, max_lon)
+                x0, x1 = int(x0 * size), int(x1 * size)
+                y0, y1 = int(y0 * size), int(y1 * size)
+
+                if min_lon > max_lon:
+                    x_ranges = [(x0, size - 1), (0, x1)]
+                else:
+                    x_ranges = [(x0, x1)]
+
+                width = sum(x_max - x_min + 1 for x_min, x_max in x_ranges)
+                if width * (y1 - y0 + 1) < len(cells):
+                    keys = [(x, y) for x_min, x_max in x_ranges
+                            for x in range(x_min, x_max + 1)
+                            for y in range(y0, y1 + 1) if (x, y) in cells]
+                else:
+                    keys = [key for key in cells
+                            if y0 <= key[1] <= y1 and
+                            any(x_min <= key[0] <= x_max
+                                for x_min, x_max in x_ranges)]
+
+            result = []
+            for key in keys:
+                count, sum_lat, sum_lon, sum_ids = cells[key]
+                cluster = {
+                    'latitude': sum_lat / count,
+                    'longitude': sum_lon / count,
+                    'count': count,
+                }
+                if count == 1:
+                    cluster['id'] = sum_ids
+                result.append(cluster)
+
+            return result
+
+
+catador_clusters = register_position_index(GridClusterIndex())
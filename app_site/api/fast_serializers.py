@@ -0,0 +1,114 @@
+"""
+    Read-only serializers for the hot list endpoints.
+
+    They build the response dicts straight from .values_list() rows with one
+    converter per field, chosen when the serializer is created, instead of
+    going through the DRF field machinery for every value of every row. The
+    output matches the ModelSerializer of the same endpoint, so the rendered
+    JSON is byte for byte the same (see tests_fast_serializers.py).
+"""
+from collections import OrderedDict
+
+from rest_framework import serializers
+
+from .models import CatadorLastPosition, GeorefCatador, Partner
+
+
+class CompiledSerializer(object):
+    """
+        `fields` is a sequence of (output name, values_list lookup). A method
+        named convert_<output name> is applied to the values of that field.
+    """
+    fields = ()
+
+    def __init__(self, context=None):
+        self.context = context or {}
+        self.names = [name for name, lookup in self.fields]
+        self.lookups = [lookup for name, lookup in self.fields]
+        self.converters = [getattr(self, 'convert_' + name, None)
+                           for name in self.names]
+
+    def rows(self, queryset):
+        return queryset.values_list(*self.lookups)
+
+    def to_representation(self, rows):
+        names = self.names
+
+        if not any(self.converters):
+            return [OrderedDict(zip(names, row)) for row in rows]
+
+        converters = [(i, convert) for i, convert in enumerate(self.converters)
+                      if convert is not None]
+        result = []
+        for row in rows:
+            row = list(row)
+            for i, convert in converters:
+                row[i] = convert(row[i])
+            result.append(OrderedDict(zip(names, row)))
+        return result
+
+
+class MaterialCompiledSerializer(CompiledSerializer):
+    """
+        Same output as MaterialSerializer
+    """
+    fields = (('id', 'id'), ('name', 'name'), ('description', 'description'))
+
+
+class PartnerCompiledSerializer(CompiledSerializer):
+    """
+        Same output as PartnerSerializer
+    """
+    fields = (('pk', 'pk'), ('name', 'name'), ('image', 'image'))
+
+    def __init__(self, context=None):
+        super(PartnerCompiledSerializer, self).__init__(context)
+        self.storage = Partner._meta.get_field('image').storage
+        self.request = self.context.get('request')
+
+    def convert_image(self, name):
+        # Like serializers.ImageField: absolute url when there is a request
+        if not name:
+            return None
+        url = self.storage.url(name)
+        if self.request is not None:
+            return self.request.build_absolute_uri(url)
+        return url
+
+
+class CatadorPositionsCompiledSerializer(CompiledSerializer):
+    """
+        Same output as CatadorsPositionsSerializer: the id of each catador
+        with the list of its georefs and its current position.
+    """
+    fields = (('id', 'id'), ('geolocation', 'geolocation'),
+              ('last_position', 'last_position'))
+    recorded_on = serializers.DateTimeField()
+
+    def rows(self, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+
+        georefs = {}
+        for catador_id, latitude, longitude, reverse_geocoding in \
+                GeorefCatador.objects.filter(catador__in=queryset)\
+                .order_by('pk').values_list(
+                    'catador_id', 'georef__latitude', 'georef__longitude',
+                    'georef__reverse_geocoding'):
+            georefs.setdefault(catador_id, []).append(OrderedDict((
+                ('latitude', latitude),
+                ('longitude', longitude),
+                ('reverse_geocoding', reverse_geocoding),
+            )))
+
+        positions = {}
+        for catador_id, latitude, longitude, recorded_on in \
+                CatadorLastPosition.objects.filter(catador__in=queryset)\
+                .values_list('catador_id', 'latitude', 'longitude',
+                             'recorded_on'):
+            positions[catador_id] = OrderedDict((
+                ('latitude', latitude),
+                ('longitude', longitude),
+                ('recorded_on', self.recorded_on.to_representation(recorded_on)),
+            ))
+
+        return [(pk, georefs.get(pk, []), positions.get(pk)) for pk in ids]
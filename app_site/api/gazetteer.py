@@ -0,0 +1,192 @@
+"""
+    Offline gazetteer of neighbourhoods (bairros) loaded from a GeoJSON file.
+
+    The bounding boxes of the polygons are packed in an R-tree (STR bulk
+    loading), so a lookup only runs the exact point-in-polygon test on the
+    few polygons whose box contains the point.
+"""
+import json
+import math
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+
+def point_in_rings(x, y, rings):
+    """
+    Even-odd rule over all rings of a polygon, so holes are handled.
+    """
+    inside = False
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ring in rings:
+            xi, yi = ring[:, 0], ring[:, 1]
+            xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+            crosses = ((yi > y) != (yj > y)) & \
+                (x < (xj - xi) * (y - yi) / (yj - yi) + xi)
+            if np.count_nonzero(crosses) % 2:
+                inside = not inside
+    return inside
+
+
+def feature_polygons(geometry):
+    """
+    GeoJSON Polygon/MultiPolygon -> list of polygons (lists of ring arrays)
+    """
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return []
+
+    return [[np.array(ring, dtype=np.float64)[:, :2] for ring in polygon]
+            for polygon in polygons]
+
+
+class RTree(object):
+    """
+        Static R-tree of boxes (min_x, min_y, max_x, max_y), bulk loaded with
+        Sort-Tile-Recursive. Every level is a list of nodes
+        (box, child indexes); the leaves point to the original boxes.
+    """
+
+    def __init__(self, boxes, node_size=16):
+        self.node_size = node_size
+        self.boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.levels = []
+
+        entries = [(box, [i]) for i, box in enumerate(self.boxes)]
+        level = self._pack(entries)
+        self.levels.append(level)
+
+        while len(level) > 1:
+            level = self._pack([(box, [i]) for i, (box, children)
+                                in enumerate(level)])
+            self.levels.append(level)
+
+    def _pack(self, entries):
+        if not entries:
+            return []
+
+        size = self.node_size
+        n_slices = int(math.ceil(math.sqrt(math.ceil(len(entries) / float(size)))))
+        per_slice = n_slices * size
+
+        entries = sorted(entries, key=lambda e: e[0][0] + e[0][2])
+        nodes = []
+        for start in range(0, len(entries), per_slice):
+            vertical = sorted(entries[start:start + per_slice],
+                              key=lambda e: e[0][1] + e[0][3])
+            for node_start in range(0, len(vertical), size):
+                group = vertical[node_start:node_start + size]
+                boxes = np.array([box for box, children in group])
+                box = np.array([boxes[:, 0].min(), boxes[:, 1].min(),
+                                boxes[:, 2].max(), boxes[:, 3].max()])
+                nodes.append((box, [children[0] for box_, children in group]))
+        return nodes
+
+    def query_point(self, x, y):
+        """
+        Indexes of the boxes that contain (x, y).
+        """
+        if not self.levels or not self.levels[-1]:
+            return []
+
+        candidates = range(len(self.levels[-1]))
+        for level in reversed(self.levels):
+            found = []
+            for i in candidates:
+                box, children = level[i]
+                if box[0] <= x <= box[2] and box[1] <= y <= box[3]:
+                    found.extend(children)
+            candidates = found
+
+        return [i for i in candidates
+                if self.boxes[i][0] <= x <= self.boxes[i][2] and
+                self.boxes[i][1] <= y <= self.boxes[i][3]]
+
+
+class Gazetteer(object):
+
+    def __init__(self, features):
+        """
+        features: [(key, polygons)], polygons as returned by feature_polygons
+        """
+        self.keys = []
+        self.polygons = []
+        boxes = []
+
+        for key, polygons in features:
+            for polygon in polygons:
+                outer = polygon[0]
+                self.keys.append(key)
+                self.polygons.append(polygon)
+                boxes.append((outer[:, 0].min(), outer[:, 1].min(),
+                              outer[:, 0].max(), outer[:, 1].max()))
+
+        self.tree = RTree(boxes)
+
+    @classmethod
+    def from_geojson(cls, path, key_property='id'):
+        with open(path, encoding='utf-8') as geojson:
+            data = json.load(geojson)
+
+        features = []
+        for feature in data.get('features', []):
+            key = feature_key(feature, key_property)
+            features.append((key, feature_polygons(feature['geometry'])))
+
+        return cls(features)
+
+    def locate(self, latitude, longitude):
+        """
+        Key of the region that contains the point, or None.
+        """
+        for i in self.tree.query_point(longitude, latitude):
+            if point_in_rings(longitude, latitude, self.polygons[i]):
+                return self.keys[i]
+        return None
+
+
+def feature_key(feature, key_property='id'):
+    properties = feature.get('properties') or {}
+    key = properties.get(key_property, feature.get('id'))
+    return str(key) if key is not None else None
+
+
+_lock = threading.Lock()
+_gazetteer = {}
+
+
+def get_gazetteer():
+    """
+    Gazetteer of settings.REGIONS_GEOJSON keyed by Region pk, kept per
+    process and loaded again when the file or the Region version (bumped
+    by the Region signals, see api/caching.py) changes. None when no file
+    is configured.
+    """
+    from .caching import get_version
+    from .models import Region
+
+    path = getattr(settings, 'REGIONS_GEOJSON', None)
+    if not path:
+        return None
+
+    stamp = (os.path.getmtime(path), get_version(Region))
+
+    with _lock:
+        if path not in _gazetteer or _gazetteer[path][0] != stamp:
+            key_property = getattr(settings, 'REGIONS_GEOJSON_ID_PROPERTY', 'id')
+            gazetteer = Gazetteer.from_geojson(path, key_property)
+            region_ids = dict(Region.objects.values_list('source_id', 'pk'))
+            gazetteer.keys = [region_ids.get(key) for key in gazetteer.keys]
+            _gazetteer[path] = (stamp, gazetteer)
+
+        return _gazetteer[path][1]
+
+
+def reset_gazetteer():
+    with _lock:
+        _gazetteer.clear()
@@ -0,0 +1,141 @@
+"""
+    Reverse geocoding with a two tier cache.
+
+    Addresses are cached by coordinates rounded to
+    REVERSE_GEOCODING_PRECISION decimals (4 ~ 11 meters): first in an
+    in-process LRU, then in the ReverseGeocodingCache table. Only misses on
+    both reach the provider configured in REVERSE_GEOCODING_PROVIDER.
+    Unknown addresses are only kept in the LRU, for
+    REVERSE_GEOCODING_EMPTY_TIMEOUT seconds, so they are asked again later.
+"""
+import math
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+
+from .caching import LRUCache
+
+
+class GeocodingError(Exception):
+    """
+        The provider failed (unreachable, timeout, quota...).
+    """
+
+
+def valid_coordinates(latitude, longitude):
+    return math.isfinite(latitude) and math.isfinite(longitude) and \
+        -90 <= latitude <= 90 and -180 <= longitude <= 180
+
+
+class BaseReverseGeocoder(object):
+
+    def reverse(self, latitude, longitude):
+        """
+        Address of the point, or '' when unknown. Raises GeocodingError.
+        """
+        raise NotImplementedError
+
+
+class StubReverseGeocoder(BaseReverseGeocoder):
+    """
+        Offline provider for development and tests: the bairro tagged by
+        the gazetteer when there is one, otherwise an empty address.
+    """
+
+    def reverse(self, latitude, longitude):
+        from .gazetteer import get_gazetteer
+        from .models import Region
+
+        gazetteer = get_gazetteer()
+        if gazetteer is None:
+            return ''
+
+        region_id = gazetteer.locate(latitude, longitude)
+        region = Region.objects.filter(pk=region_id).first()
+        if region is None:
+            return ''
+        return ', '.join(v for v in (region.name, region.city) if v)
+
+
+class GeopyReverseGeocoder(BaseReverseGeocoder):
+    """
+        Nominatim (OpenStreetMap) through geopy.
+    """
+
+    def __init__(self):
+        from geopy.geocoders import Nominatim
+        self.geocoder = Nominatim(timeout=5)
+
+    def reverse(self, latitude, longitude):
+        from geopy.exc import GeopyError
+
+        try:
+            location = self.geocoder.reverse((latitude, longitude),
+                                             exactly_one=True)
+        except GeopyError as error:
+            raise GeocodingError(error)
+        return location.address if location else ''
+
+
+memory_cache = LRUCache(getattr(settings, 'REVERSE_GEOCODING_CACHE_SIZE', 10000))
+_provider = None
+
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        path = getattr(settings, 'REVERSE_GEOCODING_PROVIDER',
+                       'api.geocoding.StubReverseGeocoder')
+        _provider = import_string(path)()
+    return _provider
+
+
+def cache_key(latitude, longitude):
+    precision = getattr(settings, 'REVERSE_GEOCODING_PRECISION', 4)
+    return '%.*f,%.*f' % (precision, latitude, precision, longitude)
+
+
+def store(key, address):
+    from .models import ReverseGeocodingCache
+
+    if not address:
+        memory_cache.set(key, '', getattr(
+            settings, 'REVERSE_GEOCODING_EMPTY_TIMEOUT', 3600))
+        return
+
+    try:
+        with transaction.atomic():
+            ReverseGeocodingCache.objects.get_or_create(
+                key=key, defaults={'address': address})
+    except IntegrityError:
+        # Resolved at the same time by another process
+        pass
+
+    memory_cache.set(key, address)
+
+
+def cached_addresses():
+    # Rows stored empty before they were kept out of the table are asked
+    # again
+    from .models import ReverseGeocodingCache
+    return ReverseGeocodingCache.objects.exclude(address='')
+
+
+def reverse_geocode(latitude, longitude):
+    key = cache_key(latitude, longitude)
+
+    address = memory_cache.get(key)
+    if address is not None:
+        return address
+
+    address = cached_addresses().filter(key=key)\
+        .values_list('address', flat=True).first()
+
+    if address is None:
+        address = get_provider().reverse(latitude, longitude) or ''
+        store(key, address)
+    else:
+        memory_cache.set(key, address)
+
+    return address
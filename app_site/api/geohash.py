@@ -0,0 +1,215 @@
+"""
+    Geohash encoding and helpers to narrow proximity queries to the cells
+    around a point using an indexed prefix (LIKE 'abc%') lookup.
+"""
+import math
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Q
+
+from .calc_distance import EARTH_RADIUS_KM, haversine_km
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+BASE32_MAP = dict((c, i) for i, c in enumerate(BASE32))
+MAX_PRECISION = 12
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            rng, coord = lon_range, longitude
+        else:
+            rng, coord = lat_range, latitude
+
+        mid = (rng[0] + rng[1]) / 2.0
+        value <<= 1
+        if coord >= mid:
+            value |= 1
+            rng[0] = mid
+        else:
+            rng[1] = mid
+
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+
+    return ''.join(chars)
+
+
+def decode_bbox(geohash):
+    """
+    (min_lat, max_lat, min_lon, max_lon) of the cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+
+    for char in geohash:
+        value = BASE32_MAP[char]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2.0
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+
+def cell_size(precision):
+    """
+    (height, width) of a cell in degrees.
+    """
+    lon_bits = int(math.ceil(5 * precision / 2.0))
+    lat_bits = 5 * precision - lon_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def neighbours(geohash):
+    """
+    The 8 cells around `geohash` (cells beyond the poles are dropped).
+    """
+    min_lat, max_lat, min_lon, max_lon = decode_bbox(geohash)
+    height, width = max_lat - min_lat, max_lon - min_lon
+    lat = (min_lat + max_lat) / 2.0
+    lon = (min_lon + max_lon) / 2.0
+
+    cells = []
+    for d_lat in (-1, 0, 1):
+        for d_lon in (-1, 0, 1):
+            if not d_lat and not d_lon:
+                continue
+
+            n_lat = lat + d_lat * height
+            if n_lat <= -90 or n_lat >= 90:
+                continue
+
+            n_lon = (lon + d_lon * width + 180.0) % 360.0 - 180.0
+            cells.append(encode(n_lat, n_lon, len(geohash)))
+
+    return cells
+
+
+def precision_for_radius(latitude, radius_km):
+    """
+    The finest precision whose cells are at least `radius_km` on each side,
+    so the 3x3 block around a point covers the whole circle. 0 means the
+    radius is too large to narrow anything.
+    """
+    cos_lat = max(math.cos(math.radians(abs(latitude))), 1e-6)
+
+    for precision in range(MAX_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        if height * KM_PER_DEGREE >= radius_km and \
+                width * KM_PER_DEGREE * cos_lat >= radius_km:
+            return precision
+
+    return 0
+
+
+def covering_cells(latitude, longitude, radius_km):
+    """
+    Geohash prefixes that together cover the circle of `radius_km`.
+    """
+    precision = precision_for_radius(latitude, radius_km)
+    if not precision:
+        return []
+
+    center = encode(latitude, longitude, precision)
+    return [center] + neighbours(center)
+
+
+def cells_q(cells, lookup='geohash'):
+    """
+    Q object matching rows whose geohash starts with any of `cells`, plus
+    the rows without a geohash yet (see backfill).
+    """
+    if not cells:
+        return Q()
+
+    return reduce(lambda a, b: a | b,
+                  [Q(**{lookup + '__startswith': cell}) for cell in set(cells)],
+                  Q(**{lookup + '__isnull': True}))
+
+
+def backfill(queryset, batch_size=1000):
+    """
+    Fill the geohash of the LatitudeLongitude rows of `queryset`. Returns
+    the number of rows read.
+    """
+    rows = queryset.order_by('pk').values_list('pk', 'latitude', 'longitude')
+    total = 0
+    last_pk = 0
+
+    while True:
+        batch = list(rows.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+
+        # update() skips save(), so no history row per backfilled point
+        with transaction.atomic():
+            for pk, latitude, longitude in batch:
+                if latitude is None or longitude is None:
+                    continue
+                queryset.model.objects.filter(pk=pk)\
+                    .update(geohash=encode(latitude, longitude))
+
+        total += len(batch)
+        last_pk = batch[-1][0]
+
+    return total
+
+
+def nearest_queryset(queryset, latitude, longitude, k, prefix='',
+                     start_radius_km=1.0):
+    """
+    Narrow `queryset` to the geohash cells that are guaranteed to contain
+    its k rows nearest to the point. `prefix` is the path to the
+    LatitudeLongitude relation, e.g. 'georef__' for GeorefCatador.
+
+    The search starts with small cells and grows the radius until at least k
+    rows fall inside it, so the cost follows the local density instead of
+    the size of the table.
+    """
+    radius = start_radius_km
+
+    while True:
+        cells = covering_cells(latitude, longitude, radius)
+        if not cells:
+            return queryset
+
+        candidates = queryset.filter(cells_q(cells, prefix + 'geohash'))
+        rows = list(candidates.values_list(prefix + 'latitude',
+                                           prefix + 'longitude'))
+
+        if len(rows) >= k:
+            lats = [row[0] for row in rows]
+            lons = [row[1] for row in rows]
+            dist = sorted(haversine_km(latitude, longitude, lats, lons))
+            kth = dist[k - 1] if k > 0 else 0
+
+            if kth <= radius:
+                return candidates
+
+            # Something outside the cells may still beat the k-th row
+            radius = kth
+            cells = covering_cells(latitude, longitude, radius)
+            if not cells:
+                return queryset
+            return queryset.filter(cells_q(cells, prefix + 'geohash'))
+
+        radius *= 4
@@ -0,0 +1,70 @@
+"""
+    Incremental density grid of residues and collects.
+
+    HeatmapCell keeps one counter per geohash cell x day x kind x status,
+    bumped with F() updates when a residue is located and whenever a collect
+    changes status, so the heatmap endpoint never scans Collect or Residue.
+    Collect counters are events: how many collects entered that status in
+    the cell on that day.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .geohash import decode_bbox, encode
+
+RESIDUE = 'residue'
+COLLECT = 'collect'
+
+
+def cell_of(latitude, longitude):
+    """
+    (geohash, center latitude, center longitude) of the grid cell.
+    """
+    precision = getattr(settings, 'HEATMAP_PRECISION', 6)
+    cell = encode(latitude, longitude, precision)
+    min_lat, max_lat, min_lon, max_lon = decode_bbox(cell)
+    return cell, (min_lat + max_lat) / 2.0, (min_lon + max_lon) / 2.0
+
+
+def bump(latitude, longitude, kind, status='', day=None, amount=1):
+    from .models import HeatmapCell
+
+    cell, center_lat, center_lon = cell_of(latitude, longitude)
+    day = day or timezone.localtime(timezone.now()).date()
+    lookup = {'cell': cell, 'day': day, 'kind': kind, 'status': status}
+
+    with transaction.atomic():
+        if HeatmapCell.objects.filter(**lookup)\
+                .update(count=F('count') + amount):
+            return
+
+        try:
+            with transaction.atomic():
+                HeatmapCell.objects.create(latitude=center_lat,
+                                           longitude=center_lon,
+                                           count=amount, **lookup)
+        except IntegrityError:
+            # Created at the same time by another request
+            HeatmapCell.objects.filter(**lookup)\
+                .update(count=F('count') + amount)
+
+
+def record_collects(collect_ids, status, day=None):
+    """
+    Count the given collects as having entered `status`. Used for bulk
+    updates, which bypass Collect.save.
+    """
+    from .models import Collect
+
+    cells = {}
+    for latitude, longitude in Collect.objects.filter(
+            pk__in=collect_ids, residue__georefresidue__isnull=False)\
+            .values_list('residue__georefresidue__georef__latitude',
+                         'residue__georefresidue__georef__longitude'):
+        key = cell_of(latitude, longitude)
+        cells[key] = cells.get(key, 0) + 1
+
+    for (cell, latitude, longitude), amount in cells.items():
+        bump(latitude, longitude, COLLECT, status, day, amount)
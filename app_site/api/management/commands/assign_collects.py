@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.assignment import DEFAULT_CAPACITY, MAX_DISTANCE_KM
+from api.assignment import assign_open_collects
+
+
+class Command(BaseCommand):
+    help = 'Distribui as coletas em aberto entre os catadores disponíveis.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY,
+                            help='Coletas aceitas por catador')
+        parser.add_argument('--max-distance', type=float,
+                            default=MAX_DISTANCE_KM, help='Distância máxima (km)')
+        parser.add_argument('--dry-run', action='store_true', default=False)
+
+    def handle(self, *args, **options):
+        start = time.time()
+        result = assign_open_collects(options['capacity'],
+                                      options['max_distance'],
+                                      options['dry_run'])
+
+        self.stdout.write('%(assigned)d de %(open_collects)d coletas '
+                          'atribuídas a %(available_catadores)d catadores '
+                          '(%(saved)d salvas)' % result)
+        self.stdout.write('%.3fs' % (time.time() - start))
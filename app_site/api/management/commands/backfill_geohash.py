@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.geohash import backfill
+from api.models import LatitudeLongitude
+
+
+class Command(BaseCommand):
+    help = 'Preenche o geohash das GeoReferencias que ainda não o possuem.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Recalcula também os que já possuem geohash')
+
+    def handle(self, *args, **options):
+        queryset = LatitudeLongitude.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(geohash__isnull=True)
+
+        total = backfill(queryset, options['batch_size'])
+        self.stdout.write('%d georeferencias atualizadas.' % total)
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from api.geocoding import GeocodingError, cache_key, cached_addresses
+from api.geocoding import get_provider, memory_cache, store
+from api.models import LatitudeLongitude
+
+
+class Command(BaseCommand):
+    help = 'Preenche o reverse_geocoding das GeoReferencias vazias, ' \
+           'resolvendo cada coordenada arredondada uma única vez.'
+
+    def handle(self, *args, **options):
+        rows = LatitudeLongitude.objects\
+            .filter(Q(reverse_geocoding='') | Q(reverse_geocoding__isnull=True))\
+            .values_list('pk', 'latitude', 'longitude')
+
+        # Nearby coordinates share the same cell
+        cells = {}
+        for pk, latitude, longitude in rows.iterator():
+            if latitude is None or longitude is None:
+                continue
+            key = cache_key(latitude, longitude)
+            cell = cells.setdefault(key, {'point': (latitude, longitude),
+                                          'pks': []})
+            cell['pks'].append(pk)
+
+        keys = list(cells.keys())
+        cached = {}
+        for start in range(0, len(keys), 500):
+            cached.update(cached_addresses()
+                          .filter(key__in=keys[start:start + 500])
+                          .values_list('key', 'address'))
+
+        provider = get_provider()
+        resolved = 0
+        updated = 0
+        failed = 0
+
+        for key, cell in cells.items():
+            address = cached.get(key)
+            if address is None:
+                try:
+                    address = provider.reverse(*cell['point']) or ''
+                except GeocodingError:
+                    failed += 1
+                    continue
+                store(key, address)
+                resolved += 1
+            else:
+                memory_cache.set(key, address)
+
+            if not address:
+                continue
+
+            with transaction.atomic():
+                for start in range(0, len(cell['pks']), 500):
+                    chunk = cell['pks'][start:start + 500]
+                    LatitudeLongitude.objects.filter(pk__in=chunk)\
+                        .update(reverse_geocoding=address[:500])
+                    updated += len(chunk)
+
+        self.stdout.write('%d células, %d consultadas no provedor, '
+                          '%d falhas, %d georeferencias atualizadas.'
+                          % (len(cells), resolved, failed, updated))
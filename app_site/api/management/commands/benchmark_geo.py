@@ -0,0 +1,277 @@
+"""
+    Benchmark of the geo queries (k-nearest, radius and bbox) over synthetic
+    catadores spread around the points of data/pontos.sql.
+
+    The numpy and kdtree engines run at every size, the clusters engine up
+    to --clusters-max-size. The db engine needs an explicit --database (use
+    a test database): it inserts users, catadores and their current
+    positions (CatadorLastPosition, the rows the views query) inside a
+    transaction that is rolled back, and is skipped above --db-max-size.
+    The report is JSON, so runs can be compared by scripts.
+"""
+import datetime
+import json
+import os
+import re
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from django.utils import timezone
+from scipy.spatial import cKDTree
+
+from api.calc_distance import EARTH_RADIUS_KM, bounding_box, haversine_km
+from api.calc_distance import k_nearest, load_positions
+from api.clustering import GridClusterIndex
+from api.geohash import cells_q, covering_cells, encode, nearest_queryset
+from api.models import Catador, CatadorLastPosition
+from api.spatial_index import CatadorSpatialIndex, to_unit_vectors
+
+ENGINES = ('numpy', 'kdtree', 'clusters', 'db')
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180.0
+POINT_RE = re.compile(r"'(-?\d+\.\d+)',\s*'(-?\d+\.\d+)'")
+
+# Capitals used when data/pontos.sql is not available
+DEFAULT_CENTERS = [
+    (-23.5505, -46.6333), (-22.9068, -43.1729), (-19.9167, -43.9345),
+    (-30.0346, -51.2177), (-25.4284, -49.2733), (-15.7939, -47.8828),
+    (-12.9714, -38.5014), (-8.0476, -34.8770), (-3.7319, -38.5267),
+    (-3.1190, -60.0217),
+]
+
+
+def load_centers(path):
+    if not path or not os.path.exists(path):
+        return np.array(DEFAULT_CENTERS)
+
+    with open(path, encoding='utf-8') as sql:
+        points = [(float(lat), float(lon))
+                  for lat, lon in POINT_RE.findall(sql.read())]
+
+    return np.array(points or DEFAULT_CENTERS)
+
+
+def synthetic_points(rng, centers, n, spread_km):
+    idx = rng.randint(len(centers), size=n)
+    spread = spread_km / KM_PER_DEGREE
+    lats = np.clip(centers[idx, 0] + rng.normal(0, spread, n), -89.9, 89.9)
+    lons = centers[idx, 1] + rng.normal(0, spread, n)
+    return lats, lons
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def stats(seconds):
+    ms = np.array(seconds) * 1000.0
+    return {
+        'mean_ms': round(float(ms.mean()), 4),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'max_ms': round(float(ms.max()), 4),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Mede o tempo das consultas geográficas com catadores sintéticos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10000,100000,1000000')
+        parser.add_argument('--engines', default='numpy,kdtree,clusters')
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=3)
+        parser.add_argument('--radius', type=float, default=2.0,
+                            help='Raio das buscas (km)')
+        parser.add_argument('--spread', type=float, default=15.0,
+                            help='Dispersão em torno de cada ponto (km)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--clusters-max-size', type=int, default=100000)
+        parser.add_argument('--db-max-size', type=int, default=100000)
+        parser.add_argument('--database',
+                            help='Banco usado pela engine db (use um banco '
+                                 'de teste)')
+        parser.add_argument('--centers', default=os.path.join(
+            settings.BASE_DIR, '..', 'data', 'pontos.sql'))
+        parser.add_argument('--output', help='Arquivo do relatório JSON')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes deve ser uma lista de inteiros')
+
+        engines = options['engines'].split(',')
+        unknown = set(engines) - set(ENGINES)
+        if unknown:
+            raise CommandError('Engines desconhecidas: %s' % ', '.join(unknown))
+
+        self.database = options['database']
+        if 'db' in engines and not self.database:
+            raise CommandError('A engine db precisa de --database')
+        if self.database and self.database not in connections:
+            raise CommandError('Banco desconhecido: %s' % self.database)
+        max_sizes = {'clusters': options['clusters_max_size'],
+                     'db': options['db_max_size']}
+
+        self.k = options['k']
+        self.radius = options['radius']
+        centers = load_centers(options['centers'])
+
+        results = []
+        for size in sizes:
+            rng = np.random.RandomState(options['seed'])
+            lats, lons = synthetic_points(rng, centers, size, options['spread'])
+            queries = np.column_stack(synthetic_points(
+                rng, centers, options['queries'], options['spread']))
+
+            for engine in engines:
+                if size > max_sizes.get(engine, size):
+                    continue
+
+                for operation, build, seconds in getattr(
+                        self, 'bench_' + engine)(lats, lons, queries):
+                    result = {'engine': engine, 'size': size,
+                              'operation': operation, 'build_s': build}
+                    result.update(stats(seconds))
+                    results.append(result)
+                    self.stderr.write('%(engine)s %(size)d %(operation)s '
+                                      '%(mean_ms).3f ms' % result)
+
+        report = {
+            'generated_on': datetime.datetime.utcnow().isoformat(),
+            'database': connections[self.database or 'default'].vendor,
+            'numpy': np.__version__,
+            'queries': options['queries'],
+            'k': self.k,
+            'radius_km': self.radius,
+            'spread_km': options['spread'],
+            'seed': options['seed'],
+            'results': results,
+        }
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                report_file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def bboxes(self, queries):
+        return [bounding_box(lat, lon, self.radius) for lat, lon in queries]
+
+    def bench_numpy(self, lats, lons, queries):
+        ids = np.arange(len(lats))
+
+        def radius(lat, lon):
+            return ids[haversine_km(lat, lon, lats, lons) <= self.radius]
+
+        def bbox(min_lat, max_lat, min_lon, max_lon):
+            return ids[(lats >= min_lat) & (lats <= max_lat) &
+                       (lons >= min_lon) & (lons <= max_lon)]
+
+        yield ('knn', 0.0,
+               [timed(k_nearest, q, ids, lats, lons, self.k) for q in queries])
+        yield ('radius', 0.0, [timed(radius, *q) for q in queries])
+        yield ('bbox', 0.0, [timed(bbox, *b) for b in self.bboxes(queries)])
+
+    def bench_kdtree(self, lats, lons, queries):
+        positions = dict(zip(range(len(lats)), zip(lats, lons)))
+        index = CatadorSpatialIndex(loader=lambda: positions)
+        build = timed(index.nearest, queries[0], self.k)
+
+        start = time.perf_counter()
+        tree = cKDTree(to_unit_vectors(lats, lons))
+        chord = 2 * np.sin(self.radius / (2 * EARTH_RADIUS_KM))
+        tree_build = time.perf_counter() - start
+
+        def radius(lat, lon):
+            return tree.query_ball_point(to_unit_vectors([lat], [lon])[0],
+                                         chord)
+
+        yield ('knn', build,
+               [timed(index.nearest, q, self.k) for q in queries])
+        yield ('radius', tree_build, [timed(radius, *q) for q in queries])
+
+    def bench_clusters(self, lats, lons, queries):
+        positions = dict(zip(range(len(lats)), zip(lats, lons)))
+        index = GridClusterIndex(loader=lambda: positions)
+        build = timed(index.clusters, 0)
+
+        def bbox(min_lat, max_lat, min_lon, max_lon):
+            return index.clusters(14, (min_lon, min_lat, max_lon, max_lat))
+
+        yield ('bbox', build, [timed(bbox, *b) for b in self.bboxes(queries)])
+
+    def bench_db(self, lats, lons, queries):
+        using = self.database
+
+        with transaction.atomic(using=using):
+            # bulk_create skips save() and the signals: the geohash is filled
+            # here and the pks are read back in insertion order
+            start = time.perf_counter()
+            last_user = User.objects.using(using).order_by('-pk')\
+                .values_list('pk', flat=True).first() or 0
+            User.objects.using(using).bulk_create(
+                [User(username='benchmark-%d' % i) for i in range(len(lats))],
+                batch_size=5000)
+            user_ids = User.objects.using(using).filter(pk__gt=last_user)\
+                .order_by('pk').values_list('pk', flat=True)
+
+            last_catador = Catador.objects.using(using).order_by('-pk')\
+                .values_list('pk', flat=True).first() or 0
+            Catador.objects.using(using).bulk_create(
+                [Catador(name='Benchmark', nickname='benchmark', user_id=pk)
+                 for pk in user_ids], batch_size=5000)
+            catador_ids = Catador.objects.using(using)\
+                .filter(pk__gt=last_catador).order_by('pk')\
+                .values_list('pk', flat=True)
+
+            now = timezone.now()
+            CatadorLastPosition.objects.using(using).bulk_create(
+                [CatadorLastPosition(
+                    catador_id=catador_id, latitude=float(lat),
+                    longitude=float(lon), recorded_on=now,
+                    geohash=encode(float(lat), float(lon)))
+                 for catador_id, lat, lon in zip(catador_ids, lats, lons)],
+                batch_size=5000)
+            build = time.perf_counter() - start
+
+            # The current positions, as read by the matches and the
+            # radius/bbox filters of /api/catadores/
+            positions = CatadorLastPosition.objects.using(using)\
+                .filter(catador__active=True)
+
+            def knn(lat, lon):
+                ids, lats, lons = load_positions(
+                    nearest_queryset(positions, lat, lon, self.k))
+                return k_nearest((lat, lon), ids, lats, lons, self.k)
+
+            def radius(lat, lon):
+                min_lat, max_lat, min_lon, max_lon = \
+                    bounding_box(lat, lon, self.radius)
+                ids, lats, lons = load_positions(positions.filter(
+                    cells_q(covering_cells(lat, lon, self.radius), 'geohash'),
+                    latitude__range=(min_lat, max_lat),
+                    longitude__range=(min_lon, max_lon)))
+                return ids[haversine_km(lat, lon, lats, lons) <= self.radius]
+
+            def bbox(min_lat, max_lat, min_lon, max_lon):
+                return load_positions(positions.filter(
+                    latitude__range=(min_lat, max_lat),
+                    longitude__range=(min_lon, max_lon)))[0]
+
+            results = [
+                ('knn', build, [timed(knn, *q) for q in queries]),
+                ('radius', build, [timed(radius, *q) for q in queries]),
+                ('bbox', build, [timed(bbox, *b)
+                                 for b in self.bboxes(queries)]),
+            ]
+            transaction.set_rollback(True, using=using)
+
+        return results
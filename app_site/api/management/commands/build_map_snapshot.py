@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.snapshot import build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Gera o arquivo com os marcadores do mapa quando houver alterações.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Refaz o arquivo inteiro')
+        parser.add_argument('--interval', type=int, default=0,
+                            help='Repete a cada N segundos')
+
+    def handle(self, *args, **options):
+        full = options['full']
+
+        while True:
+            result = build_snapshot(full=full)
+            if result is None:
+                self.stdout.write('Nenhuma alteração.')
+            else:
+                seq, count = result
+                self.stdout.write('%d marcadores (seq %d).' % (count, seq))
+
+            if not options['interval']:
+                break
+            full = False
+            time.sleep(options['interval'])
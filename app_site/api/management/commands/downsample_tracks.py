@@ -0,0 +1,37 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import CatadorTrack
+from api.tracks import pack, simplify, unpack
+
+
+class Command(BaseCommand):
+    help = 'Simplifica os trajetos dos catadores mais antigos que N dias.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7,
+                            help='Trajetos com mais de N dias')
+        parser.add_argument('--tolerance', type=float, default=0.015,
+                            help='Tolerância em km (padrão 15 metros)')
+
+    def handle(self, *args, **options):
+        today = timezone.localtime(timezone.now()).date()
+        limit = today - datetime.timedelta(days=options['days'])
+
+        tracks = CatadorTrack.objects.filter(day__lt=limit, downsampled=False)
+        before = after = 0
+
+        for track in tracks.iterator():
+            points = unpack(track.points)
+            simplified = simplify(points, options['tolerance'])
+
+            before += len(points)
+            after += len(simplified)
+
+            CatadorTrack.objects.filter(pk=track.pk).update(
+                points=pack(simplified), count=len(simplified),
+                downsampled=True)
+
+        self.stdout.write('%d pontos reduzidos para %d.' % (before, after))
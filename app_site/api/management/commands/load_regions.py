@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.gazetteer import Gazetteer, feature_key, feature_polygons
+from api.gazetteer import reset_gazetteer
+from api.models import CatadorLastPosition, LatitudeLongitude, Region
+
+
+class Command(BaseCommand):
+    help = 'Carrega os bairros de um GeoJSON e marca o bairro de cada ' \
+           'GeoReferencia e posição atual de catador.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('geojson')
+        parser.add_argument('--id-property', default='id',
+                            help='Propriedade com o id da feature')
+        parser.add_argument('--name-property', default='name',
+                            help='Propriedade com o nome do bairro')
+        parser.add_argument('--city', default=None)
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Remarca também as que já possuem bairro')
+
+    def handle(self, *args, **options):
+        with open(options['geojson'], encoding='utf-8') as geojson:
+            data = json.load(geojson)
+
+        features = []
+        with transaction.atomic():
+            for feature in data.get('features', []):
+                key = feature_key(feature, options['id_property'])
+                if key is None:
+                    continue
+
+                properties = feature.get('properties') or {}
+                region, created = Region.objects.update_or_create(
+                    source_id=key, defaults={
+                        'name': properties.get(options['name_property'], key),
+                        'city': options['city'],
+                    })
+                features.append((region.pk, feature_polygons(feature['geometry'])))
+
+        self.stdout.write('%d bairros carregados.' % len(features))
+
+        reset_gazetteer()
+        gazetteer = Gazetteer(features)
+
+        tagged = self.tag(LatitudeLongitude, gazetteer, options['all'])
+        self.stdout.write('%d georeferencias marcadas.' % tagged)
+
+        tagged = self.tag(CatadorLastPosition, gazetteer, options['all'])
+        self.stdout.write('%d posições de catadores marcadas.' % tagged)
+
+    def tag(self, model, gazetteer, everything):
+        queryset = model.objects.all()
+        if not everything:
+            queryset = queryset.filter(region__isnull=True)
+
+        by_region = {}
+        for pk, latitude, longitude in queryset.values_list(
+                'pk', 'latitude', 'longitude').iterator():
+            if latitude is None or longitude is None:
+                continue
+            region_id = gazetteer.locate(latitude, longitude)
+            if region_id is not None:
+                by_region.setdefault(region_id, []).append(pk)
+
+        # One UPDATE per region (in chunks) instead of one per point
+        tagged = 0
+        with transaction.atomic():
+            for region_id, pks in by_region.items():
+                for start in range(0, len(pks), 500):
+                    chunk = pks[start:start + 500]
+                    model.objects.filter(pk__in=chunk)\
+                        .update(region_id=region_id)
+                    tagged += len(chunk)
+
+        return tagged
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.matching import match_unmatched_residues
+
+
+class Command(BaseCommand):
+    help = 'Calcula os catadores mais próximos dos resíduos que ainda não os possuem.'
+
+    def handle(self, *args, **options):
+        count = match_unmatched_residues()
+        self.stdout.write('%d resíduos atualizados.' % count)
@@ -0,0 +1,27 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import ChangeNotificaion
+
+
+class Command(BaseCommand):
+    help = 'Remove as alterações mais antigas que N dias do log de sincronização.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'CHANGES_RETENTION_DAYS', 30),
+            help='Alterações com mais de N dias')
+
+    def handle(self, *args, **options):
+        limit = timezone.now() - datetime.timedelta(days=options['days'])
+        latest = ChangeNotificaion.objects.order_by('-pk')\
+            .values_list('pk', flat=True).first()
+
+        # The latest entry stays, so clients can tell the log was pruned
+        count, _ = ChangeNotificaion.objects.filter(date__lt=limit)\
+            .exclude(pk=latest).delete()
+        self.stdout.write('%d alterações removidas.' % count)
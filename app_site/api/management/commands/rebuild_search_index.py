@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from api.search import rebuild, searchable_models
+
+
+class Command(BaseCommand):
+    help = 'Refaz o índice de busca dos catadores e cooperativas.'
+
+    def handle(self, *args, **options):
+        for model in searchable_models():
+            count = rebuild(model)
+            self.stdout.write('%s: %d indexados.' % (
+                model._meta.verbose_name_plural, count))
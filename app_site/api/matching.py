@@ -0,0 +1,176 @@
+"""
+    Precomputed nearest catadores of each residue.
+
+    The top-k catadores are stored when the residue gets its location
+    (GeorefResidue) and recomputed only for the residues that can be affected
+    when a catador moves, joins or is deactivated: the ones already matched to
+    that catador and the ones whose match radius (distance of the k-th match)
+    reaches the catador's new position. The bounding box of each match radius
+    is stored with the residue, so only the residues whose box contains the
+    new position are read.
+
+    Stored matches are computed from the database (CatadorLastPosition), not
+    from the in-memory index, which may be stale in the process that
+    handles the change.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .calc_distance import bounding_box, haversine_km, k_nearest
+from .calc_distance import load_positions
+from .geohash import nearest_queryset
+from .spatial_index import catador_index, register_position_index
+
+NEAREST_CATADORES_K = 3
+
+
+def nearest_catadores(georef, k=NEAREST_CATADORES_K):
+    return catador_index.nearest((georef.latitude, georef.longitude), k=k)
+
+
+def stored_nearest_catadores(georef, k=NEAREST_CATADORES_K):
+    """
+    [(catador_id, distance_km), ...] of the k nearest active catadores, read
+    from the geohash cells around the residue.
+    """
+    from .models import CatadorLastPosition
+
+    positions = nearest_queryset(
+        CatadorLastPosition.objects.filter(catador__active=True),
+        georef.latitude, georef.longitude, k)
+    ids, lats, lons = load_positions(positions)
+    return k_nearest((georef.latitude, georef.longitude), ids, lats, lons, k=k)
+
+
+def match_box(georef, radius):
+    """
+    match_min_lat, match_max_lat, match_min_lon and match_max_lon of the
+    residue.
+    """
+    if radius is None:
+        return dict.fromkeys(('match_min_lat', 'match_max_lat',
+                              'match_min_lon', 'match_max_lon'))
+
+    min_lat, max_lat, min_lon, max_lon = \
+        bounding_box(georef.latitude, georef.longitude, radius)
+    return {'match_min_lat': min_lat, 'match_max_lat': max_lat,
+            'match_min_lon': min_lon, 'match_max_lon': max_lon}
+
+
+def refresh_residue_matches(georef_residue, k=NEAREST_CATADORES_K):
+    from .models import GeorefResidue, ResidueCatadorMatch
+
+    georef = georef_residue.georef
+    nearest = stored_nearest_catadores(georef, k=k)
+
+    # Less than k catadores: any new catador may enter the match set
+    radius = nearest[-1][1] if len(nearest) == k else None
+    box = match_box(georef, radius)
+    now = timezone.now()
+
+    with transaction.atomic():
+        ResidueCatadorMatch.objects.filter(
+            residue_id=georef_residue.residue_id).delete()
+        ResidueCatadorMatch.objects.bulk_create([
+            ResidueCatadorMatch(residue_id=georef_residue.residue_id,
+                                catador_id=catador_id,
+                                distance=distance,
+                                rank=rank)
+            for rank, (catador_id, distance) in enumerate(nearest)])
+        GeorefResidue.objects.filter(pk=georef_residue.pk).update(
+            match_radius=radius, matched_on=now, **box)
+
+    georef_residue.match_radius = radius
+    georef_residue.matched_on = now
+    for field, value in box.items():
+        setattr(georef_residue, field, value)
+
+
+def fill_match_boxes():
+    """
+    Bounding boxes of the matches stored before they had one.
+    """
+    from .models import GeorefResidue
+
+    for georef_residue in GeorefResidue.objects.filter(
+            match_radius__isnull=False, match_min_lat__isnull=True)\
+            .select_related('georef').iterator():
+        GeorefResidue.objects.filter(pk=georef_residue.pk).update(
+            **match_box(georef_residue.georef, georef_residue.match_radius))
+
+
+def match_unmatched_residues():
+    """
+    Store the matches of the residues located before they were stored.
+    Returns the number of residues.
+    """
+    from .models import GeorefResidue
+
+    count = 0
+    for georef_residue in GeorefResidue.objects.filter(matched_on__isnull=True)\
+            .select_related('georef').iterator():
+        refresh_residue_matches(georef_residue)
+        count += 1
+    return count
+
+
+class ResidueMatchUpdater(object):
+    """
+        Registered as a position index, so it receives the same
+        update/remove calls as the in-memory indexes.
+    """
+    built = True
+
+    def update(self, catador_id, latitude, longitude):
+        self.refresh(self.affected_residues(catador_id, latitude, longitude))
+
+    def remove(self, catador_id):
+        self.refresh(self.affected_residues(catador_id))
+
+    def affected_residues(self, catador_id, latitude=None, longitude=None):
+        from .models import GeorefResidue, ResidueCatadorMatch
+
+        residues = set(ResidueCatadorMatch.objects.filter(catador_id=catador_id)
+                       .values_list('residue_id', flat=True))
+
+        if latitude is None or longitude is None:
+            return residues
+
+        georefs = GeorefResidue.objects.filter(residue__active=True,
+                                               matched_on__isnull=False)
+
+        residues.update(georefs.filter(match_radius__isnull=True)
+                        .values_list('residue_id', flat=True))
+
+        # Boxes crossing the antimeridian go past +-180
+        in_box = Q()
+        for lon in (longitude, longitude - 360, longitude + 360):
+            in_box |= Q(match_min_lon__lte=lon, match_max_lon__gte=lon)
+
+        rows = list(georefs.filter(
+            in_box, match_min_lat__lte=latitude,
+            match_max_lat__gte=latitude).values_list(
+                'residue_id', 'georef__latitude', 'georef__longitude',
+                'match_radius'))
+
+        if rows:
+            rows = np.array(rows, dtype=np.float64)
+            dist = haversine_km(latitude, longitude, rows[:, 1], rows[:, 2])
+            residues.update(int(r) for r in rows[dist <= rows[:, 3], 0])
+
+        return residues
+
+    def refresh(self, residue_ids):
+        from .models import GeorefResidue
+
+        if not residue_ids:
+            return
+
+        for georef_residue in GeorefResidue.objects\
+                .filter(residue_id__in=residue_ids).select_related('georef'):
+            refresh_residue_matches(georef_residue)
+
+
+residue_matches = register_position_index(ResidueMatchUpdater())
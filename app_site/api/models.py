@@ -1,17 +1,30 @@
+from django.conf import settings
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from simple_history.models import HistoricalRecords
-from datetime import datetime
+from datetime import datetime, timedelta
 from versatileimagefield.fields import VersatileImageField
 from versatileimagefield.fields import PPOIField
-from .calc_distance import nearest_catadores
+from .spatial_index import position_indexes
+from .geohash import MAX_PRECISION, encode as encode_geohash
+from .geohash import backfill as backfill_geohash
+from .geohash import covering_cells, cells_q
+from .matching import fill_match_boxes, nearest_catadores
+from .matching import refresh_residue_matches
+from .gazetteer import get_gazetteer
+from . import heatmap
+from .caching import get_cache, invalidate, model_changed
+from . import search
+from . import tracks
 
 from django.contrib.auth.models import User
 from rest_framework.authtoken.models import Token
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.db.models.signals import pre_delete, post_migrate, post_init
 from django.dispatch import receiver
+from django.utils import timezone
 
 
 RESIDUE_QUANTITY = (
@@ -170,6 +183,8 @@ class Catador(BaseMapMarker):
     class Meta:
         verbose_name = 'Catador'
         verbose_name_plural = _('Catadores')
+        # Keyset pagination (see api/pagination.py)
+        index_together = [('modified_date', 'id')]
 
 
     # BOTA = 'B'
@@ -306,6 +321,8 @@ class Catador(BaseMapMarker):
     @property
     def photos(self):
         # PhotoCatador
+        if hasattr(self, 'prefetched_photos'):
+            return self.prefetched_photos
         objs = self.photocatador_set.all().order_by('created_on')
         return objs
 
@@ -321,6 +338,8 @@ class Catador(BaseMapMarker):
 
     @property
     def collects(self):
+        if hasattr(self, 'active_collects'):
+            return self.active_collects
         return self.collect_set.filter(active=True)
 
     @property
@@ -430,13 +449,21 @@ class Catador(BaseMapMarker):
 
 
 
-@receiver(post_save, sender=Catador)
-def save_catador_notification(sender, instance, **kwargs):
-    cn = ChangeNotificaion.objects.create(model_type='Catador', model_pk=instance.pk)
-    cn.save()
-
-
 class ChangeNotificaion(models.Model):
+    """
+        Change log read by the /api/changes/ feed. The pk is the sequence
+        number the clients sync from. Entries are only handed out once they
+        are older than settings.CHANGES_COMMIT_LAG, so transactions that
+        took a lower pk and commit late are not skipped, and are kept for
+        settings.CHANGES_RETENTION_DAYS (see the prune_changes command).
+    """
+    SAVE = 'save'
+    DELETE = 'delete'
+
+    ACTION_CHOICES = (
+        (SAVE, _('Alteração')),
+        (DELETE, _('Remoção')),
+    )
 
     class Meta:
         verbose_name = 'Alterações'
@@ -445,6 +472,31 @@ class ChangeNotificaion(models.Model):
     date = models.DateTimeField(auto_now=True, blank=False, null=False)
     model_type = models.CharField(max_length=50, verbose_name=_('Tipo'))
     model_pk = models.IntegerField(null=False, blank=False, help_text='Pk do objeto')
+    action = models.CharField(_('Ação'), max_length=10, choices=ACTION_CHOICES,
+                              default=SAVE)
+
+    @classmethod
+    def record(cls, model, pks, action=SAVE):
+        cls.objects.bulk_create([
+            cls(model_type=model.__name__, model_pk=pk, action=action)
+            for pk in pks])
+
+    @classmethod
+    def committed(cls):
+        """
+        Entries older than the commit lag.
+        """
+        lag = getattr(settings, 'CHANGES_COMMIT_LAG', 30)
+        return cls.objects.filter(
+            date__lte=timezone.now() - timedelta(seconds=lag))
+
+    @classmethod
+    def kept_since(cls, seq):
+        """
+        Whether every entry after `seq` is still in the log.
+        """
+        oldest = cls.objects.aggregate(oldest=models.Min('pk'))['oldest']
+        return oldest is None or seq >= oldest - 1
 
 
 class Collect(ModeratedModel):
@@ -500,6 +552,10 @@ class Collect(ModeratedModel):
         null=True,
         on_delete=models.SET_NULL)
 
+    def __init__(self, *args, **kwargs):
+        super(Collect, self).__init__(*args, **kwargs)
+        self._original_status = self.__dict__.get('status')
+
     def save(self, *args, **kwargs):
 
         # Autoupdate when updating catador
@@ -516,6 +572,10 @@ class Collect(ModeratedModel):
 
         super(Collect, self).save(*args, **kwargs)
 
+        if self.status != self._original_status:
+            self._original_status = self.status
+            heatmap.record_collects([self.pk], self.status)
+
     @property
     def geolocation(self):
         obj = self.latitudelongitudecoleta_set.all().latest('created_on')
@@ -523,11 +583,15 @@ class Collect(ModeratedModel):
 
     @property
     def photo_collect_catador(self):
+        if hasattr(self, 'prefetched_photos_catador'):
+            return self.prefetched_photos_catador
         objs = self.photocollectcatador_set.all().order_by('created_on')
         return objs
 
     @property
     def photo_collect_user(self):
+        if hasattr(self, 'prefetched_photos_user'):
+            return self.prefetched_photos_user
         objs = self.photocollectuser_set.all().order_by('created_on')
         return objs
 
@@ -579,6 +643,24 @@ class Material(ModeratedModel):
         return '%s - %s' % (self.name, self.description)
 
 
+class Region(models.Model):
+    """
+        Bairro loaded from the gazetteer GeoJSON (see load_regions)
+    """
+    name = models.CharField(max_length=128, verbose_name=_('Bairro'))
+    city = models.CharField(max_length=64, blank=True, null=True,
+                            verbose_name=_('Cidade'))
+    source_id = models.CharField(max_length=64, unique=True,
+                                 help_text='Id da feature no GeoJSON')
+
+    class Meta:
+        verbose_name = 'Bairro'
+        ordering = ('name',)
+
+    def __str__(self):
+        return self.name
+
+
 class LatitudeLongitude(ModeratedModel):
     """
         DOCS: TODO
@@ -588,6 +670,7 @@ class LatitudeLongitude(ModeratedModel):
 
     class Meta:
         verbose_name = 'GeoReferencia'
+        index_together = [('latitude', 'longitude')]
 
     # fields:
     latitude = models.FloatField(blank=False)
@@ -595,10 +678,88 @@ class LatitudeLongitude(ModeratedModel):
     # Reference point
     reverse_geocoding = models.CharField(max_length=500, default='', null=True, blank=True)
 
+    # Grid cell used by proximity queries (see api/geohash.py)
+    geohash = models.CharField(
+        max_length=MAX_PRECISION,
+        blank=True,
+        null=True,
+        editable=False,
+        db_index=True)
+
+    region = models.ForeignKey(
+        Region, blank=True, null=True, on_delete=models.SET_NULL)
+
+    def save(self, *args, **kwargs):
+        if self.latitude is not None and self.longitude is not None:
+            self.geohash = encode_geohash(float(self.latitude),
+                                          float(self.longitude))
+
+            gazetteer = get_gazetteer()
+            if gazetteer is not None:
+                self.region_id = gazetteer.locate(float(self.latitude),
+                                                  float(self.longitude))
+
+        super(LatitudeLongitude, self).save(*args, **kwargs)
+
+    @classmethod
+    def near(cls, latitude, longitude, radius_km, queryset=None):
+        """
+            Rows in the geohash cells that cover the circle of `radius_km`.
+            Exact distances still have to be checked by the caller.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        cells = covering_cells(latitude, longitude, radius_km)
+        return queryset.filter(cells_q(cells))
+
     def __str__(self):
         return '(' + str(self.latitude) + ', ' + str(self.longitude) + ')'
 
 
+class ReverseGeocodingCache(models.Model):
+    """
+        Address of a rounded coordinate (see api/geocoding.py)
+    """
+    key = models.CharField(max_length=32, unique=True)
+    address = models.CharField(max_length=500, blank=True, default='')
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Cache de Endereços'
+
+    def __str__(self):
+        return self.key + ' - ' + self.address
+
+
+class HeatmapCell(models.Model):
+    """
+        Residues located / collects entering a status per grid cell and day
+        (see api/heatmap.py)
+    """
+    KIND_CHOICES = (
+        (heatmap.RESIDUE, 'Resíduo'),
+        (heatmap.COLLECT, 'Coleta'),
+    )
+
+    cell = models.CharField(max_length=12)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    day = models.DateField()
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, blank=True, default='')
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Mapa de Calor'
+        unique_together = ('cell', 'day', 'kind', 'status')
+        index_together = [('latitude', 'longitude', 'day')]
+
+    def __str__(self):
+        return '%s %s %s %s: %d' % (self.cell, self.day, self.kind,
+                                    self.status, self.count)
+
+
 class GeorefCatador(models.Model):
     '''
         Esta classe esta sendo mantida pois futuramente
@@ -616,6 +777,182 @@ class GeorefCatador(models.Model):
                ', ' + str(self.georef.longitude) + ')'
 
 
+def sync_position_indexes(catador_ids):
+    """
+        Push the current position (CatadorLastPosition) of the given
+        catadores to the in-memory position indexes. Indexes that were not
+        built yet are skipped.
+    """
+    indexes = [index for index in position_indexes if index.built]
+    if not indexes:
+        return
+
+    catador_ids = set(catador_ids)
+    positions = dict(
+        (catador_id, (latitude, longitude))
+        for catador_id, latitude, longitude in CatadorLastPosition.objects
+        .filter(catador_id__in=catador_ids, catador__active=True)
+        .values_list('catador_id', 'latitude', 'longitude'))
+
+    for catador_id in catador_ids:
+        latest = positions.get(catador_id)
+        for index in indexes:
+            if latest is None:
+                index.remove(catador_id)
+            else:
+                index.update(catador_id, latest[0], latest[1])
+
+
+@receiver(post_save, sender=GeorefCatador)
+@receiver(post_delete, sender=GeorefCatador)
+def georef_catador_changed(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    tracks.georef_position(instance.catador_id)
+
+
+@receiver(post_init, sender=Catador)
+def catador_loaded(sender, instance, **kwargs):
+    # Not instance.active: it would load a deferred field
+    instance._loaded_active = instance.__dict__.get('active')
+
+
+@receiver(post_save, sender=Catador)
+def catador_position_changed(sender, instance, created, **kwargs):
+    # Joining/leaving (active flag) changes who can be matched
+    if kwargs.get('raw', False) or created:
+        return
+
+    if instance.active != instance._loaded_active:
+        instance._loaded_active = instance.active
+        sync_position_indexes([instance.pk])
+
+
+@receiver(post_save, sender=LatitudeLongitude)
+@receiver(post_delete, sender=LatitudeLongitude)
+def latitude_longitude_changed(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    if kwargs.get('signal') is post_save:
+        for georef_residue in GeorefResidue.objects\
+                .filter(georef_id=instance.pk).select_related('georef'):
+            refresh_residue_matches(georef_residue)
+
+    for catador_id in set(GeorefCatador.objects.filter(georef_id=instance.pk)
+                          .values_list('catador_id', flat=True)):
+        tracks.georef_position(catador_id)
+
+
+class CatadorTrack(models.Model):
+    """
+        Path walked by a catador in one day. The points are packed as
+        (seconds since midnight, latitude, longitude), see api/tracks.py
+    """
+    catador = models.ForeignKey(Catador, on_delete=models.CASCADE)
+    day = models.DateField()
+    points = models.BinaryField(default=b'')
+    count = models.IntegerField(default=0)
+    downsampled = models.BooleanField(default=False)
+    modified_date = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Trajeto'
+        unique_together = ('catador', 'day')
+
+    def __str__(self):
+        return str(self.catador_id) + ' - ' + str(self.day)
+
+
+class CatadorLastPosition(models.Model):
+    """
+        Current position of a catador: the latest point received by
+        /catadores/<pk>/track or /catadores/<pk>/georef, or the latest
+        GeorefCatador when none was received (see api/tracks.py).
+        modified_on tells the map snapshot and the list ETags which
+        positions moved.
+    """
+    catador = models.OneToOneField(
+        Catador, primary_key=True, related_name='last_position',
+        on_delete=models.CASCADE)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    recorded_on = models.DateTimeField()
+    track = models.ForeignKey(
+        CatadorTrack, blank=True, null=True, on_delete=models.SET_NULL)
+
+    modified_on = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Grid cell used by proximity queries (see api/geohash.py)
+    geohash = models.CharField(
+        max_length=MAX_PRECISION,
+        editable=False,
+        db_index=True)
+
+    region = models.ForeignKey(
+        Region, blank=True, null=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        index_together = [('latitude', 'longitude')]
+
+    def save(self, *args, **kwargs):
+        self.geohash = encode_geohash(float(self.latitude),
+                                      float(self.longitude))
+
+        gazetteer = get_gazetteer()
+        if gazetteer is not None:
+            self.region_id = gazetteer.locate(float(self.latitude),
+                                              float(self.longitude))
+
+        super(CatadorLastPosition, self).save(*args, **kwargs)
+
+
+def log_position_change(catador_id):
+    """
+        Change log entry of a catador whose position moved, at most one per
+        settings.POSITION_LOG_INTERVAL seconds, so pings do not flood the
+        feed of the synced clients.
+    """
+    interval = getattr(settings, 'POSITION_LOG_INTERVAL', 300)
+    if get_cache().add('position-logged:%d' % catador_id, True, interval):
+        ChangeNotificaion.record(Catador, [catador_id])
+
+
+@receiver(post_init, sender=CatadorLastPosition)
+def last_position_loaded(sender, instance, **kwargs):
+    instance._loaded_position = (instance.__dict__.get('latitude'),
+                                 instance.__dict__.get('longitude'))
+
+
+@receiver(post_save, sender=CatadorLastPosition)
+@receiver(post_delete, sender=CatadorLastPosition)
+def last_position_changed(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    position = (instance.latitude, instance.longitude)
+    # Pings from where the catador already was
+    if kwargs.get('signal') is post_save and not kwargs.get('created') and \
+            position == instance._loaded_position:
+        return
+    instance._loaded_position = position
+
+    sync_position_indexes([instance.catador_id])
+    # Only the position changed: no Catador UPDATE per ping. The detail
+    # representations show it, the map snapshot reads modified_on.
+    invalidate(Catador, instance.catador_id)
+    log_position_change(instance.catador_id)
+
+
+@receiver(post_migrate)
+def backfill_positions(sender, **kwargs):
+    if sender.label == 'api':
+        backfill_geohash(LatitudeLongitude.objects.filter(geohash__isnull=True))
+        tracks.backfill_last_positions()
+        fill_match_boxes()
+
+
 class Rating(ModeratedModel):
     """
         DOCS: TODO
@@ -734,6 +1071,11 @@ class PhotoResidue(PhotoBase):
 
 
 class Cooperative(models.Model):
+
+    class Meta:
+        # Keyset pagination (see api/pagination.py)
+        index_together = [('modified_date', 'id')]
+
     name = models.CharField(max_length=100)
     email = models.EmailField(max_length=100)
     phrase = models.CharField(max_length=200)
@@ -928,20 +1270,27 @@ class Residue(models.Model):
 
     @property
     def residue_location(self):
-        if GeorefResidue.objects.filter(residue=self).count() > 0:
-            return GeorefResidue.objects.filter(residue=self)[0].georef
+        try:
+            return self.georefresidue.georef
+        except GeorefResidue.DoesNotExist:
+            return None
 
     @property
     def nearest_catadores(self):
-        if not self.residue_location:
+        try:
+            georef_residue = self.georefresidue
+        except GeorefResidue.DoesNotExist:
             return []
 
-        coord_residue = (self.residue_location.latitude, self.residue_location.longitude)
-        coord_catadores = GeorefCatador.objects.all().only(
-            'catador__id', 'georef__latitude', 'georef__longitude')
+        # Residues located before the matches were stored; the
+        # match_residues command stores them
+        if georef_residue.matched_on is None:
+            return [catador_id for catador_id, distance in
+                    nearest_catadores(georef_residue.georef)]
 
-        lista_final = nearest_catadores(coord_residue, coord_catadores)
-        return lista_final
+        # Ordered by rank, and served from the prefetch cache when present
+        return [match.catador_id
+                for match in self.residuecatadormatch_set.all()]
 
 
 def collect_create(sender, instance, created, **kwargs):
@@ -959,6 +1308,45 @@ class GeorefResidue(models.Model):
     residue = models.OneToOneField(Residue, blank=False)
     georef = models.ForeignKey(LatitudeLongitude, blank=False)
 
+    # Distance of the farthest stored match, null while there are less
+    # matches than catadores requested (see api/matching.py)
+    match_radius = models.FloatField(blank=True, null=True, db_index=True)
+    matched_on = models.DateTimeField(blank=True, null=True)
+    # Bounding box of the match radius
+    match_min_lat = models.FloatField(blank=True, null=True, db_index=True)
+    match_max_lat = models.FloatField(blank=True, null=True, db_index=True)
+    match_min_lon = models.FloatField(blank=True, null=True)
+    match_max_lon = models.FloatField(blank=True, null=True)
+
+
+@receiver(post_save, sender=GeorefResidue)
+def georef_residue_created(sender, instance, created, **kwargs):
+    if kwargs.get('raw', False) or not created:
+        return
+
+    refresh_residue_matches(instance)
+
+    georef = instance.georef
+    heatmap.bump(georef.latitude, georef.longitude, heatmap.RESIDUE)
+    # The collect is opened with the residue, before it has a location
+    for status in Collect.objects.filter(residue_id=instance.residue_id)\
+            .values_list('status', flat=True):
+        heatmap.bump(georef.latitude, georef.longitude, heatmap.COLLECT,
+                     status)
+
+
+class ResidueCatadorMatch(models.Model):
+    """
+        Nearest catadores of a residue, stored when the residue is located.
+    """
+    residue = models.ForeignKey(Residue, on_delete=models.CASCADE)
+    catador = models.ForeignKey(Catador, on_delete=models.CASCADE)
+    distance = models.FloatField(verbose_name=_('Distância (km)'))
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ('rank',)
+
 
 class Partner(ModeratedModel):
     name = models.CharField(max_length=100)
@@ -998,3 +1386,231 @@ class CallStatistics(models.Model):
 
     def __str__(self):
         return 'Estatística'
+
+
+# Changes to the rows nested in the catador/cooperative representations bump
+# the parent's modified_date, which the ETag/Last-Modified validators of the
+# API (and the keyset pagination) are based on.
+TOUCH_PARENTS = {
+    GeorefCatador: ((Catador, 'catador_id'),),
+    MobileCatador: ((Catador, 'catador_id'),),
+    PhotoCatador: ((Catador, 'catador_id'),),
+    Collect: ((Catador, 'catador_id'),),
+    MobileCooperative: ((Cooperative, 'cooperative_id'),),
+    PhotoCooperative: ((Cooperative, 'cooperative_id'),),
+    RatingCooperative: ((Cooperative, 'cooperative_id'),),
+    UserProfile: ((Catador, 'user_id'), (Cooperative, 'user_id')),
+}
+
+
+# Models synced by the mobile clients through /api/changes/
+CHANGE_LOG_MODELS = (Catador, Cooperative, Material)
+
+
+def touch(model, **lookup):
+    pks = list(model.objects.filter(**lookup).values_list('pk', flat=True))
+    if not pks:
+        return
+
+    model.objects.filter(pk__in=pks).update(modified_date=timezone.now())
+    # Changes of the nested objects are changes of the parent for the sync
+    # feed (see the changes view)
+    if model in CHANGE_LOG_MODELS:
+        ChangeNotificaion.record(model, pks)
+
+    if model is Catador:
+        # Also drops the cached detail representations (see CatadorViewSet)
+        for pk in pks:
+            invalidate(Catador, pk)
+
+
+def touch_parents(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    for model, attname in TOUCH_PARENTS[sender]:
+        value = getattr(instance, attname)
+        if value is not None:
+            lookup = 'user_id' if attname == 'user_id' else 'pk'
+            touch(model, **{lookup: value})
+
+
+for touched_sender in TOUCH_PARENTS:
+    post_save.connect(touch_parents, sender=touched_sender)
+    post_delete.connect(touch_parents, sender=touched_sender)
+
+
+@receiver(post_save, sender=LatitudeLongitude)
+def touch_georef_parents(sender, instance, **kwargs):
+    if kwargs.get('raw', False) or kwargs.get('created', False):
+        return
+
+    touch(Catador, georefcatador__georef_id=instance.pk)
+
+
+def touch_m2m_parent(sender, instance, action, reverse, model, pk_set,
+                     **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            touch(type(instance), pk=instance.pk)
+        return
+
+    # material.catador_set.add(...): the parents are the other side
+    if action == 'pre_clear':
+        source, target = [
+            next(f.attname for f in sender._meta.fields
+                 if f.related_model is related)
+            for related in (type(instance), model)]
+        instance._touch_pks = list(sender.objects.filter(
+            **{source: instance.pk}).values_list(target, flat=True))
+    elif action == 'post_clear':
+        touch(model, pk__in=getattr(instance, '_touch_pks', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        touch(model, pk__in=pk_set)
+
+
+@receiver(post_save, sender=Catador)
+@receiver(post_delete, sender=Catador)
+def catador_changed(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+    invalidate(Catador, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def catador_user_changed(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+    # The email is part of the representation; no touch, logins save users
+    for pk in Catador.objects.filter(user_id=instance.pk)\
+            .values_list('pk', flat=True):
+        invalidate(Catador, pk)
+
+
+@receiver(post_save, sender=Mobile)
+def touch_mobile_parents(sender, instance, created, **kwargs):
+    if kwargs.get('raw', False) or created:
+        return
+    touch(Catador, mobilecatador__mobile_id=instance.pk)
+    touch(Cooperative, mobilecooperative__mobile_id=instance.pk)
+
+
+@receiver(post_init, sender=Collect)
+def collect_loaded(sender, instance, **kwargs):
+    instance._loaded_catador_id = instance.__dict__.get('catador_id')
+
+
+@receiver(post_save, sender=Collect)
+def touch_previous_catador(sender, instance, **kwargs):
+    # The new catador is touched through TOUCH_PARENTS
+    if kwargs.get('raw', False):
+        return
+
+    previous = instance._loaded_catador_id
+    if previous is not None and previous != instance.catador_id:
+        touch(Catador, pk=previous)
+    instance._loaded_catador_id = instance.catador_id
+
+
+@receiver(post_save, sender=PhotoCollectUser)
+@receiver(post_delete, sender=PhotoCollectUser)
+@receiver(post_save, sender=PhotoCollectCatador)
+@receiver(post_delete, sender=PhotoCollectCatador)
+def touch_collect_photo_parents(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+    touch(Catador, collect__pk=instance.coleta_id)
+
+
+m2m_changed.connect(touch_m2m_parent, sender=Catador.materials_collected.through)
+m2m_changed.connect(touch_m2m_parent, sender=Cooperative.materials_collected.through)
+m2m_changed.connect(touch_m2m_parent, sender=Cooperative.partners.through)
+
+
+# Catalog endpoints served from the versioned response cache (api/caching.py)
+for cached_model in (Material, Partner):
+    post_save.connect(model_changed, sender=cached_model)
+    post_delete.connect(model_changed, sender=cached_model)
+
+# Also reloads the gazetteer of every process (api/gazetteer.py)
+post_save.connect(model_changed, sender=Region)
+post_delete.connect(model_changed, sender=Region)
+
+
+def record_change(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+    action = ChangeNotificaion.SAVE if 'created' in kwargs \
+        else ChangeNotificaion.DELETE
+    ChangeNotificaion.record(sender, [instance.pk], action)
+
+
+for synced_model in CHANGE_LOG_MODELS:
+    post_save.connect(record_change, sender=synced_model)
+    post_delete.connect(record_change, sender=synced_model)
+
+
+# Full-text search index (api/search.py)
+@receiver(post_migrate)
+def create_search_tables(sender, using, **kwargs):
+    if sender.label == 'api':
+        search.create_tables(using)
+
+
+def index_search_object(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+    search.index_object(instance)
+
+
+def remove_search_object(sender, instance, **kwargs):
+    search.remove_object(sender, instance.pk)
+
+
+def index_search_materials(sender, instance, action, reverse, model, pk_set,
+                           **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        search.index_object(instance)
+    elif pk_set:
+        # material.catador_set.add(...)
+        search.index_objects(model.objects.filter(pk__in=pk_set)
+                             .prefetch_related('materials_collected'))
+
+
+@receiver(pre_delete, sender=Material)
+def material_search_owners(sender, instance, **kwargs):
+    # The links are gone by post_delete
+    instance._search_owners = [
+        list(model.objects.filter(materials_collected=instance)
+             .prefetch_related('materials_collected'))
+        for model in search.searchable_models()]
+
+
+@receiver(post_save, sender=Material)
+@receiver(post_delete, sender=Material)
+def index_search_material_owners(sender, instance, **kwargs):
+    if kwargs.get('raw', False):
+        return
+
+    owners = getattr(instance, '_search_owners', None)
+    if owners is None:
+        if kwargs.get('created', False):
+            return
+        owners = [model.objects.filter(materials_collected=instance)
+                  .prefetch_related('materials_collected')
+                  for model in search.searchable_models()]
+
+    # Prefetched before the delete, they still list the material
+    skip = instance.pk if kwargs.get('signal') is post_delete else None
+    for objects in owners:
+        search.index_objects(objects, skip_material=skip)
+
+
+for searchable_model in search.searchable_models():
+    post_save.connect(index_search_object, sender=searchable_model)
+    post_delete.connect(remove_search_object, sender=searchable_model)
+    m2m_changed.connect(index_search_materials,
+                        sender=searchable_model.materials_collected.through)
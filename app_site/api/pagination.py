@@ -1,4 +1,14 @@
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
 from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class PostLimitOffSetPagination(LimitOffsetPagination):
@@ -10,4 +20,94 @@ class PostLimitOffSetPagination(LimitOffsetPagination):
 
 
 class PostPageNumberPagination(PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """
+        Cursor pagination on (modified_date, id), ascending, so deep pages
+        and full syncs cost the same as the first page:
+
+        /api/catadores/
+        /api/catadores/?cursor=<next>&page_size=100
+
+        Rows without modified_date (legacy data) come first, ordered by id.
+        Only forward links are given.
+    """
+    page_size = 50
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        size = self.page_size
+
+        rows = []
+        if cursor is None or cursor[0] is None:
+            nulls = queryset.filter(modified_date__isnull=True)
+            if cursor is not None:
+                nulls = nulls.filter(id__gt=cursor[1])
+            rows = list(nulls.order_by('id')[:size + 1])
+
+        if len(rows) <= size:
+            rest = queryset.filter(modified_date__isnull=False)
+            if cursor is not None and cursor[0] is not None:
+                modified, pk = cursor
+                rest = rest.filter(Q(modified_date__gt=modified) |
+                                   Q(modified_date=modified, id__gt=pk))
+            rows += list(rest.order_by('modified_date', 'id')
+                         [:size + 1 - len(rows)])
+
+        self.has_next = len(rows) > size
+        rows = rows[:size]
+        self.last = rows[-1] if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            value = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            modified, pk = value.rsplit('|', 1)
+            pk = int(pk)
+            if modified:
+                modified = parse_datetime(modified)
+                if modified is None:
+                    raise ValueError(value)
+            else:
+                modified = None
+        except (TypeError, ValueError, UnicodeError, binascii.Error):
+            raise NotFound('Cursor inválido')
+
+        return modified, pk
+
+    def encode_cursor(self, obj):
+        modified = obj.modified_date.isoformat() if obj.modified_date else ''
+        value = '%s|%d' % (modified, obj.pk)
+        return urlsafe_b64encode(value.encode('ascii')).decode('ascii')
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.cursor_query_param,
+                                  self.encode_cursor(self.last))
+        return url
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
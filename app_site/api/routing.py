@@ -0,0 +1,137 @@
+"""
+    Visiting order of the accepted collects of a catador.
+
+    The route starts at the catador's current position and is built with the
+    nearest neighbour heuristic, then improved with 2-opt on a precomputed
+    haversine distance matrix. Routes are cached per catador until the set
+    of collects (or their locations) changes.
+"""
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .calc_distance import haversine_km
+
+
+def distance_matrix(coords):
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return haversine_km(coords[:, 0:1], coords[:, 1:2],
+                        coords[:, 0], coords[:, 1])
+
+
+def nearest_neighbour(dist):
+    """
+    Open path from node 0 always moving to the closest unvisited node.
+    """
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    visited[0] = True
+    order = [0]
+
+    for _ in range(n - 1):
+        row = np.where(visited, np.inf, dist[order[-1]])
+        nxt = int(np.argmin(row))
+        visited[nxt] = True
+        order.append(nxt)
+
+    return order
+
+
+def two_opt(dist, order, max_rounds=50):
+    """
+    Reverse segments of the path while that makes it shorter. The first
+    node (the catador) stays in place and the path is open, so the last
+    edge of a reversed tail is free.
+    """
+    order = np.array(order)
+    n = len(order)
+    if n < 4:
+        return order.tolist()
+
+    for _ in range(max_rounds):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = order[i - 1], order[i]
+            c = order[i + 1:]
+            d = np.append(order[i + 2:], -1)
+
+            delta = dist[a, c] - dist[a, b]
+            inner = d >= 0
+            delta[inner] += dist[b, d[inner]] - dist[c[inner], d[inner]]
+
+            j = int(np.argmin(delta))
+            if delta[j] < -1e-9:
+                j += i + 1
+                order[i:j + 1] = order[i:j + 1][::-1].copy()
+                improved = True
+        if not improved:
+            break
+
+    return order.tolist()
+
+
+def solve_route(coords):
+    """
+    coords[0] is the starting point. Returns (order, legs in km).
+    """
+    dist = distance_matrix(coords)
+    order = two_opt(dist, nearest_neighbour(dist))
+    legs = [float(dist[a, b]) for a, b in zip(order, order[1:])]
+    return order, legs
+
+
+def catador_position(catador_id):
+    from .models import CatadorLastPosition
+
+    return CatadorLastPosition.objects.filter(catador_id=catador_id)\
+        .values_list('latitude', 'longitude').first()
+
+
+def route_signature(stops):
+    data = ';'.join('%d:%.6f:%.6f' % stop for stop in sorted(stops))
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def collect_route(catador_id):
+    """
+    {'start': [lat, lon], 'total_km': float, 'collects': [...]} with the
+    catador's active ACEITA collects in visiting order.
+    """
+    from .models import Collect
+
+    stops = list(Collect.objects.filter(
+        catador_id=catador_id, status=Collect.ACEITA, active=True,
+        residue__georefresidue__isnull=False).values_list(
+            'pk', 'residue__georefresidue__georef__latitude',
+            'residue__georefresidue__georef__longitude'))
+
+    key = 'collect_route:%d' % catador_id
+    signature = route_signature(stops)
+    cached = cache.get(key)
+    if cached is not None and cached['signature'] == signature:
+        return cached['route']
+
+    start = catador_position(catador_id)
+    if start is None and stops:
+        start = stops[0][1:]
+
+    collects = []
+    total = 0.0
+    if stops:
+        order, legs = solve_route([start] + [stop[1:] for stop in stops])
+        for node, leg in zip(order[1:], legs):
+            pk, latitude, longitude = stops[node - 1]
+            collects.append({'id': pk, 'latitude': latitude,
+                             'longitude': longitude, 'distance': leg})
+        total = sum(legs)
+
+    route = {
+        'start': list(start) if start else None,
+        'total_km': total,
+        'collects': collects,
+    }
+    cache.set(key, {'signature': signature, 'route': route},
+              getattr(settings, 'COLLECT_ROUTE_CACHE_TIMEOUT', 86400))
+    return route
@@ -0,0 +1,333 @@
+"""
+    Full-text search over catadores and cooperatives.
+
+    Each searchable model has a search table (api_search_<model>) with one
+    document per object: the name fields, the address fields and the names
+    of the materials collected, kept in sync by the signals in models.py
+    (`python manage.py rebuild_search_index` fills it for existing rows).
+    The backend comes from settings.SEARCH_BACKEND, or from the database
+    vendor when it is not set:
+
+        sqlite      FTS5 table ranked with bm25 (icontains filters when the
+                    sqlite library was built without FTS5)
+        postgresql  weighted tsvector (GIN) plus trigram word similarity,
+                    which also finds misspelled names (PostgreSQL 9.6+ with
+                    the pg_trgm extension, icontains filters otherwise)
+        others      unranked icontains filters, no search table
+
+    Both search tables ignore accents: "sao" finds "São".
+
+    search() returns the pks best match first; views keep that order with
+    order_by_pks.
+"""
+import logging
+import re
+import unicodedata
+from abc import ABCMeta, abstractmethod
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connections, router
+from django.db import transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+NAME_FIELDS = ('name', 'nickname')
+ADDRESS_FIELDS = ('address_base', 'address_region', 'region', 'city', 'state')
+# Relative weight of the name, address and materials columns
+WEIGHTS = (10.0, 2.0, 1.0)
+MAX_WORDS = 8
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+logger = logging.getLogger(__name__)
+
+
+def words(text):
+    return WORD_RE.findall(text.lower())[:MAX_WORDS]
+
+
+def fold(text):
+    """
+    Lowercase text without accents ('São' -> 'sao').
+    """
+    return ''.join(char for char in unicodedata.normalize('NFKD', text)
+                   if not unicodedata.combining(char)).lower()
+
+
+def table_name(model):
+    return 'api_search_%s' % model._meta.model_name
+
+
+def join(values):
+    return ' '.join(value for value in values if value)
+
+
+def document(instance, materials=None):
+    """
+    (name, address, materials) texts of the object.
+    """
+    if materials is None:
+        materials = instance.materials_collected.values_list('name', flat=True)
+    return (join(getattr(instance, field, None) for field in NAME_FIELDS),
+            join(getattr(instance, field, None) for field in ADDRESS_FIELDS),
+            join(materials))
+
+
+class SearchBackend(metaclass=ABCMeta):
+    """
+        Backends with a search table implement setup, index, remove and
+        clear besides search; the cursor is of the database of the model.
+    """
+
+    @classmethod
+    def available(cls, connection):
+        return True
+
+    def setup(self, cursor, model):
+        pass
+
+    def index(self, cursor, model, pk, name, address, materials):
+        pass
+
+    def remove(self, cursor, model, pk):
+        pass
+
+    def clear(self, cursor, model):
+        pass
+
+    @abstractmethod
+    def search(self, cursor, model, words, limit):
+        """
+        pks of the objects matching every word, best match first.
+        """
+
+
+class SQLiteFTSBackend(SearchBackend):
+
+    @classmethod
+    def available(cls, connection):
+        try:
+            with transaction.atomic(using=connection.alias), \
+                    connection.cursor() as cursor:
+                cursor.execute('CREATE VIRTUAL TABLE temp.search_probe '
+                               'USING fts5(text)')
+                cursor.execute('DROP TABLE temp.search_probe')
+        except OperationalError:
+            return False
+        return True
+
+    def setup(self, cursor, model):
+        cursor.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5('
+            'name, address, materials, tokenize="unicode61")'
+            % table_name(model))
+
+    def index(self, cursor, model, pk, name, address, materials):
+        self.remove(cursor, model, pk)
+        cursor.execute(
+            'INSERT INTO %s (rowid, name, address, materials) '
+            'VALUES (%%s, %%s, %%s, %%s)' % table_name(model),
+            [pk, name, address, materials])
+
+    def remove(self, cursor, model, pk):
+        cursor.execute('DELETE FROM %s WHERE rowid = %%s' % table_name(model),
+                       [pk])
+
+    def clear(self, cursor, model):
+        cursor.execute('DELETE FROM %s' % table_name(model))
+
+    def search(self, cursor, model, words, limit):
+        # Every word, as a prefix
+        query = ' '.join('"%s"*' % word for word in words)
+        table = table_name(model)
+        cursor.execute(
+            'SELECT rowid FROM %s WHERE %s MATCH %%s '
+            'ORDER BY bm25(%s, %s) LIMIT %%s'
+            % (table, table, table, ', '.join(str(w) for w in WEIGHTS)),
+            [query, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend(SearchBackend):
+    """
+        The documents and the queries are folded (see fold), as the
+        text search configurations keep the accents.
+    """
+
+    @classmethod
+    def available(cls, connection):
+        # word_similarity needs PostgreSQL 9.6, and managed databases may
+        # not let this user create the extension
+        if connection.pg_version < 90600:
+            logger.warning('Busca: PostgreSQL %s sem word_similarity, usando '
+                           'icontains', connection.pg_version)
+            return False
+        try:
+            with transaction.atomic(using=connection.alias), \
+                    connection.cursor() as cursor:
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError as error:
+            logger.warning('Busca: extensão pg_trgm indisponível (%s), usando '
+                           'icontains', error)
+            return False
+        return True
+
+    def config(self):
+        return getattr(settings, 'SEARCH_CONFIG', 'portuguese')
+
+    def setup(self, cursor, model):
+        table = table_name(model)
+        cursor.execute(
+            'CREATE TABLE IF NOT EXISTS %s (object_id integer PRIMARY KEY, '
+            'text text NOT NULL, document tsvector NOT NULL)' % table)
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s_document ON %s '
+                       'USING gin (document)' % (table, table))
+        cursor.execute('CREATE INDEX IF NOT EXISTS %s_text ON %s '
+                       'USING gin (text gin_trgm_ops)' % (table, table))
+
+    def index(self, cursor, model, pk, name, address, materials):
+        name, address, materials = fold(name), fold(address), fold(materials)
+        cursor.execute(
+            'INSERT INTO %s (object_id, text, document) VALUES (%%s, %%s, '
+            "setweight(to_tsvector(%%s, %%s), 'A') || "
+            "setweight(to_tsvector(%%s, %%s), 'B') || "
+            "setweight(to_tsvector(%%s, %%s), 'C')) "
+            'ON CONFLICT (object_id) DO UPDATE '
+            'SET text = EXCLUDED.text, document = EXCLUDED.document'
+            % table_name(model),
+            [pk, join((name, address, materials)), self.config(), name,
+             self.config(), address, self.config(), materials])
+
+    def remove(self, cursor, model, pk):
+        cursor.execute('DELETE FROM %s WHERE object_id = %%s'
+                       % table_name(model), [pk])
+
+    def clear(self, cursor, model):
+        cursor.execute('TRUNCATE %s' % table_name(model))
+
+    def search(self, cursor, model, words, limit):
+        # Weights of the D, C, B and A labels
+        weights = '{0.1, %s, %s, %s}' % tuple(
+            w / WEIGHTS[0] for w in reversed(WEIGHTS))
+        words = [fold(word) for word in words]
+        text = ' '.join(words)
+        cursor.execute(
+            'SELECT object_id FROM %s, to_tsquery(%%s, %%s) query '
+            'WHERE document @@ query OR %%s <%%%% text '
+            'ORDER BY ts_rank(%%s::float4[], document, query) + '
+            'word_similarity(%%s, text) DESC LIMIT %%s' % table_name(model),
+            [self.config(), ' & '.join('%s:*' % word for word in words),
+             text, weights, text, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+class ContainsBackend(SearchBackend):
+
+    def search(self, cursor, model, words, limit):
+        names = set(field.name for field in model._meta.get_fields())
+        q = Q()
+        for word in words:
+            word_q = Q(materials_collected__name__icontains=word)
+            for field in NAME_FIELDS + ADDRESS_FIELDS:
+                if field in names:
+                    word_q |= Q(**{field + '__icontains': word})
+            q &= word_q
+        return list(model.objects.filter(q).order_by('pk').distinct()
+                    .values_list('pk', flat=True)[:limit])
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backends = {}
+_ready = set()
+
+
+def get_backend(using):
+    vendor = connections[using].vendor
+    if vendor not in _backends:
+        path = getattr(settings, 'SEARCH_BACKEND', None)
+        backend_class = import_string(path) if path else \
+            VENDOR_BACKENDS.get(vendor, ContainsBackend)
+        if not backend_class.available(connections[using]):
+            backend_class = ContainsBackend
+        _backends[vendor] = backend_class()
+    return _backends[vendor]
+
+
+def searchable_models():
+    from .models import Catador, Cooperative
+    return (Catador, Cooperative)
+
+
+def create_tables(using):
+    with connections[using].cursor() as cursor:
+        for model in searchable_models():
+            get_backend(using).setup(cursor, model)
+
+
+def ensure_tables(using):
+    # Databases migrated before the search tables existed
+    if using not in _ready:
+        create_tables(using)
+        _ready.add(using)
+
+
+def index_object(instance, materials=None):
+    model = type(instance)
+    using = router.db_for_write(model)
+    ensure_tables(using)
+    with connections[using].cursor() as cursor:
+        get_backend(using).index(cursor, model, instance.pk,
+                                 *document(instance, materials))
+
+
+def index_objects(objects, skip_material=None):
+    """
+    Index objects fetched with prefetch_related('materials_collected').
+    """
+    for instance in objects:
+        index_object(instance, [
+            material.name for material in instance.materials_collected.all()
+            if material.pk != skip_material])
+
+
+def remove_object(model, pk):
+    using = router.db_for_write(model)
+    ensure_tables(using)
+    with connections[using].cursor() as cursor:
+        get_backend(using).remove(cursor, model, pk)
+
+
+def rebuild(model):
+    """
+    Index every object of the model again. Returns the number of objects.
+    """
+    using = router.db_for_write(model)
+    count = 0
+    with connections[using].cursor() as cursor:
+        backend = get_backend(using)
+        backend.setup(cursor, model)
+        backend.clear(cursor, model)
+        for instance in model.objects.prefetch_related('materials_collected'):
+            backend.index(cursor, model, instance.pk, *document(
+                instance, [m.name for m in instance.materials_collected.all()]))
+            count += 1
+    return count
+
+
+def search(model, text, limit=None):
+    """
+    pks of the objects matching every word of `text`, best match first.
+    """
+    text_words = words(text)
+    if not text_words:
+        return []
+
+    limit = limit or getattr(settings, 'SEARCH_MAX_RESULTS', 100)
+    using = router.db_for_read(model)
+    ensure_tables(using)
+    with connections[using].cursor() as cursor:
+        return get_backend(using).search(cursor, model, text_words, limit)
@@ -4,7 +4,9 @@ from base64 import b64decode
 import uuid
 
 from django.core.files.base import ContentFile
+from django.db.models import Prefetch
 from .models import Catador
+from .models import CatadorLastPosition
 from .models import Rating
 from .models import Mobile
 from .models import MobileCatador
@@ -20,9 +22,71 @@ from .models import Material
 from .models import GeorefCatador
 from .models import PhotoCollectUser
 from .models import PhotoCollectCatador
+from .models import PhotoCatador
 from .models import PhotoCooperative
 from .models import Partner
 from .models import GeneralErros
+from .models import Region
+
+
+class DynamicFieldsMixin(object):
+    """
+        Sparse fieldsets driven by the query string:
+
+            ?fields=id,name,geolocation   only these fields
+            ?expand=photos,collects       nested/computed fields to add
+
+        Without either parameter every field is rendered. Once one of them
+        is given, nested serializers, related lists and
+        SerializerMethodFields are only rendered when named, so nothing is
+        queried for them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(DynamicFieldsMixin, self).__init__(*args, **kwargs)
+
+        keep = self.sparse_fields(self.context.get('request'), self.fields)
+        if keep is not None:
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+    @staticmethod
+    def is_expandable(field):
+        return isinstance(field, (serializers.BaseSerializer,
+                                  serializers.ManyRelatedField,
+                                  serializers.SerializerMethodField))
+
+    @classmethod
+    def sparse_fields(cls, request, fields):
+        if request is None:
+            return None
+
+        params = request.query_params
+        requested = [f for f in params.get('fields', '').split(',') if f]
+        expand = [f for f in params.get('expand', '').split(',') if f]
+        if not requested and not expand:
+            return None
+
+        if requested:
+            keep = set(requested)
+        else:
+            keep = set(name for name, field in fields.items()
+                       if not cls.is_expandable(field))
+        return keep | set(expand)
+
+    @classmethod
+    def rendered_fields(cls, request):
+        """
+        Names of the fields rendered for the request, None for all.
+        """
+        if cls.sparse_fields(request, {}) is None:
+            return None
+        return set(cls(context={'request': request}).fields)
+
+
+def wants(fields, *names):
+    return fields is None or any(name in fields for name in names)
 
 
 class PhotoBaseSerializer(serializers.HyperlinkedModelSerializer):
@@ -85,12 +149,32 @@ class MaterialSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'description')
 
 
+class RegionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Region
+        fields = ('id', 'name', 'city')
+
+
 class LatitudeLongitudeSerializer(serializers.ModelSerializer):
     class Meta:
         model = LatitudeLongitude
         fields = ('latitude', 'longitude', 'reverse_geocoding')
 
 
+class LastPositionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CatadorLastPosition
+        fields = ('latitude', 'longitude', 'recorded_on')
+
+
+def last_position_data(catador):
+    # Reverse one-to-one: missing rows raise an AttributeError subclass
+    position = getattr(catador, 'last_position', None)
+    if position is None:
+        return None
+    return LastPositionSerializer(position).data
+
+
 class MobileSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mobile
@@ -143,8 +227,13 @@ class CollectSerializer(serializers.ModelSerializer):
 class CatadorsPositionsSerializer(serializers.ModelSerializer):
     class Meta:
         model = Catador
-        fields = ['id', 'geolocation']
+        fields = ['id', 'geolocation', 'last_position']
     geolocation = LatitudeLongitudeSerializer(required=False, many=True)
+    # Current position, moved by the pings (see api/tracks.py)
+    last_position = serializers.SerializerMethodField()
+
+    def get_last_position(self, obj):
+        return last_position_data(obj)
 
 
 # class UserBasicSerializer(serializers.RelatedField):
@@ -152,8 +241,9 @@ class CatadorsPositionsSerializer(serializers.ModelSerializer):
 #         return '{id: %d, first_name: %s, last_name: %s, email: %s}' % (value.id, value.first_name, value.last_name, value.email)
 
 
-class CatadorSerializer(serializers.ModelSerializer):
+class CatadorSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     geolocation = LatitudeLongitudeSerializer(read_only=True, many=True)
+    last_position = serializers.SerializerMethodField()
     phones = MobileSerializer(read_only=True, many=True)
     collects = CollectSerializer(read_only=True, many=True)
     photos = PhotoSerializer(read_only=True, many=True)
@@ -164,9 +254,48 @@ class CatadorSerializer(serializers.ModelSerializer):
         model = Catador
         exclude = ['created_on', 'mobile_m2m', 'georef_m2m', 'rating_m2m']
 
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        """
+        Load every relation the rendered fields touch in a fixed number of
+        queries, whatever the number of catadores.
+        """
+        if wants(fields, 'profile_photo', 'email'):
+            queryset = queryset.select_related('user__userprofile')
+        if wants(fields, 'geolocation'):
+            queryset = queryset.prefetch_related('georef_m2m')
+        if wants(fields, 'last_position'):
+            queryset = queryset.select_related('last_position')
+        if wants(fields, 'phones'):
+            queryset = queryset.prefetch_related('mobile_m2m')
+        if wants(fields, 'materials_collected'):
+            queryset = queryset.prefetch_related('materials_collected')
+
+        if wants(fields, 'photos'):
+            queryset = queryset.prefetch_related(Prefetch(
+                'photocatador_set',
+                queryset=PhotoCatador.objects.order_by('created_on'),
+                to_attr='prefetched_photos'))
+
+        if wants(fields, 'collects'):
+            collects = Collect.objects.filter(active=True).prefetch_related(
+                Prefetch('photocollectuser_set',
+                         queryset=PhotoCollectUser.objects.order_by('created_on'),
+                         to_attr='prefetched_photos_user'),
+                Prefetch('photocollectcatador_set',
+                         queryset=PhotoCollectCatador.objects.order_by('created_on'),
+                         to_attr='prefetched_photos_catador'))
+            queryset = queryset.prefetch_related(Prefetch(
+                'collect_set', queryset=collects, to_attr='active_collects'))
+
+        return queryset
+
     def get_email(self, obj):
         return obj.user.email
 
+    def get_last_position(self, obj):
+        return last_position_data(obj)
+
 
 class PhotoResidueSerializer(serializers.ModelSerializer):
     class Meta:
@@ -180,7 +309,7 @@ class MaterialTypeSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class ResidueSerializer(serializers.ModelSerializer):
+class ResidueSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     latitude = serializers.SerializerMethodField()
     longitude = serializers.SerializerMethodField()
     reverse_geocoding = serializers.SerializerMethodField()
@@ -198,6 +327,19 @@ class ResidueSerializer(serializers.ModelSerializer):
         model = Residue
         fields = '__all__'
 
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wants(fields, 'latitude', 'longitude', 'reverse_geocoding',
+                 'nearest_catadores'):
+            queryset = queryset.select_related('georefresidue__georef')
+        if wants(fields, 'photos'):
+            queryset = queryset.prefetch_related('photoresidue_set')
+        if wants(fields, 'materials'):
+            queryset = queryset.prefetch_related('materials')
+        if wants(fields, 'nearest_catadores'):
+            queryset = queryset.prefetch_related('residuecatadormatch_set')
+        return queryset
+
     def get_nearest_catadores(self, obj):
         return obj.nearest_catadores
 
@@ -241,7 +383,7 @@ class PartnerSerializer(serializers.ModelSerializer):
         fields = ('pk', 'name', 'image')
 
 
-class CooperativeSerializer(serializers.ModelSerializer):
+class CooperativeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     phones = MobileSerializer(required=False, many=True)
     photos = serializers.SerializerMethodField()
     geolocation = LatitudeLongitudeSerializer(read_only=True, many=True)
@@ -257,6 +399,20 @@ class CooperativeSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         return Cooperative(**validated_data)
 
+    @staticmethod
+    def setup_eager_loading(queryset, fields=None):
+        if wants(fields, 'profile_photo'):
+            queryset = queryset.select_related('user__userprofile')
+        if wants(fields, 'phones', 'mobile_m2m'):
+            queryset = queryset.prefetch_related('mobile_m2m')
+        for lookup, field in (('photocooperative_set', 'photos'),
+                              ('partners', 'partners'),
+                              ('materials_collected', 'materials_collected'),
+                              ('rating_m2m', 'rating_m2m')):
+            if wants(fields, field):
+                queryset = queryset.prefetch_related(lookup)
+        return queryset
+
     def get_photos(self, obj):
         return PhotoCooperativeSerializer(obj.photocooperative_set, many=True).data
 
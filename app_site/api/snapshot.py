@@ -0,0 +1,225 @@
+"""
+    Prebuilt snapshot of the public map markers.
+
+    The snapshot is a compact JSON file (one row per marker: model, id, type,
+    latitude, longitude and material ids) written to settings.MAP_SNAPSHOT_DIR
+    together with gzip and, when the brotli package is installed, brotli
+    copies, so the map snapshot view only streams files. It records the
+    change log sequence it was built from (see the changes view) and when
+    it was built; rebuilds only re-read the markers logged after it and the
+    catadores whose position (CatadorLastPosition) moved since.
+"""
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+FILE_NAME = 'markers.json'
+FIELDS = ('model', 'id', 'type', 'latitude', 'longitude', 'materials')
+
+# Encodings served by the view, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def snapshot_dir():
+    return getattr(settings, 'MAP_SNAPSHOT_DIR',
+                   os.path.join(settings.BASE_DIR, 'snapshots'))
+
+
+def snapshot_path(suffix=''):
+    return os.path.join(snapshot_dir(), FILE_NAME + suffix)
+
+
+def current_seq():
+    from .models import ChangeNotificaion
+    return ChangeNotificaion.committed().aggregate(seq=Max('pk'))['seq'] or 0
+
+
+def moved_catadores(snapshot):
+    """
+    pks of the catadores whose position moved after the snapshot was built
+    (or that may have, within the commit lag), or None without a timestamp.
+    """
+    from .models import CatadorLastPosition
+
+    built_on = parse_datetime(snapshot.get('positions_on') or '')
+    if built_on is None:
+        return None
+
+    lag = getattr(settings, 'CHANGES_COMMIT_LAG', 30)
+    return set(CatadorLastPosition.objects.filter(
+        modified_on__gt=built_on - timedelta(seconds=lag))
+        .values_list('catador_id', flat=True))
+
+
+def material_sets(through, owner, pks):
+    materials = {}
+    queryset = through.objects.order_by('material_id')
+    if pks is not None:
+        queryset = queryset.filter(**{owner + '__in': pks})
+    for owner_id, material_id in queryset.values_list(owner, 'material_id'):
+        materials.setdefault(owner_id, []).append(material_id)
+    return materials
+
+
+def catador_markers(pks=None):
+    from .models import Catador, CatadorLastPosition, ModeratedModel
+
+    catadores = Catador.objects.filter(active=True).exclude(
+        moderation_status=ModeratedModel.REJECTED)
+    last_positions = CatadorLastPosition.objects.all()
+    if pks is not None:
+        catadores = catadores.filter(pk__in=pks)
+        last_positions = last_positions.filter(catador_id__in=pks)
+
+    positions = dict((catador_id, (latitude, longitude))
+                     for catador_id, latitude, longitude in
+                     last_positions.values_list(
+                         'catador_id', 'latitude', 'longitude'))
+    materials = material_sets(Catador.materials_collected.through,
+                              'catador_id', pks)
+
+    return [['catador', pk, catador_type] + list(positions[pk]) +
+            [materials.get(pk, [])]
+            for pk, catador_type in catadores.values_list('pk', 'catador_type')
+            if pk in positions]
+
+
+def cooperative_markers(pks=None):
+    from .models import BaseMapMarker, Cooperative
+
+    cooperatives = Cooperative.objects.filter(latitude__isnull=False,
+                                              longitude__isnull=False)
+    if pks is not None:
+        cooperatives = cooperatives.filter(pk__in=pks)
+    materials = material_sets(Cooperative.materials_collected.through,
+                              'cooperative_id', pks)
+
+    return [['cooperative', pk, BaseMapMarker.COOPERATIVA, latitude, longitude,
+             materials.get(pk, [])]
+            for pk, latitude, longitude in cooperatives.values_list(
+                'pk', 'latitude', 'longitude')]
+
+
+def materials():
+    from .models import Material
+    return dict((str(pk), name) for pk, name in
+                Material.objects.order_by('pk').values_list('pk', 'name'))
+
+
+def build(seq):
+    return {
+        'seq': seq,
+        'positions_on': timezone.now().isoformat(),
+        'fields': FIELDS,
+        'materials': materials(),
+        'markers': sorted(catador_markers() + cooperative_markers()),
+    }
+
+
+def update(snapshot, seq, moved):
+    """
+    The snapshot with the markers logged after snapshot['seq'] and the
+    `moved` catadores reloaded, or None when it has to be built again.
+    """
+    from .models import ChangeNotificaion
+
+    if moved is None or snapshot.get('seq', 0) > seq or \
+            not ChangeNotificaion.kept_since(snapshot.get('seq', 0)):
+        return None
+
+    positions_on = timezone.now().isoformat()
+
+    changed = {}
+    for model_type, model_pk in ChangeNotificaion.committed().filter(
+            pk__gt=snapshot['seq'], pk__lte=seq)\
+            .values_list('model_type', 'model_pk'):
+        changed.setdefault(model_type, set()).add(model_pk)
+
+    if 'Material' in changed:
+        # Deleted materials leave no log entry for their markers
+        return None
+
+    catadores = changed.get('Catador', set()) | moved
+    cooperatives = changed.get('Cooperative', set())
+    markers = [marker for marker in snapshot['markers']
+               if marker[1] not in (catadores if marker[0] == 'catador'
+                                    else cooperatives)]
+    if catadores:
+        markers += catador_markers(catadores)
+    if cooperatives:
+        markers += cooperative_markers(cooperatives)
+
+    return dict(snapshot, seq=seq, positions_on=positions_on,
+                markers=sorted(markers))
+
+
+def load():
+    try:
+        with open(snapshot_path(), 'rb') as snapshot_file:
+            return json.loads(snapshot_file.read().decode('utf-8'))
+    except (IOError, ValueError):
+        return None
+
+
+def write_file(path, content):
+    # Readers never see a partial file, concurrent writers never share one
+    fd, tmp = tempfile.mkstemp(dir=snapshot_dir(), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as output:
+            output.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def write(snapshot):
+    content = json.dumps(snapshot, separators=(',', ':')).encode('utf-8')
+
+    if not os.path.isdir(snapshot_dir()):
+        os.makedirs(snapshot_dir())
+
+    write_file(snapshot_path('.gz'),
+               gzip.compress(content, compresslevel=9))
+    if brotli is not None:
+        write_file(snapshot_path('.br'), brotli.compress(content))
+    elif os.path.exists(snapshot_path('.br')):
+        # Left by an install that had brotli, it would be served stale
+        os.remove(snapshot_path('.br'))
+    write_file(snapshot_path(), content)
+    return len(content)
+
+
+def build_snapshot(full=False):
+    """
+    Write the snapshot if the change log advanced or a position moved since
+    the last one. Returns (seq, number of markers), or None when it was up
+    to date.
+    """
+    seq = current_seq()
+    snapshot = None if full else load()
+
+    if snapshot is not None:
+        moved = moved_catadores(snapshot)
+        if snapshot.get('seq') == seq and moved == set():
+            return None
+        snapshot = update(snapshot, seq, moved)
+
+    if snapshot is None:
+        snapshot = build(seq)
+
+    write(snapshot)
+    return seq, len(snapshot['markers'])
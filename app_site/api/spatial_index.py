@@ -0,0 +1,177 @@
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from scipy.spatial import cKDTree
+
+from .calc_distance import EARTH_RADIUS_KM
+
+
+def to_unit_vectors(lats, lons):
+    """
+    Project lat/lon (degrees) onto the unit sphere. The euclidean (chord)
+    distance between two of these vectors is monotonic with the great-circle
+    distance, so a plain KD-tree gives correct k-nearest answers.
+    """
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon),
+                            np.sin(lat)))
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord / 2.0, 0.0, 1.0))
+
+
+def load_catador_positions():
+    """
+    Current position of every active catador, {catador_id: (lat, lon)}.
+    """
+    from .models import CatadorLastPosition
+
+    rows = CatadorLastPosition.objects.filter(catador__active=True)\
+        .values_list('catador_id', 'latitude', 'longitude')
+
+    return dict((catador_id, (lat, lon)) for catador_id, lat, lon in rows)
+
+
+class CatadorSpatialIndex(object):
+    """
+        Process-local KD-tree of catador positions.
+
+        The tree is built lazily on the first lookup. Changes coming from
+        signals are kept in a small delta (moved/new points, searched by brute
+        force) plus a set of stale tree rows, and the tree is rebuilt from
+        memory once the delta grows past `rebuild_threshold`. The whole index
+        is reloaded from the database after `max_age` seconds, so changes made
+        by other processes are eventually picked up.
+    """
+
+    def __init__(self, loader=load_catador_positions, max_age=None,
+                 rebuild_threshold=256):
+        self.loader = loader
+        self.max_age = max_age
+        self.rebuild_threshold = rebuild_threshold
+        self._lock = threading.RLock()
+        self.reset()
+
+    @property
+    def built(self):
+        return self._positions is not None
+
+    def reset(self):
+        with self._lock:
+            self._positions = None
+            self._built_on = None
+            self._tree = None
+            self._ids = np.empty(0, dtype=np.int64)
+            self._rows = {}
+            self._stale = set()
+            self._delta = {}
+
+    def _get_max_age(self):
+        if self.max_age is not None:
+            return self.max_age
+        return getattr(settings, 'SPATIAL_INDEX_MAX_AGE', 300)
+
+    def _ensure_built(self):
+        max_age = self._get_max_age()
+        expired = self._built_on is not None and max_age and \
+            time.time() - self._built_on > max_age
+
+        if not self.built or expired:
+            self._positions = self.loader()
+            self._built_on = time.time()
+            self._rebuild()
+
+    def _rebuild(self):
+        ids = list(self._positions.keys())
+        self._ids = np.array(ids, dtype=np.int64)
+        self._rows = dict((catador_id, row) for row, catador_id in enumerate(ids))
+        self._stale = set()
+        self._delta = {}
+
+        if ids:
+            coords = np.array(list(self._positions.values()), dtype=np.float64)
+            self._tree = cKDTree(to_unit_vectors(coords[:, 0], coords[:, 1]))
+        else:
+            self._tree = None
+
+    def _maybe_rebuild(self):
+        if len(self._delta) + len(self._stale) > self.rebuild_threshold:
+            self._rebuild()
+
+    def update(self, catador_id, latitude, longitude):
+        with self._lock:
+            if not self.built:
+                return
+
+            self._positions[catador_id] = (latitude, longitude)
+            if catador_id in self._rows:
+                self._stale.add(catador_id)
+            self._delta[catador_id] = (latitude, longitude)
+            self._maybe_rebuild()
+
+    def remove(self, catador_id):
+        with self._lock:
+            if not self.built:
+                return
+
+            self._positions.pop(catador_id, None)
+            if catador_id in self._rows:
+                self._stale.add(catador_id)
+            self._delta.pop(catador_id, None)
+            self._maybe_rebuild()
+
+    def nearest(self, coord, k=3):
+        """
+        Return [(catador_id, distance_km), ...] for the k nearest catadores.
+        """
+        with self._lock:
+            self._ensure_built()
+
+            if k <= 0:
+                return []
+
+            point = to_unit_vectors([coord[0]], [coord[1]])[0]
+            candidates = []
+
+            if self._tree is not None:
+                n = len(self._ids)
+                wanted = min(k + len(self._stale), n)
+                dist, idx = self._tree.query(point, k=wanted)
+                dist = np.atleast_1d(dist)
+                idx = np.atleast_1d(idx)
+
+                for d, i in zip(dist, idx):
+                    if i >= n:
+                        continue
+                    catador_id = int(self._ids[i])
+                    if catador_id not in self._stale:
+                        candidates.append((catador_id, d))
+
+            if self._delta:
+                delta_ids = list(self._delta.keys())
+                coords = np.array(list(self._delta.values()), dtype=np.float64)
+                vectors = to_unit_vectors(coords[:, 0], coords[:, 1])
+                dist = np.sqrt(((vectors - point) ** 2).sum(axis=1))
+                candidates.extend(zip(delta_ids, dist))
+
+            candidates.sort(key=lambda c: c[1])
+            return [(int(catador_id), float(chord_to_km(d)))
+                    for catador_id, d in candidates[:k]]
+
+
+# In-memory indexes of catador positions kept up to date by the
+# CatadorLastPosition signals (see models.sync_position_indexes)
+position_indexes = []
+
+
+def register_position_index(index):
+    position_indexes.append(index)
+    return index
+
+
+catador_index = register_position_index(CatadorSpatialIndex())
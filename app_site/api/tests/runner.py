@@ -0,0 +1,31 @@
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+        Runs the tests on an empty response cache in a temporary directory,
+        so they neither read nor clear the cache of the running site.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+
+        self.cache_dir = tempfile.mkdtemp()
+        caches = dict(settings.CACHES)
+        caches['responses'] = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.cache_dir,
+        }
+        self.caches = override_settings(CACHES=caches)
+        self.caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches.disable()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+        super(TestRunner, self).teardown_test_environment(**kwargs)
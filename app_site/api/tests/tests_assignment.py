@@ -0,0 +1,103 @@
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+
+from ..assignment import assign_open_collects, solve
+from ..caching import get_cache, response_cache
+from ..models import Catador, Collect, GeorefCatador, GeorefResidue
+from ..models import LatitudeLongitude, Residue
+from ..spatial_index import catador_index
+
+
+class AssignmentSolverTestCase(SimpleTestCase):
+
+    def problem(self, capacity, catador_materials, collect_materials):
+        # Two collects near Sé, one in Pinheiros; catadores at Sé and Mooca
+        return {
+            'collect_ids': np.array([1, 2, 3], dtype=np.int64),
+            'collect_coords': np.array([[-23.5503, -46.6339],
+                                        [-23.5510, -46.6330],
+                                        [-23.5670, -46.7010]]),
+            'collect_materials': np.array(collect_materials, dtype=bool),
+            'catador_ids': np.array([10, 20], dtype=np.int64),
+            'catador_coords': np.array([[-23.5505, -46.6333],
+                                        [-23.5544, -46.5940]]),
+            'catador_materials': np.array(catador_materials, dtype=bool),
+            'capacity': np.array(capacity, dtype=np.int64),
+        }
+
+    def test_capacity_moves_collect_to_next_catador(self):
+        problem = self.problem([1, 5], [[True], [True]],
+                               [[True], [True], [True]])
+        result = solve(problem)
+
+        # Catador 10 is full after the closest collect, Mooca is beyond
+        # 10 km from Pinheiros
+        self.assertEqual(result[2][0], 10)
+        self.assertEqual(result[1][0], 20)
+        self.assertNotIn(3, result)
+
+    def test_materials_and_distance(self):
+        # Catador 10 does not collect the second material
+        problem = self.problem([5, 5], [[True, False], [True, True]],
+                               [[True, False], [True, True], [True, False]])
+        result = solve(problem)
+
+        self.assertEqual(result[1][0], 10)
+        self.assertEqual(result[2][0], 20)
+        self.assertEqual(result[3][0], 10)
+
+        self.assertEqual(solve(problem, max_distance_km=0.01), {})
+
+
+class SaveAssignmentTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        get_cache().clear()
+        response_cache.clear()
+        catador_index.reset()
+
+        user = User.objects.create_user('assigned', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=user)
+        georef = LatitudeLongitude.objects.create(latitude=-23.5505,
+                                                  longitude=-46.6333)
+        GeorefCatador.objects.create(catador=self.catador, georef=georef)
+
+        residue = Residue.objects.create(description='Garrafas', user=user,
+                                         quantity='S')
+        georef = LatitudeLongitude.objects.create(latitude=-23.5510,
+                                                  longitude=-46.6340)
+        GeorefResidue.objects.create(residue=residue, georef=georef)
+        self.collect = Collect.objects.get(residue=residue)
+
+    def tearDown(self):
+        catador_index.reset()
+
+    def test_catador_detail_changes(self):
+        path = '/api/catadores/%d/' % self.catador.pk
+        before = self.client.get(path)
+        self.assertEqual(before.data['collects'], [])
+
+        self.assertEqual(assign_open_collects()['saved'], 1)
+
+        after = self.client.get(path, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual([c['pk'] for c in after.data['collects']],
+                         [self.collect.pk])
+
+    def test_dry_run_string_false_saves(self):
+        admin = User.objects.create_superuser('admin', 'a@a.a', 'test')
+        self.client.force_authenticate(admin)
+
+        response = self.client.post('/api/collect/assign/',
+                                    {'dry_run': 'true'})
+        self.assertEqual(response.data['saved'], 0)
+
+        response = self.client.post('/api/collect/assign/',
+                                    {'dry_run': 'false'})
+        self.assertEqual(response.data['saved'], 1)
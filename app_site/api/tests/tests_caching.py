@@ -0,0 +1,169 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from ..caching import LRUCache, get_cache, response_cache, single_flight
+from ..models import Catador, Collect, Material, Mobile, MobileCatador
+from ..models import Partner, Residue
+
+
+class VersionedCacheTestCase(APITestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        response_cache.clear()
+
+        Partner.objects.create(name='Parceiro', image='cooperatives/partners/a.png')
+        Material.objects.create(name='Vidro', description='Garrafas')
+
+        self.user = User.objects.create_user('caching', password='test')
+
+    def test_partners_served_without_queries(self):
+        first = self.client.get('/api/partners/')
+        self.assertEqual(first.status_code, 200)
+
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/partners/')
+        self.assertEqual(second.content, first.content)
+
+    @override_settings(RESPONSE_CACHE='default')
+    def test_not_cached_on_a_per_process_backend(self):
+        self.client.get('/api/partners/')
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/partners/')
+
+    def test_save_invalidates(self):
+        self.client.force_authenticate(self.user)
+        self.client.get('/api/materials/')
+
+        Material.objects.create(name='Papel', description='Jornal')
+        response = self.client.get('/api/materials/')
+        self.assertEqual(response.data['count'], 2)
+
+    def test_delete_invalidates(self):
+        self.client.get('/api/partners/')
+        Partner.objects.all().delete()
+
+        response = self.client.get('/api/partners/')
+        self.assertEqual(response.data, [])
+
+
+class CatadorDetailCacheTestCase(APITestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        response_cache.clear()
+
+        user = User.objects.create_user('detail', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=user)
+        self.path = '/api/catadores/%d/' % self.catador.pk
+
+    def test_detail_served_from_cache(self):
+        first = self.client.get(self.path)
+
+        # Only the ETag validator row
+        with self.assertNumQueries(1):
+            second = self.client.get(self.path)
+        self.assertEqual(second.content, first.content)
+
+    def test_nested_change_invalidates(self):
+        first = self.client.get(self.path)
+        self.assertEqual(first.data['phones'], [])
+
+        mobile = Mobile.objects.create(phone='1234-1234', mno='V')
+        MobileCatador.objects.create(mobile=mobile, catador=self.catador)
+
+        response = self.client.get(self.path,
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['phones']), 1)
+
+    def test_reverse_m2m_change_invalidates(self):
+        first = self.client.get(self.path)
+        material = Material.objects.create(name='Vidro', description='')
+        material.catador_set.add(self.catador)
+
+        response = self.client.get(self.path,
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['materials_collected']), 1)
+
+        material.catador_set.clear()
+        response = self.client.get(self.path,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['materials_collected'], [])
+
+    def test_reassigned_collect_invalidates_previous_catador(self):
+        user = User.objects.create_user('residue', password='test')
+        residue = Residue.objects.create(description='Garrafas', user=user,
+                                         quantity='S')
+        collect = Collect.objects.get(residue=residue)
+        collect.catador = self.catador
+        collect.save()
+        first = self.client.get(self.path)
+
+        other = Catador.objects.create(name='Outro', nickname='o', user=user)
+        collect = Collect.objects.get(pk=collect.pk)
+        collect.catador = other
+        collect.save()
+
+        response = self.client.get(self.path,
+                                   HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['collects'], [])
+
+    def test_inactive_catador_not_found(self):
+        self.client.get(self.path)
+        self.catador.active = False
+        self.catador.save()
+
+        self.assertEqual(self.client.get(self.path).status_code, 404)
+
+
+class LRUCacheTestCase(SimpleTestCase):
+
+    def test_entries_expire(self):
+        lru = LRUCache(10, timeout=60)
+        lru.set('key', 'value')
+        self.assertEqual(lru.get('key'), 'value')
+
+        lru = LRUCache(10, timeout=0)
+        lru.set('key', 'value')
+        self.assertIsNone(lru.get('key'))
+
+    def test_least_recently_used_is_dropped(self):
+        lru = LRUCache(2, timeout=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b')), (1, None))
+
+
+class SingleFlightTestCase(SimpleTestCase):
+
+    def test_concurrent_misses_build_once(self):
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(single_flight('key', build)))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
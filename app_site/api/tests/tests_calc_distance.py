@@ -0,0 +1,60 @@
+import numpy as np
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+
+from ..calc_distance import haversine_km, k_nearest, batch_k_nearest
+from ..calc_distance import chunk_rows
+
+
+class CalcDistanceTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.ids = np.array([10, 20, 30, 40], dtype=np.int64)
+        # Sé, Mooca, Pinheiros, Rio de Janeiro
+        self.lats = np.array([-23.5503, -23.5544, -23.5670, -22.9068])
+        self.lons = np.array([-46.6339, -46.5940, -46.7010, -43.1729])
+
+    def test_haversine_known_distance(self):
+        dist = haversine_km(-23.5505, -46.6333,
+                            np.array([-22.9068]), np.array([-43.1729]))
+        # Sao Paulo -> Rio de Janeiro is roughly 360 km
+        self.assertAlmostEqual(float(dist[0]), 360.7, delta=2)
+
+    def test_k_nearest_is_ordered(self):
+        result = k_nearest((-23.5505, -46.6333),
+                           self.ids, self.lats, self.lons, k=3)
+        self.assertEqual([cat for cat, dist in result], [10, 20, 30])
+        self.assertTrue(result[0][1] < result[1][1] < result[2][1])
+
+    def test_k_bigger_than_list(self):
+        result = k_nearest((-22.9, -43.17), self.ids, self.lats, self.lons, k=10)
+        self.assertEqual(len(result), 4)
+        self.assertEqual(result[0][0], 40)
+
+    def test_empty_list(self):
+        empty = np.array([])
+        self.assertEqual(k_nearest((0, 0), empty, empty, empty), [])
+
+    def test_batch_matches_single_lookups(self):
+        points = [(-23.5505, -46.6333), (-22.9, -43.17), (-23.56, -46.70)]
+        result = batch_k_nearest(points, self.ids, self.lats, self.lons,
+                                 k=2, chunk_size=2)
+        self.assertEqual(len(result), 3)
+        for point, nearest in zip(points, result):
+            single = k_nearest(point, self.ids, self.lats, self.lons, k=2)
+            self.assertEqual([c for c, d in nearest], [c for c, d in single])
+
+    def test_chunk_rows_fit_the_budget(self):
+        self.assertEqual(chunk_rows(100000, budget_mb=0), 1)
+        rows = chunk_rows(100000, budget_mb=64)
+        self.assertTrue(rows * 100000 * 8 <= 64 * 1024 * 1024)
+        self.assertTrue(chunk_rows(10, budget_mb=64) > rows)
+
+
+class NearestBatchViewTestCase(APITestCase):
+
+    def test_invalid_materials(self):
+        response = self.client.post('/api/nearest-catadores/batch/', {
+            'points': [{'latitude': -23.55, 'longitude': -46.63}],
+            'materials': ['vidro']}, format='json')
+        self.assertEqual(response.status_code, 400)
@@ -1,9 +1,16 @@
 import json
+from unittest import mock
 
 from django.contrib.auth.models import User
-from ..models import Catador, Material, LatitudeLongitude, GeorefCatador
+from django.db import ProgrammingError, connection
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from ..models import Catador, Cooperative, Material, LatitudeLongitude
+from ..models import GeorefCatador
 from ..models import Mobile
 from ..models import MobileCatador
+from ..models import Collect
+from ..search import PostgresSearchBackend, fold
 #
 # from .tests_general import BaseTestCase
 from rest_framework.test import APITestCase
@@ -84,3 +91,242 @@ class CatadorTestCase(APITestCase):
         self.data['catador']['nickname'] = 'Catador Nickname 2'
         response = self.client.post('/api/edit_catador/', self.data, format='json')
         self.assertEqual(response.status_code, 200)
+
+    def test_filter_by_radius(self):
+        params = {'lat': -16.74, 'lon': -43.87, 'radius_km': 5}
+        response = self.client.get('/api/catadores/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([c['id'] for c in response.data],
+                         [self.data['catador']['id']])
+
+    def test_filter_by_radius_excludes_far_catadores(self):
+        params = {'lat': -23.55, 'lon': -46.63, 'radius_km': 5}
+        response = self.client.get('/api/catadores/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 0)
+
+    def test_filter_by_radius_uses_latest_position(self):
+        georeference = LatitudeLongitude.objects.create(latitude=-23.55,
+                                                        longitude=-46.63)
+        GeorefCatador.objects.create(georef=georeference,
+                                     catador_id=self.data['catador']['id'])
+
+        params = {'lat': -16.74, 'lon': -43.87, 'radius_km': 5}
+        response = self.client.get('/api/catadores/', params)
+        self.assertEqual(response.data, [])
+
+    @override_settings(POSITION_MAX_RESULTS=1)
+    def test_filter_by_radius_returns_the_nearest(self):
+        user = User.objects.create_user('nearer', password='test')
+        nearer = Catador.objects.create(name='Perto', nickname='p', user=user)
+        georeference = LatitudeLongitude.objects.create(latitude=-16.7401,
+                                                        longitude=-43.8701)
+        GeorefCatador.objects.create(georef=georeference, catador=nearer)
+
+        params = {'lat': -16.74, 'lon': -43.87, 'radius_km': 5}
+        response = self.client.get('/api/catadores/', params)
+        self.assertEqual([c['id'] for c in response.data], [nearer.pk])
+
+    def test_filter_by_bbox(self):
+        response = self.client.get('/api/catadores/', {'bbox': '-44,-17,-43,-16'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+
+    def test_filter_by_invalid_bbox(self):
+        response = self.client.get('/api/catadores/', {'bbox': '-44,-17'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CatadorQueryCountTestCase(APITestCase):
+
+    def _create_catadores(self, n):
+        for i in range(n):
+            user = User.objects.create_user('queries%d' % i, password='test')
+            catador = Catador.objects.create(name='Catador %d' % i,
+                                             nickname='c%d' % i, user=user)
+            georef = LatitudeLongitude.objects.create(latitude=-23.55 + i,
+                                                      longitude=-46.63)
+            GeorefCatador.objects.create(georef=georef, catador=catador)
+            mobile = Mobile.objects.create(phone='1234-%04d' % i, mno='V')
+            MobileCatador.objects.create(mobile=mobile, catador=catador)
+            Collect.objects.create(catador=catador)
+
+    def _list_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/catadores/')
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_query_count_is_constant(self):
+        self._create_catadores(2)
+        few = self._list_queries()
+
+        self._create_catadores(8)
+        self.assertEqual(self._list_queries(), few)
+
+    def test_sparse_fields(self):
+        self._create_catadores(3)
+        full = self._list_queries()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/catadores/',
+                                       {'fields': 'id,name,geolocation'})
+        self.assertEqual(set(response.data['results'][0]),
+                         {'id', 'name', 'geolocation'})
+        self.assertLess(len(queries), full)
+
+    def test_expand_adds_nested_fields(self):
+        self._create_catadores(1)
+        response = self.client.get('/api/catadores/', {'expand': 'phones'})
+
+        catador = response.data['results'][0]
+        self.assertIn('name', catador)
+        self.assertIn('phones', catador)
+        self.assertNotIn('collects', catador)
+        self.assertNotIn('photos', catador)
+
+    def test_keyset_pagination_walks_every_catador(self):
+        self._create_catadores(7)
+
+        seen = []
+        response = self.client.get('/api/catadores/', {'page_size': 3})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen += [c['id'] for c in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(sorted(seen), sorted(
+            Catador.objects.values_list('pk', flat=True)))
+        self.assertEqual(len(seen), len(set(seen)))
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/catadores/', {'cursor': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTestCase(APITestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('conditional', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=user)
+
+    def test_list_not_modified(self):
+        response = self.client.get('/api/catadores/')
+        etag = response['ETag']
+
+        response = self.client.get('/api/catadores/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        georef = LatitudeLongitude.objects.create(latitude=-23.55,
+                                                  longitude=-46.63)
+        GeorefCatador.objects.create(georef=georef, catador=self.catador)
+
+        response = self.client.get('/api/catadores/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_detail_if_modified_since(self):
+        path = '/api/catadores/%d/' % self.catador.pk
+        response = self.client.get(path)
+        last_modified = response['Last-Modified']
+
+        response = self.client.get(path, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_fields(self):
+        full = self.client.get('/api/catadores/')
+        sparse = self.client.get('/api/catadores/', {'fields': 'id'})
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+
+
+class CatadorSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.glass = Material.objects.create(name='Vidro', description='')
+        self.catadores = {}
+        for name, nickname, city in (('Maria Silva', 'Vidreira', 'Santos'),
+                                     ('João Souza', 'Joca', 'São Paulo'),
+                                     ('Ana Lima', 'Aninha', 'São Paulo')):
+            user = User.objects.create_user(nickname, password='test')
+            self.catadores[nickname] = Catador.objects.create(
+                name=name, nickname=nickname, city=city, user=user)
+
+    def search(self, text):
+        response = self.client.get('/api/catadores/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [catador['nickname'] for catador in response.data]
+
+    def test_address_and_accents(self):
+        self.assertEqual(sorted(self.search('sao paulo')), ['Aninha', 'Joca'])
+
+    def test_prefix_of_name(self):
+        self.assertEqual(self.search('Sou'), ['Joca'])
+
+    def test_materials_kept_in_sync(self):
+        self.assertEqual(self.search('vidro'), [])
+
+        self.catadores['Aninha'].materials_collected.add(self.glass)
+        self.assertEqual(self.search('vidro'), ['Aninha'])
+
+        self.glass.name = 'Garrafas'
+        self.glass.save()
+        self.assertEqual(self.search('garrafas'), ['Aninha'])
+
+    def test_name_ranked_first(self):
+        self.catadores['Aninha'].materials_collected.add(self.glass)
+        self.catadores['Vidreira'].name = 'Maria Vidro'
+        self.catadores['Vidreira'].save()
+
+        self.assertEqual(self.search('vidro'), ['Vidreira', 'Aninha'])
+
+    def test_deleted_catador_is_removed(self):
+        self.catadores['Joca'].delete()
+        self.assertEqual(self.search('joão'), [])
+
+    def test_deleted_material_is_removed(self):
+        self.catadores['Aninha'].materials_collected.add(self.glass)
+        self.glass.delete()
+        self.assertEqual(self.search('vidro'), [])
+
+
+class CooperativeSearchTestCase(APITestCase):
+
+    def setUp(self):
+        self.paper = Material.objects.create(name='Papelão', description='')
+        for name in ('Cooperativa Recicla Sul', 'Coopernorte'):
+            user = User.objects.create_user(name, password='test')
+            Cooperative.objects.create(name=name, user=user, city='São Paulo')
+
+    def search(self, text):
+        response = self.client.get('/api/cooperatives/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [cooperative['name'] for cooperative in response.data]
+
+    def test_name_and_address(self):
+        self.assertEqual(self.search('recicla'), ['Cooperativa Recicla Sul'])
+        self.assertEqual(sorted(self.search('sao paulo')),
+                         ['Cooperativa Recicla Sul', 'Coopernorte'])
+
+    def test_materials(self):
+        cooperative = Cooperative.objects.get(name='Coopernorte')
+        self.paper.cooperative_set.add(cooperative)
+        self.assertEqual(self.search('papelao'), ['Coopernorte'])
+
+
+class SearchBackendTestCase(SimpleTestCase):
+
+    def test_fold(self):
+        self.assertEqual(fold('São JOÃO Pacaembú'), 'sao joao pacaembu')
+
+    def test_postgres_falls_back_without_pg_trgm(self):
+        self.assertFalse(PostgresSearchBackend.available(
+            mock.Mock(pg_version=90500)))
+
+        connection = mock.MagicMock(pg_version=100000)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.side_effect = ProgrammingError('permission denied')
+        with mock.patch('api.search.transaction.atomic'):
+            self.assertFalse(PostgresSearchBackend.available(connection))
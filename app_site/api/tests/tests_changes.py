@@ -0,0 +1,100 @@
+import datetime
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from ..models import Catador, ChangeNotificaion, Cooperative, Material
+from ..models import Mobile, MobileCatador
+
+
+@override_settings(CHANGES_COMMIT_LAG=0)
+class ChangesFeedTestCase(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('changes', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=self.user)
+        self.seq = self.client.get('/api/changes/').data['seq']
+
+    def changes(self, since, **params):
+        params['since'] = since
+        response = self.client.get('/api/changes/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_only_changes_after_seq(self):
+        material = Material.objects.create(name='Vidro', description='Garrafas')
+
+        data = self.changes(self.seq)
+        self.assertEqual([(c['type'], c['id'], c['action'])
+                          for c in data['changes']],
+                         [('material', material.pk, 'save')])
+        self.assertEqual(data['changes'][0]['data']['name'], 'Vidro')
+        self.assertEqual(self.changes(data['seq'])['changes'], [])
+
+    def test_object_sent_once_with_latest_state(self):
+        self.catador.name = 'Novo nome'
+        self.catador.save()
+        mobile = Mobile.objects.create(phone='1234-1234', mno='V')
+        MobileCatador.objects.create(mobile=mobile, catador=self.catador)
+
+        changes = self.changes(self.seq)['changes']
+        self.assertEqual(len(changes), 1)
+        self.assertEqual(changes[0]['data']['name'], 'Novo nome')
+        self.assertEqual(len(changes[0]['data']['phones']), 1)
+
+    def test_deletions(self):
+        user = User.objects.create_user('cooperative', password='test')
+        cooperative = Cooperative.objects.create(name='Cooperativa', user=user)
+        seq = self.changes(self.seq)['seq']
+        pk = cooperative.pk
+        cooperative.delete()
+
+        changes = self.changes(seq)['changes']
+        self.assertEqual([(c['type'], c['id'], c['action'], c['data'])
+                          for c in changes],
+                         [('cooperative', pk, 'delete', None)])
+
+    def test_limit(self):
+        for name in ('Vidro', 'Papel', 'Metal'):
+            Material.objects.create(name=name, description=name)
+
+        first = self.changes(self.seq, limit=2)
+        self.assertTrue(first['more'])
+        self.assertEqual(len(first['changes']), 2)
+
+        second = self.changes(first['seq'], limit=2)
+        self.assertFalse(second['more'])
+        self.assertEqual([c['data']['name'] for c in second['changes']],
+                         ['Metal'])
+
+    def test_recent_changes_wait_for_the_commit_lag(self):
+        Material.objects.create(name='Vidro', description='Garrafas')
+
+        with override_settings(CHANGES_COMMIT_LAG=60):
+            data = self.changes(self.seq)
+        self.assertEqual((data['seq'], data['changes']), (self.seq, []))
+
+    def test_pruned_log_asks_for_resync(self):
+        for name in ('Vidro', 'Papel'):
+            Material.objects.create(name=name, description=name)
+        ChangeNotificaion.objects.update(
+            date=timezone.now() - datetime.timedelta(days=60))
+
+        call_command('prune_changes', days=30, stdout=StringIO())
+        self.assertEqual(ChangeNotificaion.objects.count(), 1)
+
+        response = self.client.get('/api/changes/', {'since': self.seq})
+        self.assertEqual(response.status_code, 410)
+        self.assertTrue(response.data['resync'])
+
+        latest = ChangeNotificaion.objects.get().pk
+        self.assertEqual(self.changes(latest)['changes'], [])
+
+    def test_invalid_since(self):
+        response = self.client.get('/api/changes/', {'since': 'x'})
+        self.assertEqual(response.status_code, 400)
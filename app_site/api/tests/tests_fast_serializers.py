@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from rest_framework.renderers import JSONRenderer
+
+from ..fast_serializers import CatadorPositionsCompiledSerializer
+from ..fast_serializers import MaterialCompiledSerializer
+from ..fast_serializers import PartnerCompiledSerializer
+from ..models import Catador, GeorefCatador, LatitudeLongitude
+from ..models import Material, Partner
+from ..serializers import CatadorsPositionsSerializer
+from ..serializers import MaterialSerializer, PartnerSerializer
+
+
+class CompiledSerializerTestCase(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/api/partners/')
+
+        Material.objects.create(name='Papelão', description='Caixas "secas"')
+        Material.objects.create(name='Vidro', description='')
+
+        Partner.objects.create(name='Parceiro', image='cooperatives/partners/a.png')
+        Partner.objects.create(name='Sem imagem', image='')
+
+        for i, name in enumerate(['Zé', 'Maria ', 'Sem posição']):
+            user = User.objects.create_user('compiled%d' % i, password='test')
+            catador = Catador.objects.create(name=name, nickname=name, user=user)
+            if i == 2:
+                continue
+            for j in range(2):
+                georef = LatitudeLongitude.objects.create(
+                    latitude=-23.55 + i + j * 0.001, longitude=-46.63,
+                    reverse_geocoding='Rua São João, %d' % j if j else None)
+                GeorefCatador.objects.create(catador=catador, georef=georef)
+
+    def assertSameJSON(self, serializer_class, compiled_class, queryset):
+        context = {'request': self.request}
+        expected = serializer_class(queryset, many=True, context=context).data
+
+        compiled = compiled_class(context=context)
+        result = compiled.to_representation(compiled.rows(queryset))
+
+        renderer = JSONRenderer()
+        self.assertEqual(renderer.render(result), renderer.render(expected))
+
+    def test_materials(self):
+        self.assertSameJSON(MaterialSerializer, MaterialCompiledSerializer,
+                            Material.objects.order_by('pk'))
+
+    def test_partners(self):
+        self.assertSameJSON(PartnerSerializer, PartnerCompiledSerializer,
+                            Partner.objects.order_by('pk'))
+
+    def test_catador_positions(self):
+        self.assertSameJSON(CatadorsPositionsSerializer,
+                            CatadorPositionsCompiledSerializer,
+                            Catador.objects.order_by('pk'))
@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from ..caching import get_cache
+from ..gazetteer import Gazetteer, RTree, feature_polygons, get_gazetteer
+from ..models import Catador, Region
+from ..tracks import record_points
+
+
+def square(x, y, size=1.0):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+class GazetteerTestCase(SimpleTestCase):
+
+    def test_rtree_query(self):
+        boxes = [(i, 0, i + 1, 1) for i in range(100)]
+        tree = RTree(boxes, node_size=4)
+        self.assertEqual(tree.query_point(10.5, 0.5), [10])
+        self.assertEqual(sorted(tree.query_point(10, 0.5)), [9, 10])
+        self.assertEqual(tree.query_point(10.5, 2), [])
+
+    def test_locate_with_hole(self):
+        with_hole = {'type': 'Polygon',
+                     'coordinates': [square(0, 0, 10), square(4, 4, 2)]}
+        inside_hole = {'type': 'Polygon', 'coordinates': [square(4, 4, 2)]}
+
+        gazetteer = Gazetteer([('outer', feature_polygons(with_hole)),
+                               ('inner', feature_polygons(inside_hole))])
+
+        # locate(latitude, longitude)
+        self.assertEqual(gazetteer.locate(1, 1), 'outer')
+        self.assertEqual(gazetteer.locate(5, 5), 'inner')
+        self.assertIsNone(gazetteer.locate(11, 11))
+
+    def test_multipolygon(self):
+        geometry = {'type': 'MultiPolygon',
+                    'coordinates': [[square(0, 0)], [square(5, 5)]]}
+        gazetteer = Gazetteer([('multi', feature_polygons(geometry))])
+        self.assertEqual(gazetteer.locate(5.5, 5.5), 'multi')
+        self.assertIsNone(gazetteer.locate(3, 3))
+
+
+class RegionsTestCase(APITestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        fd, self.path = tempfile.mkstemp(suffix='.geojson')
+        with os.fdopen(fd, 'w') as geojson:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'properties': {'id': 'se'},
+                 'geometry': {'type': 'Polygon',
+                              'coordinates': [square(-46.7, -23.6, 0.2)]}}]},
+                geojson)
+        self.settings = override_settings(REGIONS_GEOJSON=self.path)
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+        os.remove(self.path)
+
+    def test_gazetteer_follows_region_changes(self):
+        self.assertIsNone(get_gazetteer().locate(-23.55, -46.63))
+
+        region = Region.objects.create(name='Sé', source_id='se')
+        self.assertEqual(get_gazetteer().locate(-23.55, -46.63), region.pk)
+
+    def test_region_filter_follows_the_current_position(self):
+        region = Region.objects.create(name='Sé', source_id='se')
+        user = User.objects.create_user('regions', password='test')
+        catador = Catador.objects.create(name='Catador', nickname='c',
+                                         user=user)
+
+        record_points(catador, [(timezone.now(), -23.55, -46.63)])
+        response = self.client.get('/api/catadores/', {'region': region.pk})
+        self.assertEqual([c['id'] for c in response.data['results']],
+                         [catador.pk])
+
+        record_points(catador, [(timezone.now(), -22.9, -43.17)])
+        response = self.client.get('/api/catadores/', {'region': region.pk})
+        self.assertEqual(response.data['results'], [])
+
+    def test_invalid_region_filter(self):
+        response = self.client.get('/api/catadores/', {'region': 'se'})
+        self.assertEqual(response.status_code, 400)
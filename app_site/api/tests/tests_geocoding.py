@@ -0,0 +1,71 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from rest_framework.test import APITestCase
+
+from ..geocoding import GeocodingError, memory_cache, reverse_geocode
+from ..models import ReverseGeocodingCache
+
+
+class FixedGeocoder(object):
+
+    def __init__(self, address=None, error=False):
+        self.address = address
+        self.error = error
+        self.calls = 0
+
+    def reverse(self, latitude, longitude):
+        self.calls += 1
+        if self.error:
+            raise GeocodingError('timeout')
+        return self.address
+
+
+class ReverseGeocodingTestCase(APITestCase):
+
+    def setUp(self):
+        memory_cache.clear()
+        user = User.objects.create_user('geocoding', password='test')
+        self.client.force_authenticate(user)
+
+    def provider(self, geocoder):
+        return mock.patch('api.geocoding.get_provider', return_value=geocoder)
+
+    def test_address_is_stored(self):
+        geocoder = FixedGeocoder('Rua Augusta, São Paulo')
+        with self.provider(geocoder):
+            reverse_geocode(-23.5505, -46.6333)
+            memory_cache.clear()
+            self.assertEqual(reverse_geocode(-23.55051, -46.63331),
+                             'Rua Augusta, São Paulo')
+
+        self.assertEqual(geocoder.calls, 1)
+        self.assertEqual(ReverseGeocodingCache.objects.count(), 1)
+
+    def test_unknown_address_is_not_stored(self):
+        geocoder = FixedGeocoder('')
+        with self.provider(geocoder):
+            self.assertEqual(reverse_geocode(-23.5505, -46.6333), '')
+            self.assertEqual(reverse_geocode(-23.5505, -46.6333), '')
+
+        self.assertEqual(geocoder.calls, 1)
+        self.assertFalse(ReverseGeocodingCache.objects.exists())
+
+    def test_view_validates_coordinates(self):
+        for lat, lon in (('nan', '0'), ('91', '0'), ('0', 'inf'), ('x', '0')):
+            response = self.client.get('/api/reverse_geocoding/',
+                                       {'lat': lat, 'lon': lon})
+            self.assertEqual(response.status_code, 400)
+
+    def test_view_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.get('/api/reverse_geocoding/',
+                                   {'lat': '-23.55', 'lon': '-46.63'})
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_provider_error(self):
+        with self.provider(FixedGeocoder(error=True)):
+            response = self.client.get('/api/reverse_geocoding/',
+                                       {'lat': '-23.55', 'lon': '-46.63'})
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(ReverseGeocodingCache.objects.exists())
@@ -0,0 +1,59 @@
+from django.test import SimpleTestCase, TestCase
+
+from ..calc_distance import EARTH_RADIUS_KM
+from ..geohash import covering_cells, decode_bbox, encode
+from ..models import LatitudeLongitude
+
+KM_PER_DEGREE = 3.141592653589793 * EARTH_RADIUS_KM / 180.0
+
+
+def covered(cells, latitude, longitude):
+    geohash = encode(latitude, longitude)
+    return any(geohash.startswith(cell) for cell in cells)
+
+
+class GeohashTestCase(SimpleTestCase):
+
+    def test_encode(self):
+        self.assertEqual(encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(encode(-23.5505, -46.6333, 5), '6gyf4')
+
+        min_lat, max_lat, min_lon, max_lon = decode_bbox('6gyf4')
+        self.assertTrue(min_lat <= -23.5505 <= max_lat)
+        self.assertTrue(min_lon <= -46.6333 <= max_lon)
+
+    def test_covering_cells_near_cell_edges(self):
+        radius = 2.0
+        step = radius * 0.99 / KM_PER_DEGREE
+        min_lat, max_lat, min_lon, max_lon = decode_bbox('6gyf4')
+
+        # Points just inside each edge of a cell, and points at almost
+        # the radius across that edge
+        for lat, lon, d_lat, d_lon in (
+                (min_lat + 1e-6, -46.63, -step, 0),
+                (max_lat - 1e-6, -46.63, step, 0),
+                (-23.55, min_lon + 1e-6, 0, -step),
+                (-23.55, max_lon - 1e-6, 0, step)):
+            cells = covering_cells(lat, lon, radius)
+            self.assertTrue(covered(cells, lat, lon))
+            self.assertTrue(covered(cells, lat + d_lat, lon + d_lon))
+
+    def test_covering_cells_across_the_antimeridian(self):
+        cells = covering_cells(0.0, 179.999, 1.0)
+        self.assertTrue(covered(cells, 0.0, 179.999))
+        self.assertTrue(covered(cells, 0.0, -179.999))
+
+    def test_large_radius_is_not_narrowed(self):
+        self.assertEqual(covering_cells(0.0, 0.0, 30000), [])
+
+
+class GeohashQueryTestCase(TestCase):
+
+    def test_rows_without_geohash_are_found(self):
+        georef = LatitudeLongitude.objects.create(latitude=-23.5505,
+                                                  longitude=-46.6333)
+        LatitudeLongitude.objects.filter(pk=georef.pk).update(geohash=None)
+
+        self.assertEqual(
+            list(LatitudeLongitude.near(-23.55, -46.63, 1)
+                 .values_list('pk', flat=True)), [georef.pk])
@@ -1,4 +1,5 @@
 import os
+from base64 import b64encode
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase
@@ -7,6 +8,10 @@ from rest_framework.test import APIClient
 from ..models import Residue
 from ..models import Material
 from ..models import PhotoResidue
+from ..models import Catador, GeorefCatador, GeorefResidue
+from ..models import LatitudeLongitude, ResidueCatadorMatch
+from ..models import Collect, HeatmapCell
+from ..spatial_index import catador_index
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -111,3 +116,200 @@ class ResidueTestCase(APITestCase):
         response = self.client.get(path='/api/residues/1/', format='json')
         self.assertEqual(response.status_code, 200)
 
+
+class ResidueMatchesTestCase(APITestCase):
+    def setUp(self):
+        catador_index.reset()
+
+        self.u = User.objects.create_user('matches', password='test')
+        self.residue = Residue.objects.create(description='Test Residue',
+                                              user=self.u, quantity='S')
+        self.catador = self._create_catador('near', -23.5510, -46.6340)
+
+    def tearDown(self):
+        catador_index.reset()
+
+    def _create_catador(self, name, latitude, longitude):
+        user = User.objects.create_user(name, password='test')
+        catador = Catador.objects.create(name=name, nickname=name, user=user)
+        georef = LatitudeLongitude.objects.create(latitude=latitude,
+                                                  longitude=longitude)
+        GeorefCatador.objects.create(catador=catador, georef=georef)
+        return catador
+
+    def _locate_residue(self):
+        georef = LatitudeLongitude.objects.create(latitude=-23.5505,
+                                                  longitude=-46.6333)
+        GeorefResidue.objects.create(residue=self.residue, georef=georef)
+
+    def _matches(self):
+        return list(ResidueCatadorMatch.objects.filter(residue=self.residue)
+                    .values_list('catador_id', flat=True))
+
+    def test_matches_stored_when_located(self):
+        self._locate_residue()
+        self.assertEqual(self._matches(), [self.catador.pk])
+        self.assertEqual(self.residue.nearest_catadores, [self.catador.pk])
+
+    def test_stored_matches_ignore_a_stale_index(self):
+        catador_index.nearest((0, 0))
+        # Deactivated by another process: this one's index still has it
+        Catador.objects.filter(pk=self.catador.pk).update(active=False)
+
+        self._locate_residue()
+        self.assertEqual(self._matches(), [])
+
+    def test_new_catador_enters_match_set(self):
+        self._locate_residue()
+        nearer = self._create_catador('nearer', -23.5506, -46.6334)
+        self.assertEqual(self._matches(), [nearer.pk, self.catador.pk])
+
+    def test_deactivated_catador_leaves_match_set(self):
+        self._locate_residue()
+        self.catador.active = False
+        self.catador.save()
+        self.assertEqual(self._matches(), [])
+
+    def _matched_on(self):
+        return GeorefResidue.objects.get(residue=self.residue).matched_on
+
+    def test_saving_catador_keeps_matches(self):
+        self._locate_residue()
+        matched_on = self._matched_on()
+
+        self.catador.name = 'Novo nome'
+        self.catador.save()
+        self.assertEqual(self._matched_on(), matched_on)
+
+    def test_catador_outside_match_radius(self):
+        self._create_catador('second', -23.5520, -46.6350)
+        self._create_catador('third', -23.5530, -46.6360)
+        self._locate_residue()
+        matched_on = self._matched_on()
+
+        self._create_catador('far', -22.9068, -43.1729)
+        self.assertEqual(self._matched_on(), matched_on)
+        self.assertEqual(len(self._matches()), 3)
+
+    def test_unmatched_residue_read_does_not_write(self):
+        self._locate_residue()
+        ResidueCatadorMatch.objects.all().delete()
+        GeorefResidue.objects.update(matched_on=None)
+
+        residue = Residue.objects.get(pk=self.residue.pk)
+        self.assertEqual(residue.nearest_catadores, [self.catador.pk])
+        self.assertEqual(self._matches(), [])
+
+
+class HeatmapTestCase(APITestCase):
+    def setUp(self):
+        self.u = User.objects.create_user('heatmap', password='test')
+        self.residue = Residue.objects.create(description='Test Residue',
+                                              user=self.u, quantity='S')
+        georef = LatitudeLongitude.objects.create(latitude=-23.5505,
+                                                  longitude=-46.6333)
+        GeorefResidue.objects.create(residue=self.residue, georef=georef)
+
+    def _count(self, **filters):
+        return sum(HeatmapCell.objects.filter(**filters)
+                   .values_list('count', flat=True))
+
+    def test_located_residue_is_counted(self):
+        self.assertEqual(self._count(kind='residue'), 1)
+        self.assertEqual(self._count(kind='collect', status=Collect.ABERTA), 1)
+
+    def test_collect_status_change_is_counted(self):
+        collect = Collect.objects.get(residue=self.residue)
+        collect.status = Collect.CANCELADA
+        collect.save()
+        collect.save()
+
+        self.assertEqual(self._count(kind='collect',
+                                     status=Collect.CANCELADA), 1)
+
+    def test_heatmap_endpoint(self):
+        response = self.client.get(
+            '/api/heatmap/?bbox=-46.7,-23.6,-46.6,-23.5&kind=residue')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([cell['count'] for cell in response.data], [1])
+
+        response = self.client.get(
+            '/api/heatmap/?bbox=-46.5,-23.6,-46.4,-23.5&kind=residue')
+        self.assertEqual(response.data, [])
+
+
+class BatchTestCase(APITestCase):
+    def setUp(self):
+        self.u = User.objects.create_user('batch', password='test')
+        self.client.force_authenticate(self.u)
+        self.material = Material.objects.create(name='Vidro', description='')
+
+        path = os.path.join(BASE_DIR, 'tests/file-for-tests.png')
+        with open(path, 'rb') as image:
+            self.photo = 'data:image/png;base64,' + \
+                b64encode(image.read()).decode('ascii')
+
+    def tearDown(self):
+        PhotoResidue.objects.all().delete()
+
+    def test_register_residue_in_one_request(self):
+        response = self.client.post('/api/batch/', {'operations': [
+            {'op': 'residue', 'id': 'r1',
+             'data': {'description': 'Garrafas', 'quantity': 'S',
+                      'materials': [self.material.pk]}},
+            {'op': 'georef', 'residue': 'r1',
+             'data': {'latitude': -23.5505, 'longitude': -46.6333}},
+            {'op': 'photo', 'residue': 'r1',
+             'data': {'full_photo': self.photo}},
+            {'op': 'photo', 'residue': 'r1',
+             'data': {'full_photo': self.photo}},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        residue = Residue.objects.get(pk=response.data['ids']['r1'])
+        self.assertEqual(residue.user, self.u)
+        self.assertEqual(list(residue.materials.all()), [self.material])
+        self.assertEqual(residue.residue_location.latitude, -23.5505)
+        self.assertEqual(residue.photoresidue_set.count(), 2)
+        self.assertEqual(len(response.data['residues']), 1)
+
+    def test_error_rolls_back(self):
+        response = self.client.post('/api/batch/', {'operations': [
+            {'op': 'residue', 'id': 'r1',
+             'data': {'description': 'Garrafas', 'quantity': 'S'}},
+            {'op': 'georef', 'residue': 'r2',
+             'data': {'latitude': -23.5505, 'longitude': -46.6333}},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['index'], 1)
+        self.assertFalse(Residue.objects.filter(user=self.u).exists())
+
+    def test_invalid_photo(self):
+        for photo in (5, ['data'], None):
+            response = self.client.post('/api/batch/', {'operations': [
+                {'op': 'residue', 'id': 'r1',
+                 'data': {'description': 'Garrafas', 'quantity': 'S'}},
+                {'op': 'photo', 'residue': 'r1',
+                 'data': {'full_photo': photo}},
+            ]}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.data['index'], 1)
+
+    def test_numeric_temp_id(self):
+        response = self.client.post('/api/batch/', {'operations': [
+            {'op': 'residue', 'id': '5',
+             'data': {'description': 'Garrafas', 'quantity': 'S'}},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['index'], 0)
+
+    def test_other_users_residue(self):
+        other = User.objects.create_user('other', password='test')
+        residue = Residue.objects.create(description='Outro', user=other,
+                                         quantity='S')
+
+        response = self.client.post('/api/batch/', {'operations': [
+            {'op': 'materials', 'residue': residue.pk,
+             'data': [self.material.pk]},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
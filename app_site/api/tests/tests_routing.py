@@ -0,0 +1,102 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase
+
+from ..models import Catador, Collect, GeorefCatador, GeorefResidue
+from ..models import LatitudeLongitude, Residue
+from ..routing import solve_route
+
+
+class RouteTestCase(SimpleTestCase):
+
+    def test_route_visits_every_stop_once(self):
+        # Start at Sé, then Pinheiros, Mooca, Liberdade, Luz
+        coords = [(-23.5503, -46.6339), (-23.5670, -46.7010),
+                  (-23.5544, -46.5940), (-23.5587, -46.6345),
+                  (-23.5343, -46.6352)]
+        order, legs = solve_route(coords)
+
+        self.assertEqual(order[0], 0)
+        self.assertEqual(sorted(order), [0, 1, 2, 3, 4])
+        self.assertEqual(len(legs), 4)
+
+    def test_collinear_stops_in_line_order(self):
+        # Points along a line: the best open path is the line itself
+        coords = [(0.0, 0.0), (0.0, 0.3), (0.0, 0.1), (0.0, 0.4), (0.0, 0.2)]
+        order, legs = solve_route(coords)
+
+        self.assertEqual(order, [0, 2, 4, 1, 3])
+        self.assertAlmostEqual(sum(legs), 44.5, delta=0.5)
+
+
+class CollectRouteViewTestCase(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        self.user = User.objects.create_user('route', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=self.user)
+        georef = LatitudeLongitude.objects.create(latitude=-23.5503,
+                                                  longitude=-46.6339)
+        GeorefCatador.objects.create(catador=self.catador, georef=georef)
+
+        # Liberdade and Luz
+        self.collects = [self.accepted_collect(-23.5587, -46.6345),
+                         self.accepted_collect(-23.5343, -46.6352)]
+
+    def accepted_collect(self, latitude, longitude):
+        residue = Residue.objects.create(description='Garrafas',
+                                         user=self.user, quantity='S')
+        georef = LatitudeLongitude.objects.create(latitude=latitude,
+                                                  longitude=longitude)
+        GeorefResidue.objects.create(residue=residue, georef=georef)
+
+        collect = Collect.objects.get(residue=residue)
+        collect.catador = self.catador
+        collect.save()
+        return collect
+
+    def route(self, **params):
+        return self.client.get('/api/collect/route/', params)
+
+    def ids(self, response):
+        return [collect['id'] for collect in response.data['collects']]
+
+    def test_route_of_the_catador(self):
+        self.client.force_authenticate(self.user)
+        response = self.route()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['start'], [-23.5503, -46.6339])
+        self.assertEqual(self.ids(response), [c.pk for c in self.collects])
+        self.assertAlmostEqual(
+            response.data['total_km'],
+            sum(c['distance'] for c in response.data['collects']))
+
+    def test_permissions(self):
+        self.assertIn(self.route().status_code, (401, 403))
+
+        # Only staff may ask for another catador's route
+        other = User.objects.create_user('other', password='test')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.route(catador=self.catador.pk).status_code, 404)
+
+        admin = User.objects.create_superuser('admin', 'a@a.a', 'test')
+        self.client.force_authenticate(admin)
+        response = self.route(catador=self.catador.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['collects']), 2)
+
+    def test_cached_route_follows_the_collects(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(len(self.route().data['collects']), 2)
+
+        self.collects[0].status = Collect.SUCESSO
+        self.collects[0].save()
+        self.assertEqual(self.ids(self.route()), [self.collects[1].pk])
+
+        mooca = self.accepted_collect(-23.5544, -46.5940)
+        self.assertEqual(sorted(self.ids(self.route())),
+                         sorted([self.collects[1].pk, mooca.pk]))
@@ -0,0 +1,105 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from ..models import Catador, GeorefCatador, LatitudeLongitude, Material
+from .. import snapshot
+from ..snapshot import build_snapshot, load
+from ..tracks import record_points
+
+
+class MapSnapshotTestCase(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.settings = override_settings(MAP_SNAPSHOT_DIR=self.directory,
+                                          CHANGES_COMMIT_LAG=0)
+        self.settings.enable()
+
+        self.material = Material.objects.create(name='Vidro', description='')
+        user = User.objects.create_user('snapshot', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=user)
+        self.catador.materials_collected.add(self.material)
+        georef = LatitudeLongitude.objects.create(latitude=-23.55,
+                                                  longitude=-46.63)
+        GeorefCatador.objects.create(georef=georef, catador=self.catador)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.directory)
+
+    def test_markers(self):
+        build_snapshot()
+        self.assertEqual(load()['markers'], [
+            ['catador', self.catador.pk, 'C', -23.55, -46.63,
+             [self.material.pk]]])
+
+    def test_incremental_rebuild(self):
+        build_snapshot()
+        self.assertIsNone(build_snapshot())
+
+        self.catador.active = False
+        self.catador.save()
+        self.assertIsNotNone(build_snapshot())
+        self.assertEqual(load()['markers'], [])
+
+    def test_moved_position_is_reloaded(self):
+        build_snapshot()
+        record_points(self.catador, [(timezone.now(), -23.6, -46.7)])
+
+        self.assertIsNotNone(build_snapshot())
+        self.assertEqual(load()['markers'][0][3:5], [-23.6, -46.7])
+
+    def test_served_compressed_without_queries(self):
+        build_snapshot()
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/map/snapshot/',
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        content = gzip.decompress(b''.join(response.streaming_content))
+        self.assertEqual(json.loads(content.decode('utf-8')), load())
+
+        response = self.client.get('/api/map/snapshot/',
+                                   HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_missing_snapshot_is_not_built_by_requests(self):
+        response = self.client.get('/api/map/snapshot/')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_stale_brotli_copy_is_removed(self):
+        path = os.path.join(self.directory, 'markers.json.br')
+        with open(path, 'wb') as stale:
+            stale.write(b'stale')
+
+        with mock.patch.object(snapshot, 'brotli', None):
+            build_snapshot()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['markers.json', 'markers.json.gz'])
+
+    def test_range(self):
+        build_snapshot()
+        with open(self.directory + '/markers.json', 'rb') as snapshot_file:
+            content = snapshot_file.read()
+
+        response = self.client.get('/api/map/snapshot/', HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, content[10:])
+        self.assertEqual(response['Content-Range'],
+                         'bytes 10-%d/%d' % (len(content) - 1, len(content)))
+
+        response = self.client.get('/api/map/snapshot/',
+                                   HTTP_RANGE='bytes=%d-' % len(content))
+        self.assertEqual(response.status_code, 416)
@@ -0,0 +1,90 @@
+from django.test import SimpleTestCase
+
+from ..spatial_index import CatadorSpatialIndex, catador_index
+from ..clustering import GridClusterIndex, catador_clusters
+
+
+class CatadorSpatialIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        # The global index must not carry positions between tests
+        catador_index.reset()
+        positions = {
+            1: (-23.5503, -46.6339),  # Sé
+            2: (-23.5544, -46.5940),  # Mooca
+            3: (-23.5670, -46.7010),  # Pinheiros
+            4: (-22.9068, -43.1729),  # Rio de Janeiro
+        }
+        self.index = CatadorSpatialIndex(loader=lambda: dict(positions),
+                                         max_age=0)
+
+    def tearDown(self):
+        catador_index.reset()
+
+    def ids(self, coord, k=3):
+        return [catador_id for catador_id, dist in self.index.nearest(coord, k)]
+
+    def test_nearest(self):
+        self.assertEqual(self.ids((-23.5505, -46.6333)), [1, 2, 3])
+
+    def test_update_moves_catador(self):
+        self.index.nearest((0, 0))
+        self.index.update(4, -23.5504, -46.6335)
+        self.assertEqual(self.ids((-23.5505, -46.6333), k=2), [4, 1])
+
+    def test_remove_and_add(self):
+        self.index.nearest((0, 0))
+        self.index.remove(1)
+        self.index.update(5, -23.5600, -46.6500)
+        self.assertEqual(self.ids((-23.5505, -46.6333)), [5, 2, 3])
+
+    def test_rebuild_keeps_changes(self):
+        self.index.rebuild_threshold = 0
+        self.index.nearest((0, 0))
+        self.index.update(4, -23.5504, -46.6335)
+        self.assertEqual(self.ids((-23.5505, -46.6333), k=1), [4])
+
+
+class GridClusterIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        catador_clusters.reset()
+        positions = {
+            1: (-23.5503, -46.6339),
+            2: (-23.5544, -46.5940),
+            3: (-22.9068, -43.1729),
+        }
+        self.index = GridClusterIndex(loader=lambda: dict(positions), max_age=0)
+
+    def tearDown(self):
+        catador_clusters.reset()
+
+    def test_low_zoom_groups_everything(self):
+        clusters = self.index.clusters(0)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(clusters[0]['count'], 3)
+
+    def test_city_zoom(self):
+        clusters = self.index.clusters(8)
+        counts = sorted(c['count'] for c in clusters)
+        self.assertEqual(counts, [1, 2])
+        single = [c for c in clusters if c['count'] == 1][0]
+        self.assertEqual(single['id'], 3)
+
+    def test_bbox(self):
+        clusters = self.index.clusters(18, (-47, -24, -46, -23))
+        self.assertEqual(sorted(c['id'] for c in clusters), [1, 2])
+
+    def test_bbox_across_the_antimeridian(self):
+        index = GridClusterIndex(loader=lambda: {
+            1: (-17.7, 179.5), 2: (-17.8, -179.5), 3: (-17.7, 0.0)},
+            max_age=0)
+        clusters = index.clusters(18, (179, -18, -179, -17))
+        self.assertEqual(sorted(c['id'] for c in clusters), [1, 2])
+
+    def test_update_and_remove(self):
+        self.index.clusters(0)
+        self.index.update(3, -23.5500, -46.6300)
+        self.index.remove(2)
+        clusters = self.index.clusters(8)
+        self.assertEqual([c['count'] for c in clusters], [2])
@@ -0,0 +1,187 @@
+import datetime
+from io import StringIO
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from ..caching import get_cache
+from ..models import Catador, CatadorLastPosition, CatadorTrack
+from ..models import ChangeNotificaion, GeorefCatador, LatitudeLongitude
+from ..spatial_index import catador_index
+from ..tracks import POINT_DTYPE, pack, record_points, simplify, unpack
+
+
+class PackTestCase(SimpleTestCase):
+
+    def test_roundtrip(self):
+        points = np.array([(10, -23.55, -46.63), (20, -23.56, -46.64)],
+                          dtype=POINT_DTYPE)
+        self.assertEqual(len(pack(points)), 24)
+        self.assertTrue(np.array_equal(unpack(pack(points)), points))
+        self.assertEqual(len(unpack(b'')), 0)
+
+    def test_simplify_drops_collinear_points(self):
+        points = np.array([(t, -23.55, -46.63 + t * 0.001) for t in range(10)] +
+                          [(10, -23.54, -46.62)], dtype=POINT_DTYPE)
+        simplified = simplify(points, 0.015)
+        self.assertEqual(list(simplified['t']), [0, 9, 10])
+
+
+class RecordPointsTestCase(TestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        user = User.objects.create_user('tracks', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=user)
+        self.now = timezone.now().replace(microsecond=0)
+
+    def test_points_of_a_day_are_merged_in_order(self):
+        later = self.now + datetime.timedelta(seconds=30)
+        record_points(self.catador, [(later, -23.56, -46.64)])
+        record_points(self.catador, [(self.now, -23.55, -46.63)])
+
+        track = CatadorTrack.objects.get(catador=self.catador)
+        self.assertEqual(track.count, 2)
+        self.assertAlmostEqual(float(unpack(track.points)['lat'][1]), -23.56,
+                               places=5)
+
+        last = CatadorLastPosition.objects.get(catador=self.catador)
+        self.assertEqual((last.latitude, last.longitude), (-23.56, -46.64))
+        self.assertEqual(last.recorded_on, later)
+
+    def test_ping_overrides_registered_georef(self):
+        georef = LatitudeLongitude.objects.create(latitude=-22.9,
+                                                  longitude=-43.17)
+        GeorefCatador.objects.create(georef=georef, catador=self.catador)
+        last = CatadorLastPosition.objects.get(catador=self.catador)
+        self.assertIsNone(last.track_id)
+
+        record_points(self.catador, [(self.now - datetime.timedelta(days=1),
+                                      -23.55, -46.63)])
+        last.refresh_from_db()
+        self.assertEqual((last.latitude, last.longitude), (-23.55, -46.63))
+
+        # Georefs registered later no longer move the position
+        georef.latitude = -20.0
+        georef.save()
+        last.refresh_from_db()
+        self.assertEqual(last.latitude, -23.55)
+
+    def test_pings_do_not_touch_the_catador(self):
+        modified_date = Catador.objects.get(pk=self.catador.pk).modified_date
+        logged = ChangeNotificaion.objects.filter(
+            model_type='Catador', model_pk=self.catador.pk).count()
+
+        for i in range(3):
+            record_points(self.catador, [(
+                self.now + datetime.timedelta(seconds=i), -23.55 + i, -46.63)])
+
+        self.assertEqual(Catador.objects.get(pk=self.catador.pk).modified_date,
+                         modified_date)
+        # One entry per POSITION_LOG_INTERVAL
+        self.assertEqual(ChangeNotificaion.objects.filter(
+            model_type='Catador', model_pk=self.catador.pk).count(),
+            logged + 1)
+
+
+@override_settings(TRACK_MAX_POINTS=2)
+class TrackViewTestCase(APITestCase):
+
+    def setUp(self):
+        get_cache().clear()
+        self.user = User.objects.create_user('track', password='test')
+        self.catador = Catador.objects.create(name='Catador', nickname='c',
+                                              user=self.user)
+        self.client.force_authenticate(self.user)
+        catador_index.reset()
+        catador_index.nearest((0, 0))
+
+    def tearDown(self):
+        catador_index.reset()
+
+    def test_georef_moves_the_current_position(self):
+        url = '/api/catadores/%d/georef/' % self.catador.pk
+        response = self.client.post(url, {'latitude': -23.55,
+                                          'longitude': -46.63}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(GeorefCatador.objects.exists())
+        self.assertEqual(CatadorTrack.objects.get().count, 1)
+        self.assertEqual(
+            catador_index.nearest((-23.55, -46.63), 1)[0][0], self.catador.pk)
+
+        response = self.client.get(url)
+        self.assertEqual(response.data[-1]['latitude'], -23.55)
+
+    def test_detail_shows_the_moved_position(self):
+        url = '/api/catadores/%d/' % self.catador.pk
+        self.assertIsNone(self.client.get(url).data['last_position'])
+
+        self.client.post('/api/catadores/%d/georef/' % self.catador.pk,
+                         {'latitude': -23.55, 'longitude': -46.63},
+                         format='json')
+        self.assertEqual(self.client.get(url).data['last_position']['latitude'],
+                         -23.55)
+
+    def test_track_is_only_shown_to_the_catador_and_staff(self):
+        url = '/api/catadores/%d/track/' % self.catador.pk
+        other = User.objects.create_user('other', password='test')
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        other.is_staff = True
+        other.save()
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_georef_validation(self):
+        url = '/api/catadores/%d/georef/' % self.catador.pk
+        response = self.client.post(url, {'latitude': 'nan',
+                                          'longitude': -46.63}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_authenticate(None)
+        response = self.client.post(url, {'latitude': -23.55,
+                                          'longitude': -46.63}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_points_per_request_are_capped(self):
+        point = {'latitude': -23.55, 'longitude': -46.63}
+        response = self.client.post(
+            '/api/catadores/%d/track/' % self.catador.pk,
+            {'points': [point] * 3}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CatadorTrack.objects.exists())
+
+
+class DownsampleTracksTestCase(TestCase):
+
+    def test_old_tracks_are_simplified(self):
+        user = User.objects.create_user('downsample', password='test')
+        catador = Catador.objects.create(name='Catador', nickname='c',
+                                         user=user)
+        points = np.array([(t, -23.55, -46.63 + t * 0.0001)
+                           for t in range(100)], dtype=POINT_DTYPE)
+        today = timezone.localtime(timezone.now()).date()
+        old = CatadorTrack.objects.create(
+            catador=catador, day=today - datetime.timedelta(days=10),
+            points=pack(points), count=100)
+        recent = CatadorTrack.objects.create(
+            catador=catador, day=today, points=pack(points), count=100)
+
+        call_command('downsample_tracks', days=7, tolerance=0.015,
+                     stdout=StringIO())
+
+        old.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertTrue(old.downsampled)
+        self.assertEqual(old.count, 2)
+        self.assertEqual(len(unpack(old.points)), 2)
+        self.assertFalse(recent.downsampled)
+        self.assertEqual(recent.count, 100)
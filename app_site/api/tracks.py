@@ -0,0 +1,204 @@
+"""
+    Compact storage of the path walked by the catadores.
+
+    Location pings are packed in one CatadorTrack row per catador per day as
+    a numpy array of (seconds since midnight, latitude, longitude), 12 bytes
+    per point, instead of a LatitudeLongitude row (plus its history) per
+    ping. Old days can be downsampled with the downsample_tracks command.
+
+    CatadorLastPosition is the current position of every catador, read by
+    the spatial index, the clusters, the residue matches, the assignment,
+    the routes and the map. It comes from the latest ping or, for catadores
+    that never sent one, from their registered georefs (GeorefCatador).
+"""
+import datetime
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .calc_distance import EARTH_RADIUS_KM
+
+POINT_DTYPE = np.dtype([('t', '<u4'), ('lat', '<f4'), ('lon', '<f4')])
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180.0
+
+
+def pack(points):
+    return np.ascontiguousarray(points, dtype=POINT_DTYPE).tobytes()
+
+
+def unpack(data):
+    if not data:
+        return np.empty(0, dtype=POINT_DTYPE)
+    return np.frombuffer(bytes(data), dtype=POINT_DTYPE)
+
+
+def seconds_of_day(moment):
+    local = timezone.localtime(moment)
+    return local.date(), local.hour * 3600 + local.minute * 60 + local.second
+
+
+def simplify(points, tolerance_km):
+    """
+    Ramer-Douglas-Peucker on a local equirectangular projection. Keeps the
+    first and last points and every point farther than `tolerance_km` from
+    the simplified line.
+    """
+    n = len(points)
+    if n < 3:
+        return points
+
+    lat = points['lat'].astype(np.float64)
+    lon = points['lon'].astype(np.float64)
+    y = lat * KM_PER_DEGREE
+    x = lon * KM_PER_DEGREE * np.cos(np.radians(lat.mean()))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        px, py = x[start + 1:end] - x[start], y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+
+        if length == 0:
+            dist = np.hypot(px, py)
+        else:
+            dist = np.abs(dx * py - dy * px) / length
+
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance_km:
+            index = start + 1 + i
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return points[keep]
+
+
+def record_points(catador, points):
+    """
+    Append [(datetime, latitude, longitude), ...] to the catador's tracks
+    and move the latest position pointer. Returns the number of points.
+    """
+    from .models import CatadorTrack, CatadorLastPosition
+
+    by_day = {}
+    for moment, latitude, longitude in points:
+        day, seconds = seconds_of_day(moment)
+        by_day.setdefault(day, []).append((seconds, latitude, longitude))
+
+    if not by_day:
+        return 0
+
+    latest = max(points, key=lambda p: p[0])
+
+    with transaction.atomic():
+        for day, day_points in by_day.items():
+            track, created = CatadorTrack.objects.select_for_update()\
+                .get_or_create(catador=catador, day=day)
+
+            new = np.array(day_points, dtype=POINT_DTYPE)
+            merged = np.concatenate((unpack(track.points), new))
+            merged = merged[np.argsort(merged['t'], kind='mergesort')]
+
+            track.points = pack(merged)
+            track.count = len(merged)
+            track.save()
+
+            if day == seconds_of_day(latest[0])[0]:
+                last_track = track
+
+        last, created = CatadorLastPosition.objects.select_for_update()\
+            .get_or_create(catador=catador, defaults={
+                'latitude': latest[1], 'longitude': latest[2],
+                'recorded_on': latest[0], 'track': last_track})
+
+        # A position taken from the registered georefs gives way to any ping
+        if not created and (last.track_id is None or
+                            last.recorded_on <= latest[0]):
+            last.latitude = latest[1]
+            last.longitude = latest[2]
+            last.recorded_on = latest[0]
+            last.track = last_track
+            last.save()
+
+    return len(points)
+
+
+def georef_position(catador_id):
+    """
+    Take the position of a catador that never sent a ping from its latest
+    registered georef.
+    """
+    from .models import CatadorLastPosition, GeorefCatador
+
+    last = CatadorLastPosition.objects.filter(catador_id=catador_id).first()
+    if last is not None and last.track_id is not None:
+        return
+
+    latest = GeorefCatador.objects.filter(catador_id=catador_id)\
+        .order_by('-pk')\
+        .values_list('georef__latitude', 'georef__longitude').first()
+
+    if latest is None or None in latest:
+        if last is not None:
+            last.delete()
+        return
+
+    if last is None:
+        last = CatadorLastPosition(catador_id=catador_id)
+    elif (last.latitude, last.longitude) == latest:
+        return
+
+    last.latitude, last.longitude = latest
+    last.recorded_on = timezone.now()
+    last.save()
+
+
+def backfill_last_positions():
+    """
+    Last position of the catadores registered before CatadorLastPosition
+    was the source of the current position. Returns how many were created.
+    """
+    from .gazetteer import get_gazetteer
+    from .geohash import encode
+    from .models import CatadorLastPosition, GeorefCatador
+
+    positions = {}
+    for catador_id, latitude, longitude in GeorefCatador.objects.filter(
+            catador__last_position__isnull=True).order_by('pk').values_list(
+                'catador_id', 'georef__latitude', 'georef__longitude'):
+        if latitude is not None and longitude is not None:
+            positions[catador_id] = (latitude, longitude)
+
+    # bulk_create skips save(): the geohash and the region are set here
+    gazetteer = get_gazetteer()
+    now = timezone.now()
+    CatadorLastPosition.objects.bulk_create([
+        CatadorLastPosition(
+            catador_id=catador_id, latitude=latitude, longitude=longitude,
+            recorded_on=now, geohash=encode(latitude, longitude),
+            region_id=gazetteer.locate(latitude, longitude)
+            if gazetteer is not None else None)
+        for catador_id, (latitude, longitude) in positions.items()])
+    return len(positions)
+
+
+def track_points(track):
+    """
+    Points of a CatadorTrack as a list of dicts.
+    """
+    midnight = timezone.make_aware(
+        datetime.datetime.combine(track.day, datetime.time()))
+
+    return [{
+        'timestamp': midnight + datetime.timedelta(seconds=int(p['t'])),
+        'latitude': float(p['lat']),
+        'longitude': float(p['lon']),
+    } for p in unpack(track.points)]
@@ -18,6 +18,12 @@ from .views import edit_catador
 from .views import edit_cooperativa
 from .views import get_docs
 from .views import PartnerViewSet
+from .views import RegionViewSet
+from .views import reverse_geocoding
+from .views import heatmap
+from .views import changes
+from .views import map_snapshot
+from .views import batch
 
 router = routers.DefaultRouter()
 
@@ -30,6 +36,7 @@ router.register(r'collect', CollectViewSet)
 router.register(r'materials', MaterialsViewSet)
 router.register(r'cooperatives', CooperativeViewSet, base_name='cooperative')
 router.register(r'partners', PartnerViewSet, base_name='partners')
+router.register(r'regions', RegionViewSet)
 
 
 urlpatterns = [
@@ -40,6 +47,11 @@ urlpatterns = [
     url(r'edit_catador/$', edit_catador),
     url(r'cadastro_cooperativa/$', cadastro_cooperativa),
     url(r'add_statistic/$', add_statistic),
+    url(r'reverse_geocoding/$', reverse_geocoding),
+    url(r'heatmap/$', heatmap),
+    url(r'changes/$', changes),
+    url(r'map/snapshot/$', map_snapshot),
+    url(r'batch/$', batch),
     url(r'edit_cooperativa/$', edit_cooperativa),
     url(r'get_docs/([0-9]{1})/$', get_docs)
 ]
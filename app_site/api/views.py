@@ -1,25 +1,37 @@
 from rest_framework import serializers
 from rest_framework import viewsets
 from django.contrib.auth.models import User
-from rest_framework.decorators import api_view
+from django.conf import settings
+from rest_framework.decorators import api_view, permission_classes
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_safe
+from django.http import FileResponse
 from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, \
-    IsAuthenticatedOrReadOnly, AllowAny
+    IsAuthenticatedOrReadOnly, AllowAny, IsAdminUser
 from rest_framework.filters import SearchFilter, OrderingFilter
-from rest_framework.decorators import detail_route
+from rest_framework.decorators import detail_route, list_route
 from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404, HttpResponse
 from base64 import b64decode
 from django.core.files.base import ContentFile
-from django.db.models import Q
+from django.db.models import Case, When, IntegerField, Sum, Max, Count
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import http_date, parse_etags, parse_http_date_safe, \
+    quote_etag
 # from braces.views import CsrfExemptMixin
 import xlwt
 import datetime as dt
 import operator
+import os
+import re
 
 import uuid
 import logging
+import calendar
+import hashlib
+import numpy as np
 
 from rest_framework import status
 from rest_framework.authtoken.views import ObtainAuthToken
@@ -46,6 +58,11 @@ from .models import RatingCooperative
 from .models import UserProfile
 from .models import GeneralErros
 from .models import MobileCooperative
+from .models import CatadorTrack
+from .models import CatadorLastPosition
+from .models import Region
+from .models import HeatmapCell
+from .models import ChangeNotificaion
 
 from .serializers import RatingSerializer, PartnerSerializer
 from .serializers import MobileSerializer
@@ -61,10 +78,28 @@ from .serializers import PhotoCollectCatadorSerializer
 from .serializers import PhotoCollectUserSerializer
 from .serializers import CatadorsPositionsSerializer
 from .serializers import PasswordSerializer
+from .serializers import RegionSerializer
 
 from .permissions import IsObjectOwner
 
-from .pagination import PostLimitOffSetPagination
+from .pagination import PostLimitOffSetPagination, KeysetPagination
+
+from .calc_distance import bounding_box, haversine_km, load_positions
+from .calc_distance import batch_k_nearest
+from .geohash import covering_cells, cells_q
+from .clustering import catador_clusters
+from .tracks import record_points, track_points
+from .geocoding import GeocodingError, reverse_geocode, valid_coordinates
+from .assignment import assign_open_collects, DEFAULT_CAPACITY, \
+    MAX_DISTANCE_KM
+from .routing import collect_route
+from . import snapshot
+from .batch import Batch, BatchError
+from . import search as search_index
+from .fast_serializers import CatadorPositionsCompiledSerializer
+from .fast_serializers import MaterialCompiledSerializer
+from .fast_serializers import PartnerCompiledSerializer
+from .caching import cached_data, get_version
 
 public_status = (ModeratedModel.APPROVED, ModeratedModel.PENDING)
 logger = logging.getLogger(__name__)
@@ -84,6 +119,166 @@ class RecoBaseView(PermissionBase):
     pagination_class = PostLimitOffSetPagination
 
 
+class ConditionalGetMixin(object):
+    """
+        ETag/Last-Modified for list and retrieve, computed from
+        Max(modified_date) and Count of the filtered queryset (or the
+        object's modified_date), so a client polling with If-None-Match or
+        If-Modified-Since gets a 304 without anything being serialized.
+        Changes to nested rows bump the parent's modified_date (see
+        TOUCH_PARENTS in models.py).
+    """
+
+    # Other timestamps the list representation depends on
+    list_etag_fields = ()
+
+    def list(self, request, *args, **kwargs):
+        extra = dict(('extra_%d' % i, Max(field))
+                     for i, field in enumerate(self.list_etag_fields))
+        stats = self.filter_queryset(self.get_queryset()).order_by()\
+            .aggregate(last=Max('modified_date'), count=Count('pk'), **extra)
+        extra = tuple(stats['extra_%d' % i] for i in range(len(extra)))
+        last_modified = max([stats['last']] + [value for value in extra
+                                               if value is not None])\
+            if stats['last'] is not None else None
+        return self.conditional_response(
+            request, (stats['last'], stats['count']) + extra, last_modified,
+            super(ConditionalGetMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        # Same rows as get_object(), so hidden objects are a 404
+        row = self.filter_queryset(self.get_queryset())\
+            .filter(**{self.lookup_field: kwargs[lookup]})\
+            .prefetch_related(None).order_by()\
+            .values_list('pk', 'modified_date').first()
+        if row is None:
+            return super(ConditionalGetMixin, self).retrieve(
+                request, *args, **kwargs)
+
+        return self.conditional_response(
+            request, row + tuple(self.etag_extra(row[0])), row[1],
+            super(ConditionalGetMixin, self).retrieve, *args, **kwargs)
+
+    def etag_extra(self, pk):
+        """
+        More validator parts of an object, e.g. its cache version.
+        """
+        return ()
+
+    def get_etag(self, request, parts):
+        # The representation also depends on the query string (fields,
+        # cursor...) and on the negotiated format
+        value = '|'.join(str(part) for part in (
+            self.__class__.__name__, request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', '')) + tuple(parts))
+        return quote_etag(hashlib.md5(value.encode('utf-8')).hexdigest())
+
+    def conditional_response(self, request, parts, last_modified, view,
+                             *args, **kwargs):
+        etag = self.get_etag(request, parts)
+        timestamp = None
+        if last_modified is not None:
+            timestamp = calendar.timegm(last_modified.utctimetuple())
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+
+        if if_none_match is not None:
+            not_modified = if_none_match.strip() == '*' or \
+                etag in [quote_etag(e) for e in parse_etags(if_none_match)]
+        else:
+            not_modified = timestamp is not None and \
+                if_modified_since is not None and timestamp <= if_modified_since
+
+        if not_modified:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = view(request, *args, **kwargs)
+
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+        return response
+
+
+class VersionedCacheMixin(object):
+    """
+        list/retrieve served from the versioned response cache (see
+        api/caching.py). Saving or deleting any of `cache_models` bumps
+        their version and so invalidates every cached response.
+    """
+    cache_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super(VersionedCacheMixin, self).list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super(VersionedCacheMixin, self).retrieve,
+            *args, **kwargs)
+
+    def cached_response(self, request, view, *args, **kwargs):
+        versions = [get_version(model) for model in self.cache_models]
+        value = '|'.join(str(part) for part in [
+            self.__class__.__name__, request.build_absolute_uri(),
+            request.META.get('HTTP_ACCEPT', '')] + versions)
+        key = 'response:' + hashlib.md5(value.encode('utf-8')).hexdigest()
+
+        def build():
+            response = view(request, *args, **kwargs)
+            return response.data, response.status_code
+
+        data, status_code = cached_data(key, build)
+        return Response(data, status=status_code)
+
+
+class ObjectCacheMixin(object):
+    """
+        retrieve() served from a per-object cache keyed by the pk and the
+        object's version (see api/caching.py). The version is bumped by the
+        signals of every model the representation is built from.
+    """
+    cache_model = None
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        value = '|'.join(str(part) for part in (
+            self.__class__.__name__, pk, get_version(self.cache_model, pk),
+            request.build_absolute_uri(), request.META.get('HTTP_ACCEPT', '')))
+        key = 'object:' + hashlib.md5(value.encode('utf-8')).hexdigest()
+
+        def build():
+            response = super(ObjectCacheMixin, self).retrieve(
+                request, *args, **kwargs)
+            return response.data, response.status_code
+
+        data, status_code = cached_data(key, build)
+        return Response(data, status=status_code)
+
+
+class CompiledListMixin(object):
+    """
+        list() through a CompiledSerializer (see api/fast_serializers.py):
+        filters and pagination work as usual, but the rows come from
+        .values_list() and skip the DRF field machinery.
+    """
+    compiled_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        compiled = self.compiled_serializer_class(
+            context=self.get_serializer_context())
+        rows = compiled.rows(self.filter_queryset(self.get_queryset()))
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.to_representation(page))
+        return Response(compiled.to_representation(rows))
+
+
 class UserViewSet(viewsets.ModelViewSet):
     '''
         Endpoint used to create, update and retrieve users
@@ -166,7 +361,33 @@ def create_new_comment(data):
     return comment.save()
 
 
-class CatadorViewSet(viewsets.ModelViewSet):
+def parse_bbox(value):
+    """
+    '<min_lon>,<min_lat>,<max_lon>,<max_lat>' -> tuple of floats
+    """
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(v) for v in value.split(',')]
+    except ValueError:
+        raise ValidationError(
+            'bbox deve ser <min_lon>,<min_lat>,<max_lon>,<max_lat>')
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def order_by_pks(queryset, pks):
+    """
+    Restrict the queryset to `pks`, keeping the order of the list.
+    """
+    pks = [int(pk) for pk in pks]
+    if not pks:
+        return queryset.none()
+
+    ordering = Case(*[When(pk=pk, then=pos) for pos, pk in enumerate(pks)],
+                    output_field=IntegerField())
+    return queryset.filter(pk__in=pks).order_by(ordering)
+
+
+class CatadorViewSet(ConditionalGetMixin, ObjectCacheMixin,
+                     viewsets.ModelViewSet):
     """
         CatadorViewSet Routes:
 
@@ -175,6 +396,7 @@ class CatadorViewSet(viewsets.ModelViewSet):
         /api/catadores/<pk>/comments (GET, POST, PUT, PATCH, DELETE) pass
         pk parameter
         /api/catadores/<pk>/georef (GET, POST)
+        /api/catadores/<pk>/track (GET, POST)
         /api/catadores/<pk>/phones (GET, POST, DELETE)
 
     """
@@ -184,6 +406,24 @@ class CatadorViewSet(viewsets.ModelViewSet):
     # queryset = Catador.objects.all()
     queryset = Catador.objects.filter(active=True)
     http_method_names = ['get', 'post', 'update', 'options', 'patch', 'delete']
+    pagination_class = KeysetPagination
+    cache_model = Catador
+    # Pings move last_position without touching the catador
+    list_etag_fields = ('last_position__modified_on',)
+
+    def etag_extra(self, pk):
+        return (get_version(Catador, pk),)
+
+    def paginate_queryset(self, queryset):
+        # Results sorted by distance are bounded by the radius/bbox
+        params = self.request.query_params
+        if params.get('bbox') or (params.get('lat') and params.get('lon') and
+                                  params.get('radius_km')):
+            return None
+        # Search results are ranked and bounded by SEARCH_MAX_RESULTS
+        if params.get('search'):
+            return None
+        return super(CatadorViewSet, self).paginate_queryset(queryset)
 
     def get_queryset(self):
         """
@@ -193,45 +433,104 @@ class CatadorViewSet(viewsets.ModelViewSet):
 
         # Filter by 'search' will search in
         # (name, nickname, endereço (rua, bairro, cidade, estado), material)
+        # ranked by the search index (see api/search.py)
         search = self.request.query_params.get('search', None)
-        filter_by_name = self.request.query_params.get('name', False)
-        filter_by_nickname = self.request.query_params.get('nickname', False)
-        # filter_by_address = self.request.query_params.get('address', False)
         materials = self.request.query_params.getlist('materials')
 
-        if search is not None or materials:
-            q_objects = Q()
-
-            if search is not None:
-                if filter_by_name:
-                    q_objects |= Q(name__contains=search)
-                if filter_by_nickname:
-                    q_objects |= Q(nickname__contains=search)
-
-            queryset = Catador.objects.filter(q_objects)
-
-            # if filter_by_address:
-            #     # q_objects |= Q(region__contains=search)
-            #     # q_objects |= Q(address_region__contains=search)
-            #     # q_objects |= Q(country__contains=search)
-            #     state = self.request.query_params.get('state')
-            #     city = self.request.query_params.get('city')
-            #
-            #     if state:
-            #         queryset = queryset.filter(state=state)
-            #
-            #     if city:
-            #         queryset = queryset.filter(city=city)
-
-            if materials:
-                if queryset:
-                    queryset = queryset\
-                        .filter(materials_collected__in=materials)
-        else:
-            queryset = Catador.objects.all()
+        queryset = Catador.objects.all()
 
+        # Deactivated catadores keep their own detail routes
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.filter(active=True)
+
+        if materials:
+            queryset = queryset\
+                .filter(materials_collected__in=materials).distinct()
+
+        if search:
+            queryset = order_by_pks(queryset,
+                                    search_index.search(Catador, search))
+
+        # Bairro tagged by the gazetteer (see /api/regions/)
+        region = self.request.query_params.get('region')
+        if region:
+            try:
+                region = int(region)
+            except ValueError:
+                raise ValidationError('region deve ser o id de um bairro')
+            queryset = queryset.filter(last_position__region_id=region)
+
+        queryset = self.filter_by_position(queryset)
+
+        # Detail routes that write would read stale prefetched relations
+        if self.action in ('list', 'retrieve'):
+            queryset = CatadorSerializer.setup_eager_loading(
+                queryset, CatadorSerializer.rendered_fields(self.request))
         return queryset
 
+    def filter_by_position(self, queryset):
+        """
+        Filter by position and sort by distance:
+            ?lat=<lat>&lon=<lon>&radius_km=<km>
+            ?bbox=<min_lon>,<min_lat>,<max_lon>,<max_lat>
+
+        Candidates are narrowed with indexed geohash prefix and range
+        queries on the current positions (CatadorLastPosition) before
+        computing the exact distances; the POSITION_MAX_RESULTS nearest are
+        returned.
+        """
+        params = self.request.query_params
+        lat = params.get('lat')
+        lon = params.get('lon')
+        radius = params.get('radius_km')
+        bbox = params.get('bbox')
+
+        has_center = bool(lat and lon)
+
+        if not bbox and not (has_center and radius):
+            return queryset
+
+        try:
+            if has_center:
+                lat, lon = float(lat), float(lon)
+            if radius:
+                radius = float(radius)
+        except ValueError:
+            raise ValidationError('Use lat=<lat>&lon=<lon>&radius_km=<km>')
+
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = parse_bbox(bbox)
+
+        positions = CatadorLastPosition.objects.filter(catador__in=queryset)
+
+        if bbox:
+            positions = positions.filter(
+                latitude__range=(min_lat, max_lat),
+                longitude__range=(min_lon, max_lon))
+
+            if not has_center:
+                lat = (min_lat + max_lat) / 2.0
+                lon = (min_lon + max_lon) / 2.0
+
+        if has_center and radius:
+            box_min_lat, box_max_lat, box_min_lon, box_max_lon = \
+                bounding_box(lat, lon, radius)
+            positions = positions.filter(
+                cells_q(covering_cells(lat, lon, radius), 'geohash'),
+                latitude__range=(box_min_lat, box_max_lat),
+                longitude__range=(box_min_lon, box_max_lon))
+
+        ids, lats, lons = load_positions(positions.order_by('pk'))
+        dist = haversine_km(lat, lon, lats, lons)
+
+        if has_center and radius:
+            inside = dist <= radius
+            ids, dist = ids[inside], dist[inside]
+
+        max_results = getattr(settings, 'POSITION_MAX_RESULTS', 500)
+        ids = ids[np.argsort(dist, kind='mergesort')][:max_results]
+        return order_by_pks(Catador.objects.all(), ids)
+
     @detail_route(methods=['POST', 'OPTIONS'], permission_classes=[AllowAny])
     def add(self, request):
         print(request.data)
@@ -242,24 +541,115 @@ class CatadorViewSet(viewsets.ModelViewSet):
     @detail_route(methods=['GET', 'POST'], permission_classes=[])
     def georef(self, request, pk=None):
         """
-        Get all geolocation from one Catador
+        Get all geolocation from one Catador, followed by its current
+        position when it came from a ping
+        POST {"latitude": .., "longitude": ..} moves the current position
+        of the catador (a ping of the track store, see track)
         :param request:
         :param pk:
         :return:
         """
+        catador = self.get_object()
+
         if request.method == 'POST':
-            data = request.data
-            georeference = LatitudeLongitude.objects.create(
-                latitude=data.get('latitude'),
-                longitude=data.get('longitude'))
+            if catador.user != request.user:
+                return Response('Apenas o próprio catador pode enviar sua posição',
+                                status=status.HTTP_403_FORBIDDEN)
 
-            GeorefCatador.objects.create(
-                georef=georeference, catador=self.get_object())
+            try:
+                point = (timezone.now(), float(request.data['latitude']),
+                         float(request.data['longitude']))
+                if not (-90 <= point[1] <= 90 and -180 <= point[2] <= 180):
+                    raise ValueError(point)
+            except (KeyError, TypeError, ValueError):
+                raise ValidationError('Informe latitude e longitude válidas')
+
+            record_points(catador, [point])
+            return Response({'latitude': point[1], 'longitude': point[2]},
+                            status=status.HTTP_201_CREATED)
+
+        data = LatitudeLongitudeSerializer(catador.geolocation, many=True).data
+        last = CatadorLastPosition.objects.filter(
+            catador=catador, track__isnull=False).first()
+        if last is not None:
+            data.append({'latitude': last.latitude,
+                         'longitude': last.longitude,
+                         'reverse_geocoding': None})
+
+        return Response(data)
+
+    @detail_route(methods=['GET', 'POST'], permission_classes=[IsAuthenticated])
+    def track(self, request, pk=None):
+        """
+        Location pings of the catador, stored in the compact track store.
 
-        serializer = LatitudeLongitudeSerializer(
-            self.get_object().geolocation, many=True)
+        POST {"latitude": .., "longitude": .., "timestamp": ..} or
+             {"points": [{"latitude": .., "longitude": .., "timestamp": ..}]}
+             timestamp (ISO 8601) is optional, defaults to now.
+        GET  ?day=YYYY-MM-DD (defaults to today), only for the catador
+             and the staff
+        """
+        catador = self.get_object()
 
-        return Response(serializer.data)
+        if request.method == 'GET' and catador.user != request.user and \
+                not request.user.is_staff:
+            return Response('Apenas o próprio catador pode ver seu trajeto',
+                            status=status.HTTP_403_FORBIDDEN)
+
+        if request.method == 'POST':
+            if catador.user != request.user:
+                return Response('Apenas o próprio catador pode enviar sua posição',
+                                status=status.HTTP_403_FORBIDDEN)
+
+            data = request.data
+            pings = data.get('points') if 'points' in data else [data]
+            max_points = getattr(settings, 'TRACK_MAX_POINTS', 500)
+            if not isinstance(pings, list):
+                raise ValidationError('points deve ser uma lista')
+            if len(pings) > max_points:
+                raise ValidationError(
+                    'Máximo de %d pontos por requisição' % max_points)
+            points = []
+
+            try:
+                for ping in pings:
+                    moment = ping.get('timestamp')
+                    moment = parse_datetime(moment) if moment else timezone.now()
+                    if moment is None:
+                        raise ValueError(ping.get('timestamp'))
+                    if timezone.is_naive(moment):
+                        moment = timezone.make_aware(moment)
+                    points.append((moment, float(ping['latitude']),
+                                   float(ping['longitude'])))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                raise ValidationError(
+                    'Informe latitude, longitude e timestamp (ISO 8601)')
+
+            record_points(catador, points)
+            return Response({'recorded': len(points)},
+                            status=status.HTTP_201_CREATED)
+
+        day = request.query_params.get('day')
+        day = parse_date(day) if day else timezone.localtime(timezone.now()).date()
+        if day is None:
+            raise ValidationError('day deve ser YYYY-MM-DD')
+
+        track = CatadorTrack.objects.filter(catador=catador, day=day).first()
+
+        last = None
+        if hasattr(catador, 'last_position'):
+            last = {
+                'latitude': catador.last_position.latitude,
+                'longitude': catador.last_position.longitude,
+                'recorded_on': catador.last_position.recorded_on,
+            }
+
+        return Response({
+            'last_position': last,
+            'day': day,
+            'downsampled': track.downsampled if track else False,
+            'points': track_points(track) if track else [],
+        })
 
     @detail_route(methods=['GET', 'POST', 'DELETE', 'OPTIONS'],
                   permission_classes=[IsAuthenticated])
@@ -736,6 +1126,264 @@ def get_docs(request, doc):
         return response
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def reverse_geocoding(request):
+    """
+        /api/reverse_geocoding/?lat=<lat>&lon=<lon>
+        Address of the point, served from the reverse geocoding cache
+    """
+    try:
+        latitude = float(request.query_params.get('lat'))
+        longitude = float(request.query_params.get('lon'))
+    except (TypeError, ValueError):
+        return Response('lat e lon são obrigatórios',
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    if not valid_coordinates(latitude, longitude):
+        return Response('lat deve estar entre -90 e 90 e lon entre -180 e 180',
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        address = reverse_geocode(latitude, longitude)
+    except GeocodingError:
+        return Response('Serviço de endereços indisponível',
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    return Response({'latitude': latitude, 'longitude': longitude,
+                     'reverse_geocoding': address})
+
+
+@api_view(['GET'])
+def heatmap(request):
+    """
+        /api/heatmap/?bbox=<min_lon>,<min_lat>,<max_lon>,<max_lat>
+            &start=<YYYY-MM-DD>&end=<YYYY-MM-DD>&kind=<residue|collect>
+            &status=<status>
+        Counts per grid cell, summed over the date range
+    """
+    params = request.query_params
+    cells = HeatmapCell.objects.filter(kind=params.get('kind', 'residue'))
+
+    if params.get('bbox'):
+        min_lon, min_lat, max_lon, max_lat = parse_bbox(params['bbox'])
+        cells = cells.filter(latitude__range=(min_lat, max_lat),
+                             longitude__range=(min_lon, max_lon))
+
+    for param, lookup in (('start', 'day__gte'), ('end', 'day__lte')):
+        if params.get(param):
+            day = parse_date(params[param])
+            if day is None:
+                raise ValidationError('%s deve ser YYYY-MM-DD' % param)
+            cells = cells.filter(**{lookup: day})
+
+    if params.get('status'):
+        cells = cells.filter(status=params['status'])
+
+    rows = cells.values('cell', 'latitude', 'longitude')\
+        .annotate(count=Sum('count')).order_by('cell')
+
+    return Response([{'latitude': row['latitude'],
+                      'longitude': row['longitude'],
+                      'count': row['count']} for row in rows])
+
+
+# Objects sent by the changes feed: (queryset, serializer). Objects logged
+# but no longer in the queryset are sent as deleted.
+SYNCED_MODELS = {
+    'Catador': (lambda: Catador.objects.filter(active=True), CatadorSerializer),
+    'Cooperative': (lambda: Cooperative.objects.all(), CooperativeSerializer),
+    'Material': (lambda: Material.objects.all(), MaterialSerializer),
+}
+
+
+@api_view(['GET'])
+def changes(request):
+    """
+        /api/changes/?since=<seq>&limit=<n>
+        Objects changed after `seq`, oldest first, at most once each with
+        their current data. Clients sync again from the returned `seq`
+        while `more` is true. Without `since` only the current `seq` is
+        returned, to be read before the first full download. A `since`
+        older than the log keeps gets a 410: download everything again.
+    """
+    log = ChangeNotificaion.committed().filter(model_type__in=SYNCED_MODELS)
+    since = request.query_params.get('since')
+
+    if since is None:
+        seq = log.aggregate(seq=Max('pk'))['seq'] or 0
+        return Response({'seq': seq, 'more': False, 'changes': []})
+
+    try:
+        since = int(since)
+        limit = min(int(request.query_params.get(
+            'limit', getattr(settings, 'CHANGES_PAGE_SIZE', 500))),
+            getattr(settings, 'CHANGES_MAX_PAGE_SIZE', 1000))
+    except ValueError:
+        raise ValidationError('since e limit devem ser inteiros')
+    if limit < 1:
+        raise ValidationError('limit deve ser positivo')
+
+    if not ChangeNotificaion.kept_since(since):
+        return Response({'detail': 'Alterações antigas removidas, '
+                                   'faça a sincronização completa',
+                         'resync': True}, status=status.HTTP_410_GONE)
+
+    rows = list(log.filter(pk__gt=since).order_by('pk')
+                .values_list('pk', 'model_type', 'model_pk')[:limit + 1])
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    # Keep the last entry of each object
+    latest = {}
+    for seq, model_type, model_pk in rows:
+        latest[(model_type, model_pk)] = seq
+
+    pks = {}
+    for model_type, model_pk in latest:
+        pks.setdefault(model_type, []).append(model_pk)
+
+    data = {}
+    for model_type, model_pks in pks.items():
+        queryset, serializer_class = SYNCED_MODELS[model_type]
+        queryset = queryset().filter(pk__in=model_pks)
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            queryset = serializer_class.setup_eager_loading(
+                queryset, serializer_class.rendered_fields(request))
+        for obj in queryset:
+            data[(model_type, obj.pk)] = serializer_class(
+                obj, context={'request': request}).data
+
+    result = []
+    for (model_type, model_pk), seq in sorted(latest.items(),
+                                              key=lambda item: item[1]):
+        item = data.get((model_type, model_pk))
+        result.append({
+            'seq': seq,
+            'type': model_type.lower(),
+            'id': model_pk,
+            'action': ChangeNotificaion.SAVE if item is not None
+            else ChangeNotificaion.DELETE,
+            'data': item,
+        })
+
+    return Response({'seq': rows[-1][0] if rows else since, 'more': more,
+                     'changes': result})
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(value, size):
+    """
+    (first, last) byte of a single range header, None when it can't be
+    satisfied.
+    """
+    match = RANGE_RE.match(value.strip())
+    if match is None or not any(match.groups()):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first = int(first)
+        last = min(int(last), size - 1) if last else size - 1
+
+    if first > last or first >= size:
+        return None
+    return first, last
+
+
+@require_safe
+def map_snapshot(request):
+    """
+        /api/map/snapshot/
+        Every public marker of the map from the prebuilt snapshot (see
+        api/snapshot.py and the build_map_snapshot command), brotli or gzip
+        encoded when accepted, with ETag and Range support. Requests never
+        build it: 503 until the command wrote the first one.
+    """
+    accepted = [part.split(';')[0].strip()
+                for part in request.META.get('HTTP_ACCEPT_ENCODING', '')
+                .split(',')]
+    path, encoding = snapshot.snapshot_path(), None
+    for name, suffix in snapshot.ENCODINGS:
+        if name in accepted and os.path.exists(snapshot.snapshot_path(suffix)):
+            path, encoding = snapshot.snapshot_path(suffix), name
+            break
+
+    try:
+        snapshot_file = open(path, 'rb')
+    except IOError:
+        response = HttpResponse('Mapa ainda não gerado',
+                                status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response['Retry-After'] = '60'
+        return response
+
+    stat = os.fstat(snapshot_file.fileno())
+    size = stat.st_size
+    etag = quote_etag('%x-%x-%s' % (stat.st_mtime_ns, size,
+                                    encoding or 'identity'))
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None and (
+            if_none_match.strip() == '*' or
+            etag in [quote_etag(e) for e in parse_etags(if_none_match)]):
+        snapshot_file.close()
+        response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        byte_range = None
+        range_header = request.META.get('HTTP_RANGE')
+        # A range of an older snapshot can't be mixed with this one
+        if range_header and request.META.get('HTTP_IF_RANGE', etag) == etag:
+            byte_range = parse_range(range_header, size)
+            if byte_range is None:
+                snapshot_file.close()
+                response = HttpResponse(
+                    status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                response['Content-Range'] = 'bytes */%d' % size
+                return response
+
+        if byte_range is None:
+            response = FileResponse(snapshot_file,
+                                    content_type='application/json')
+            response['Content-Length'] = size
+        else:
+            first, last = byte_range
+            with snapshot_file:
+                snapshot_file.seek(first)
+                content = snapshot_file.read(last - first + 1)
+            response = HttpResponse(content, content_type='application/json',
+                                    status=status.HTTP_206_PARTIAL_CONTENT)
+            response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def batch(request):
+    """
+        /api/batch/ (POST)
+        {"operations": [...]} run in one transaction (see api/batch.py).
+        Returns the pks of the temporary ids and the residues written.
+    """
+    try:
+        result = Batch(request).run(request.data.get('operations'))
+    except BatchError as error:
+        return Response({'index': error.index, 'detail': error.detail},
+                        status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_201_CREATED)
+
+
 @api_view(['POST'])
 def add_statistic(request):
     # data = request.data['statistic']
@@ -788,12 +1436,51 @@ class CollectViewSet(viewsets.ModelViewSet):
         api/accept_collet/ (POST, GET)
         api/photo_catador/ (POST, GET)
         api/photo_user/ (POST, GET)
+        api/collect/assign/ (POST, admin)
+        api/collect/route/ (GET)
     """
     serializer_class = CollectSerializer
     permission_classes = (IsAuthenticated,)
     queryset = Collect.objects.filter()
     http_method_names = ['get', 'options', 'post']
 
+    @list_route(methods=['POST'], permission_classes=[IsAdminUser])
+    def assign(self, request):
+        """
+        Assign every open collect to the nearest available catador
+        """
+        data = request.data
+        try:
+            capacity = int(data.get('capacity', DEFAULT_CAPACITY))
+            max_distance = float(data.get('max_distance', MAX_DISTANCE_KM))
+        except (TypeError, ValueError):
+            raise ValidationError('capacity e max_distance devem ser números')
+
+        # "false" and "0" from form data are False
+        dry_run = serializers.BooleanField().to_internal_value(
+            data.get('dry_run', False))
+
+        result = assign_open_collects(capacity, max_distance, dry_run=dry_run)
+        return Response(result)
+
+    @list_route(methods=['GET'])
+    def route(self, request):
+        """
+        Visiting order of the catador's accepted collects. Admins may pass
+        ?catador=<id>.
+        """
+        catador_id = request.query_params.get('catador')
+        if catador_id is not None and request.user.is_staff:
+            try:
+                catador_id = int(catador_id)
+            except ValueError:
+                raise ValidationError('catador deve ser um número inteiro')
+        else:
+            catador = get_object_or_404(Catador, user=request.user)
+            catador_id = catador.pk
+
+        return Response(collect_route(catador_id))
+
     @detail_route(methods=['POST'])
     def accept_collect(self, request, pk):
         collect = self.get_object()
@@ -903,6 +1590,13 @@ class ResidueViewSet(RecoBaseView, viewsets.ModelViewSet):
     search_fields = ['id', 'description', 'user']
     http_method_names = ['get', 'post', 'update', 'options', 'patch']
 
+    def get_queryset(self):
+        queryset = super(ResidueViewSet, self).get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = ResidueSerializer.setup_eager_loading(
+                queryset, ResidueSerializer.rendered_fields(self.request))
+        return queryset
+
     @detail_route(methods=['GET', 'POST'],
                   permission_classes=[IsObjectOwner])
     def photos(self, request, pk=None):
@@ -944,8 +1638,11 @@ class ResidueViewSet(RecoBaseView, viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class PartnerViewSet(viewsets.ModelViewSet):
+class PartnerViewSet(VersionedCacheMixin, CompiledListMixin,
+                     viewsets.ModelViewSet):
     serializer_class = PartnerSerializer
+    compiled_serializer_class = PartnerCompiledSerializer
+    cache_models = (Partner,)
     queryset = Partner.objects.all()
     filter_backends = (SearchFilter,)
     search_fields = ['^name']
@@ -955,12 +1652,11 @@ class PartnerViewSet(viewsets.ModelViewSet):
     # authentication_classes = []
 
 
-class CooperativeViewSet(viewsets.ModelViewSet):
-    # pagination_class = PostLimitOffSetPagination
+class CooperativeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetPagination
     serializer_class = CooperativeSerializer
     queryset = Cooperative.objects.all()
-    filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['name', 'email', 'id']
+    filter_backends = [OrderingFilter]
     ordering_fields = ['name', 'email', 'id']
     http_method_names = ['get', 'post', 'update', 'patch', 'options', 'delete']
     permission_classes = (AllowAny,)
@@ -972,45 +1668,37 @@ class CooperativeViewSet(viewsets.ModelViewSet):
     #
     #     return super(self).get_permissions()
 
+    def paginate_queryset(self, queryset):
+        # Search results are ranked and bounded by SEARCH_MAX_RESULTS
+        if self.request.query_params.get('search'):
+            return None
+        return super(CooperativeViewSet, self).paginate_queryset(queryset)
+
     def get_queryset(self):
         """
         Adding custom filter by params.
         :return:
         """
 
-        # Filter by 'search' will search in (name, email, phrase)
+        # Filter by 'search' will search in
+        # (name, endereço (rua, bairro, cidade, estado), material)
+        # ranked by the search index (see api/search.py)
         search = self.request.query_params.get('search', None)
-        filter_by_name = self.request.query_params.get('name', False)
-        # filter_by_address = self.request.query_params.get('address', False)
         materials = self.request.query_params.getlist('materials')
 
-        if search is not None or materials:
-            q_objects = Q()
-
-            if search is not None and filter_by_name:
-                q_objects |= Q(name__contains=search)
-
-            queryset = Cooperative.objects.filter(q_objects)
-
-            # if filter_by_address:
-            #     # q_objects |= Q(address_region__contains=search)
-            #     # q_objects |= Q(country__contains=search)
-            #     state = self.request.query_params.get('state')
-            #     city = self.request.query_params.get('city')
-            #
-            #     if state:
-            #         queryset = queryset.filter(state=state)
-            #
-            #     if city:
-            #         queryset = queryset.filter(city=city)
-
-            if materials:
-                if queryset:
-                    queryset = queryset\
-                        .filter(materials_collected__in=materials)
-        else:
-            queryset = Cooperative.objects.all()
+        queryset = Cooperative.objects.all()
+
+        if materials:
+            queryset = queryset\
+                .filter(materials_collected__in=materials).distinct()
+
+        if search:
+            queryset = order_by_pks(queryset,
+                                    search_index.search(Cooperative, search))
 
+        if self.action in ('list', 'retrieve'):
+            queryset = CooperativeSerializer.setup_eager_loading(
+                queryset, CooperativeSerializer.rendered_fields(self.request))
         return queryset
 
     @csrf_exempt
@@ -1076,8 +1764,11 @@ class CooperativeViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class MaterialsViewSet(RecoBaseView, viewsets.ModelViewSet):
+class MaterialsViewSet(VersionedCacheMixin, CompiledListMixin, RecoBaseView,
+                       viewsets.ModelViewSet):
     serializer_class = MaterialSerializer
+    compiled_serializer_class = MaterialCompiledSerializer
+    cache_models = (Material,)
     queryset = Material.objects.all()
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['name', 'id']
@@ -1085,9 +1776,106 @@ class MaterialsViewSet(RecoBaseView, viewsets.ModelViewSet):
     http_method_names = ['get', 'options']
 
 
-class NearestCatadoresViewSet(viewsets.ModelViewSet):
+class RegionViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+        Bairros loaded from the gazetteer, used by ?region= filters
+    """
+    serializer_class = RegionSerializer
+    queryset = Region.objects.all()
+    filter_backends = [SearchFilter]
+    search_fields = ['name', 'city']
+    permission_classes = (AllowAny,)
+
+
+class NearestCatadoresViewSet(CompiledListMixin, viewsets.ModelViewSet):
+    """
+        /api/nearest-catadores/
+        /api/nearest-catadores/?zoom=<zoom>&bbox=<bbox> (clusters)
+        /api/nearest-catadores/batch/ (POST)
+    """
     serializer_class = CatadorsPositionsSerializer
-    queryset = Catador.objects.all()
+    compiled_serializer_class = CatadorPositionsCompiledSerializer
+    queryset = Catador.objects.order_by('pk')
+
+    MAX_BATCH_POINTS = 5000
+    MAX_BATCH_K = 50
+
+    def list(self, request, *args, **kwargs):
+        """
+        With ?zoom= returns the map clusters (centroid + count) of the
+        visible area instead of every catador position.
+        """
+        zoom = request.query_params.get('zoom')
+        if zoom is None:
+            return super(NearestCatadoresViewSet, self).list(
+                request, *args, **kwargs)
+
+        try:
+            zoom = int(zoom)
+        except ValueError:
+            raise ValidationError('zoom deve ser um número inteiro')
+
+        bbox = request.query_params.get('bbox')
+        if bbox:
+            bbox = parse_bbox(bbox)
+
+        return Response(catador_clusters.clusters(zoom, bbox))
+
+    @list_route(methods=['POST'])
+    def batch(self, request):
+        """
+        Nearest catadores for many points in one request.
+
+        {"points": [{"latitude": -23.55, "longitude": -46.63}, ...],
+         "materials": [1, 2],  (optional)
+         "k": 3}               (optional)
+
+        All catador positions are loaded once and the whole
+        point x catador distance matrix is computed in chunks.
+        """
+        data = request.data
+        points = data.get('points') or []
+        materials = data.get('materials') or []
+
+        try:
+            k = int(data.get('k', 3))
+            coords = [(float(p['latitude']), float(p['longitude']))
+                      for p in points]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(
+                'points deve ser uma lista de {latitude, longitude}')
+
+        if not 0 < k <= self.MAX_BATCH_K:
+            raise ValidationError('k deve estar entre 1 e %d' % self.MAX_BATCH_K)
+
+        if len(coords) > self.MAX_BATCH_POINTS:
+            raise ValidationError(
+                'Máximo de %d pontos por requisição' % self.MAX_BATCH_POINTS)
+
+        try:
+            materials = [int(material) for material in materials]
+        except (TypeError, ValueError):
+            raise ValidationError('materials deve ser uma lista de ids')
+
+        positions = CatadorLastPosition.objects.filter(catador__active=True)
+        if materials:
+            positions = positions.filter(
+                catador__in=Catador.objects.filter(
+                    materials_collected__in=materials))
+
+        ids, lats, lons = load_positions(positions.order_by('pk'))
+        nearest = batch_k_nearest(coords, ids, lats, lons, k=k)
+
+        result = []
+        for (latitude, longitude), catadores in zip(coords, nearest):
+            result.append({
+                'latitude': latitude,
+                'longitude': longitude,
+                'catadores': [{'id': catador_id, 'distance_km': distance}
+                              for catador_id, distance in catadores]
+            })
+
+        return Response(result)
 
 
 class CustomObtainAuthToken(ObtainAuthToken):
@@ -1,5 +1,6 @@
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
+import tempfile
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -136,6 +137,83 @@ SERVE_STATIC_FILES = True
 
 AUTH_PROFILE_MODULE = 'api.models.UserProfile'
 
+# Seconds before the in-memory position indexes are reloaded from the db
+SPATIAL_INDEX_MAX_AGE = 300
+
+# GeoJSON with the bairros used to tag LatitudeLongitude.region
+# (python manage.py load_regions <file>)
+REGIONS_GEOJSON = None
+REGIONS_GEOJSON_ID_PROPERTY = 'id'
+
+# Reverse geocoding (api/geocoding.py). Use
+# 'api.geocoding.GeopyReverseGeocoder' to resolve with OpenStreetMap
+REVERSE_GEOCODING_PROVIDER = 'api.geocoding.StubReverseGeocoder'
+REVERSE_GEOCODING_PRECISION = 4
+REVERSE_GEOCODING_CACHE_SIZE = 10000
+# Seconds an unknown address is remembered before asking the provider again
+REVERSE_GEOCODING_EMPTY_TIMEOUT = 3600
+
+# Seconds a catador's collect route stays cached (it is recomputed anyway
+# when the set of collects changes)
+COLLECT_ROUTE_CACHE_TIMEOUT = 86400
+
+# Geohash length of the heatmap grid cells (6 ~ 1.2 x 0.6 km)
+HEATMAP_PRECISION = 6
+
+# 'responses' must be shared by every process (memcached or redis in
+# production): the response cache is disabled on a per-process backend.
+# The tests run on a temporary copy (see api/tests/runner.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'app_site_responses'),
+    },
+}
+
+TEST_RUNNER = 'api.tests.runner.TestRunner'
+
+# Cache alias, timeout (seconds) and in-process LRU size of the versioned
+# response cache used by the catalog endpoints (materials, partners)
+RESPONSE_CACHE = 'responses'
+RESPONSE_CACHE_TIMEOUT = 3600
+RESPONSE_CACHE_SIZE = 1000
+
+# Default and maximum number of log entries read per /api/changes/ request
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 1000
+# Seconds before a log entry is handed out (longer transactions may be
+# skipped) and days it is kept (prune_changes)
+CHANGES_COMMIT_LAG = 30
+CHANGES_RETENTION_DAYS = 30
+
+# Directory of the prebuilt map markers snapshot (build_map_snapshot)
+MAP_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots')
+
+# Maximum number of operations of a /api/batch/ request
+BATCH_MAX_OPERATIONS = 100
+
+# Pings accepted by one POST to /catadores/<pk>/track
+TRACK_MAX_POINTS = 500
+
+# Seconds between two change log entries of a catador that keeps moving
+POSITION_LOG_INTERVAL = 300
+
+# Catadores returned by the radius/bbox filters, nearest first
+POSITION_MAX_RESULTS = 500
+
+# Full-text search (api/search.py): backend class path (None picks it from
+# the database vendor), Postgres text search configuration and maximum
+# number of ranked results
+SEARCH_BACKEND = None
+SEARCH_CONFIG = 'portuguese'
+SEARCH_MAX_RESULTS = 100
+
+# Memory (MB) each chunk of a point x catador distance matrix may use
+DISTANCE_MATRIX_BUDGET_MB = 64
+
 # KEEP THIS FOR TRAVIS
 DATABASES = {
     'default': {